@@ -0,0 +1,69 @@
+from decimal import Decimal
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+from recipes.models import Recipe
+from .models import Rating
+
+
+def apply_rating_delta(recipe_id, sum_delta, count_delta):
+    """
+    Shifts a recipe's rating aggregates in a single UPDATE. The new average is computed from the
+    row's current values in the same statement, so concurrent ratings never overwrite each other
+    """
+    if not sum_delta and not count_delta:
+        return
+
+    new_sum = F("rating_sum") + Value(Decimal(sum_delta))
+    new_count = F("rating_count") + Value(count_delta)
+
+    Recipe.objects.filter(pk=recipe_id).update(
+        rating_sum=new_sum,
+        rating_count=new_count,
+        avg_rating=Case(
+            When(rating_count__gt=-count_delta, then=Cast(new_sum, FloatField()) / Cast(new_count, FloatField())),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ),
+    )
+
+
+def contribution(recipe_id, rating):
+    """What a single rating adds to its recipe's aggregates, as (recipe_id, sum, count)"""
+    if recipe_id is None or rating is None:
+        return recipe_id, Decimal(0), 0
+    return recipe_id, Decimal(str(rating)), 1
+
+
+def actual_aggregates():
+    """Subqueries recomputing sum, count and average of a recipe from its ratings"""
+    ratings = Rating.objects.filter(recipe=OuterRef("pk"), rating__isnull=False).order_by().values("recipe")
+
+    return {
+        "rating_sum": Coalesce(Subquery(ratings.annotate(total=Sum("rating")).values("total")), Value(Decimal(0))),
+        "rating_count": Coalesce(Subquery(ratings.annotate(total=Count("pk")).values("total")), Value(0)),
+        "avg_rating": Coalesce(
+            Subquery(ratings.annotate(total=Cast(Sum("rating"), FloatField()) / Count("pk")).values("total")),
+            Value(0.0),
+        ),
+    }
+
+
+def refresh_rating_aggregates(recipe_ids=None):
+    """
+    Recomputes the stored aggregates from the ratings table, for the given recipes or all of them.
+    Only recipes whose stored values drifted are written. Returns how many were fixed
+    """
+    queryset = Recipe.objects.all()
+    if recipe_ids is not None:
+        queryset = queryset.filter(pk__in=recipe_ids)
+
+    aggregates = actual_aggregates()
+    drifted = list(
+        queryset.annotate(actual_sum=aggregates["rating_sum"], actual_count=aggregates["rating_count"])
+        .exclude(rating_sum=F("actual_sum"), rating_count=F("actual_count"))
+        .values_list("pk", flat=True)
+    )
+    if drifted:
+        Recipe.objects.filter(pk__in=drifted).update(**aggregates)
+
+    return len(drifted)
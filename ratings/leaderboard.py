@@ -0,0 +1,154 @@
+from itertools import islice
+import redis
+from django.conf import settings
+from recipes.models import Recipe
+
+# Top-rated recipes as Redis sorted sets scored by Bayesian average, one over all listed recipes
+# and one per category and diet, so the top N is a single ZREVRANGE. MEAN_KEY holds the mean
+# rating over all recipes the last rebuild found, the prior new scores are pulled towards
+ALL_KEY = "leaderboard:all"
+CATEGORY_KEY = "leaderboard:category:{}"
+DIET_KEY = "leaderboard:diet:{}"
+MEAN_KEY = "leaderboard:mean"
+BUILD_KEY = "leaderboard:build:{}"
+LOCK_KEY = "leaderboard:rebuild_lock"
+
+# Seconds a rebuild may hold the lock before it is taken as crashed
+REBUILD_TIMEOUT = 600
+
+BATCH_SIZE = 5000
+
+_client = None
+
+
+def get_client():
+    global _client
+
+    if _client is None:
+        _client = redis.Redis.from_url(settings.LEADERBOARD_REDIS_URL)
+    return _client
+
+
+def score(rating_sum, rating_count, mean):
+    """
+    Average rating pulled towards the mean by LEADERBOARD_PRIOR_WEIGHT phantom ratings,
+    so a single 5 doesn't outrank a recipe rated 4.5 by dozens
+    """
+    weight = settings.LEADERBOARD_PRIOR_WEIGHT
+    return (weight * mean + float(rating_sum)) / (weight + rating_count)
+
+
+def all_keys():
+    return (
+        [ALL_KEY]
+        + [CATEGORY_KEY.format(value) for value, _ in Recipe.CATEGORY_CHOICES]
+        + [DIET_KEY.format(value) for value, _ in Recipe.DIET_CHOICES]
+    )
+
+
+def key_for(category=None, diet=None):
+    if category:
+        return CATEGORY_KEY.format(category)
+    if diet:
+        return DIET_KEY.format(diet)
+    return ALL_KEY
+
+
+def keys_of(categories, diets):
+    """The leaderboards a recipe with these categories and diets is ranked on"""
+    keys = [ALL_KEY]
+    keys += [CATEGORY_KEY.format(value) for value in categories or [] if value != "none"]
+    keys += [DIET_KEY.format(value) for value in diets or [] if value != "none"]
+    return keys
+
+
+def ranked_rows(recipe_ids=None):
+    """(id, categories, diets, rating sum, rating count) of listed recipes with at least one rating"""
+    recipes = Recipe.objects.filter(duplicate_of__isnull=True, rating_count__gt=0)
+    if recipe_ids is not None:
+        recipes = recipes.filter(pk__in=recipe_ids)
+    return recipes.order_by().values_list("id", "category", "diet", "rating_sum", "rating_count")
+
+
+def update(recipe_ids):
+    """
+    Re-scores recipes whose ratings changed, in one round trip. Recipes no longer listed or rated
+    leave every board. Call once the new aggregates are committed
+    """
+    recipe_ids = set(recipe_ids)
+    if not recipe_ids:
+        return
+
+    client = get_client()
+    mean = client.get(MEAN_KEY)
+    if mean is None:
+        # Nothing ranked yet, a rebuild scores these recipes against the actual mean
+        rebuild()
+        return
+    mean = float(mean)
+    keys = all_keys()
+
+    pipeline = client.pipeline(transaction=False)
+    for recipe_id, categories, diets, rating_sum, rating_count in ranked_rows(recipe_ids):
+        recipe_ids.discard(recipe_id)
+        ranked = keys_of(categories, diets)
+        for key in ranked:
+            pipeline.zadd(key, {recipe_id: score(rating_sum, rating_count, mean)})
+        # Categories and diets may have changed since the recipe was last ranked
+        for key in set(keys) - set(ranked):
+            pipeline.zrem(key, recipe_id)
+
+    for recipe_id in recipe_ids:
+        for key in keys:
+            pipeline.zrem(key, recipe_id)
+    pipeline.execute()
+
+
+def rebuild():
+    """
+    Rebuilds every leaderboard from the stored rating aggregates and recomputes the mean prior.
+    Boards are filled under build keys and renamed in one transaction, so readers never see a
+    partial board. Returns the number of recipes ranked
+    """
+    client = get_client()
+    # One rebuild at a time, concurrent ones would fill the same build keys
+    with client.lock(LOCK_KEY, timeout=REBUILD_TIMEOUT):
+        totals = [0.0, 0]
+        for rating_sum, rating_count in ranked_rows().values_list("rating_sum", "rating_count").iterator(chunk_size=10000):
+            totals[0] += float(rating_sum)
+            totals[1] += rating_count
+        mean = totals[0] / totals[1] if totals[1] else 0.0
+
+        keys = all_keys()
+        client.delete(*(BUILD_KEY.format(key) for key in keys))
+
+        built, ranked = set(), 0
+        rows = ranked_rows().iterator(chunk_size=10000)
+        while batch := list(islice(rows, BATCH_SIZE)):
+            boards = {}
+            for recipe_id, categories, diets, rating_sum, rating_count in batch:
+                for key in keys_of(categories, diets):
+                    boards.setdefault(key, {})[recipe_id] = score(rating_sum, rating_count, mean)
+
+            pipeline = client.pipeline(transaction=False)
+            for key, members in boards.items():
+                pipeline.zadd(BUILD_KEY.format(key), members)
+            pipeline.execute()
+            built.update(boards)
+            ranked += len(batch)
+
+        pipeline = client.pipeline(transaction=True)
+        for key in keys:
+            if key in built:
+                pipeline.rename(BUILD_KEY.format(key), key)
+            else:
+                pipeline.delete(key)
+        pipeline.set(MEAN_KEY, mean)
+        pipeline.execute()
+        return ranked
+
+
+def top(limit, category=None, diet=None):
+    """The best ranked recipes of a leaderboard as (recipe id, score) pairs, best first"""
+    entries = get_client().zrevrange(key_for(category, diet), 0, limit - 1, withscores=True)
+    return [(int(recipe_id), value) for recipe_id, value in entries]
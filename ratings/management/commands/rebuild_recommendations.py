@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from ratings.recommendations import rebuild_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Recompute rating-based recipe neighbours and user recommendations now, instead of waiting for the hourly task'
+
+    def handle(self, *args, **options):
+        recipes, users = rebuild_recommendations()
+        self.stdout.write(self.style.SUCCESS(f'Stored neighbours for {recipes} recipes and recommendations for {users} users'))
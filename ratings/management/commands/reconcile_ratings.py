@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from ratings import leaderboard
+from ratings.aggregates import refresh_rating_aggregates
+from recipes.models import Recipe
+
+class Command(BaseCommand):
+    help = 'Recompute the stored recipe rating aggregates from the ratings table and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Recipes checked per query')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = 0
+        fixed = 0
+        last_id = 0
+
+        while True:
+            ids = list(
+                Recipe.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+
+            fixed += refresh_rating_aggregates(ids)
+            checked += len(ids)
+            last_id = ids[-1]
+
+        # Scores come from the aggregates, so rank again once they are fixed
+        ranked = leaderboard.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} recipes, fixed {fixed}, ranked {ranked}'))
@@ -1,4 +1,5 @@
-from django.db import models
+from django.contrib.postgres.fields import ArrayField
+from django.db import models, transaction
 from recipes.models import Recipe
 from django.contrib.auth import get_user_model
 from django.core.validators import MaxValueValidator, MinValueValidator
@@ -23,5 +24,52 @@ class Rating(models.Model):
     class Meta:
         unique_together = ("author", "recipe")
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (recipe_id, rating) as last stored, so signals can apply the difference to the recipe
+        self._stored = (None, None)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored = (instance.__dict__.get("recipe_id"), instance.__dict__.get("rating"))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # The recipe aggregates are updated by a post_save receiver, commit both or neither
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.rating}"
+
+
+class RecipeRatingNeighbours(models.Model):
+    """
+    A recipe's most similar recipes by how the same users rated them, best first.
+    Rebuilt by ratings.tasks.rebuild_recommendations, see ratings.recommendations
+    """
+
+    recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE, primary_key=True, related_name="rating_neighbours")
+    neighbour_ids = ArrayField(models.BigIntegerField(), default=list)
+    scores = ArrayField(models.FloatField(), default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Rating neighbours of {self.recipe_id}"
+
+
+class UserRecommendations(models.Model):
+    """
+    Precomputed recommendations for a user, best first. because_ids holds, per recipe,
+    the rated recipe that contributed most to it
+    """
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="recommendations")
+    recipe_ids = ArrayField(models.BigIntegerField(), default=list)
+    scores = ArrayField(models.FloatField(), default=list)
+    because_ids = ArrayField(models.BigIntegerField(), default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Recommendations for {self.user_id}"
@@ -12,4 +12,4 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
             return True
 
         # Write permissions only for the owner
-        return obj.user == request.user
+        return obj.author == request.user
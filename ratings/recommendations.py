@@ -0,0 +1,168 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from .models import Rating, RecipeRatingNeighbours, UserRecommendations
+
+# Similarities backed by few co-raters are shrunk by co_raters / (co_raters + SHRINKAGE)
+SHRINKAGE = 10
+
+# Co-rated pairs collected before duplicates are summed up, bounds memory during the build
+PAIR_BUFFER = 5_000_000
+
+RATING_DTYPE = np.dtype([("user", np.int64), ("recipe", np.int64), ("rating", np.float32)])
+
+BATCH_SIZE = 5000
+
+
+def load_ratings():
+    """
+    Ratings of listed recipes as a structured array sorted by user, keeping each user's
+    newest RECOMMENDATION_MAX_USER_RATINGS so heavy raters don't dominate the pair count
+    """
+    rows = (
+        Rating.objects.filter(rating__isnull=False, recipe__duplicate_of__isnull=True)
+        .order_by("author_id", "-updated_at")
+        .values_list("author_id", "recipe_id", "rating")
+    )
+    data = np.fromiter(
+        ((user, recipe, float(rating)) for user, recipe, rating in rows.iterator(chunk_size=10000)),
+        dtype=RATING_DTYPE,
+    )
+
+    _, starts, inverse = np.unique(data["user"], return_index=True, return_inverse=True)
+    rank = np.arange(len(data)) - starts[inverse]
+    return data[rank < settings.RECOMMENDATION_MAX_USER_RATINGS]
+
+
+def user_groups(users):
+    """(start, end) of each user's rows in an array sorted by user"""
+    _, starts = np.unique(users, return_index=True)
+    ends = np.append(starts[1:], len(users))
+    return zip(starts.tolist(), ends.tolist())
+
+
+def sum_pairs(keys, products, counts):
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return keys, np.bincount(inverse, weights=products), np.bincount(inverse, weights=counts)
+
+
+def item_neighbours(items, ratings, users, item_count):
+    """
+    Top RECOMMENDATION_NEIGHBOURS similar items per item in CSR form (indptr, neighbours, similarities).
+    The -5..5 scale is already centered on 0 (negative means disliked), so similarity is the cosine
+    of the raw rating vectors, shrunk when few users rated both items. Only positive similarities are kept
+    """
+    keys, products, counts = np.empty(0, np.int64), np.empty(0), np.empty(0)
+    pending_keys, pending_products, pending = [], [], 0
+
+    for start, end in user_groups(users):
+        if end - start < 2:
+            continue
+        first, second = np.triu_indices(end - start, 1)
+        a, b = items[start:end][first], items[start:end][second]
+        pending_keys.append(np.minimum(a, b) * item_count + np.maximum(a, b))
+        pending_products.append(ratings[start:end][first] * ratings[start:end][second])
+        pending += len(first)
+
+        if pending > PAIR_BUFFER:
+            keys, products, counts = sum_pairs(
+                np.concatenate([keys, *pending_keys]),
+                np.concatenate([products, *pending_products]),
+                np.concatenate([counts, np.ones(pending)]),
+            )
+            pending_keys, pending_products, pending = [], [], 0
+
+    keys, products, counts = sum_pairs(
+        np.concatenate([keys, *pending_keys]),
+        np.concatenate([products, *pending_products]),
+        np.concatenate([counts, np.ones(pending)]),
+    )
+
+    norms = np.sqrt(np.bincount(items, weights=ratings.astype(np.float64) ** 2, minlength=item_count))
+    low, high = keys // item_count, keys % item_count
+    with np.errstate(divide="ignore", invalid="ignore"):
+        similarity = products / (norms[low] * norms[high]) * counts / (counts + SHRINKAGE)
+
+    keep = (counts >= settings.RECOMMENDATION_MIN_CORATERS) & (similarity > 0)
+    low, high, similarity = low[keep], high[keep], similarity[keep]
+
+    # Both directions, best first within each item, cut to the neighbour limit
+    sources = np.concatenate([low, high])
+    targets = np.concatenate([high, low])
+    similarity = np.concatenate([similarity, similarity])
+    order = np.lexsort((targets, -similarity, sources))
+    sources, targets, similarity = sources[order], targets[order], similarity[order]
+
+    _, starts, inverse = np.unique(sources, return_index=True, return_inverse=True)
+    keep = np.arange(len(sources)) - starts[inverse] < settings.RECOMMENDATION_NEIGHBOURS
+    sources, targets, similarity = sources[keep], targets[keep], similarity[keep]
+
+    indptr = np.zeros(item_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=item_count), out=indptr[1:])
+    return indptr, targets, similarity
+
+
+def recommend(rated, ratings, indptr, neighbours, similarities):
+    """
+    Scores unrated items for one user as the sum of similarity times rating over the items they rated.
+    Returns (items, scores, because) best first, because being the rated item contributing most
+    """
+    slices = [np.arange(indptr[item], indptr[item + 1]) for item in rated]
+    positions = np.concatenate(slices)
+    if not len(positions):
+        return np.empty(0, np.int64), np.empty(0), np.empty(0, np.int64)
+
+    sources = np.repeat(rated, [len(part) for part in slices])
+    candidates = neighbours[positions]
+    contributions = similarities[positions] * np.repeat(ratings, [len(part) for part in slices])
+
+    keep = ~np.isin(candidates, rated)
+    sources, candidates, contributions = sources[keep], candidates[keep], contributions[keep]
+
+    order = np.lexsort((-contributions, candidates))
+    sources, candidates, contributions = sources[order], candidates[order], contributions[order]
+    items, starts, inverse = np.unique(candidates, return_index=True, return_inverse=True)
+    scores = np.bincount(inverse, weights=contributions)
+
+    positive = np.flatnonzero(scores > 0)
+    best = positive[np.lexsort((items[positive], -scores[positive]))][:settings.RECOMMENDATION_RESULTS]
+    return items[best], scores[best], sources[starts[best]]
+
+
+def rebuild_recommendations():
+    """
+    Recomputes every recipe's rating neighbours and every rater's recommendations, replacing the
+    stored ones in one transaction. Returns (recipes with neighbours, users with recommendations)
+    """
+    data = load_ratings()
+    recipe_ids, items = np.unique(data["recipe"], return_inverse=True)
+    ratings = data["rating"]
+    indptr, neighbours, similarities = item_neighbours(items, ratings, data["user"], len(recipe_ids))
+
+    recipe_neighbours = [
+        RecipeRatingNeighbours(
+            recipe_id=int(recipe_ids[item]),
+            neighbour_ids=recipe_ids[neighbours[indptr[item]:indptr[item + 1]]].tolist(),
+            scores=np.round(similarities[indptr[item]:indptr[item + 1]], 4).tolist(),
+        )
+        for item in np.flatnonzero(np.diff(indptr)).tolist()
+    ]
+
+    user_recommendations = []
+    for start, end in user_groups(data["user"]):
+        recommended, scores, because = recommend(items[start:end], ratings[start:end], indptr, neighbours, similarities)
+        if len(recommended):
+            user_recommendations.append(UserRecommendations(
+                user_id=int(data["user"][start]),
+                recipe_ids=recipe_ids[recommended].tolist(),
+                scores=np.round(scores, 4).tolist(),
+                because_ids=recipe_ids[because].tolist(),
+            ))
+
+    with transaction.atomic():
+        RecipeRatingNeighbours.objects.all().delete()
+        RecipeRatingNeighbours.objects.bulk_create(recipe_neighbours, batch_size=BATCH_SIZE)
+        UserRecommendations.objects.all().delete()
+        UserRecommendations.objects.bulk_create(user_recommendations, batch_size=BATCH_SIZE)
+
+    return len(recipe_neighbours), len(user_recommendations)
@@ -4,14 +4,24 @@ from django.contrib.auth import get_user_model
 from recipes.models import Recipe
 
 class RatingSerializer(serializers.ModelSerializer):
-    recipe = serializers.CharField(source='recipe.title', read_only=True)
-    user = serializers.StringRelatedField(read_only=True)
+    author = serializers.StringRelatedField(read_only=True)
+    recipe = serializers.PrimaryKeyRelatedField(queryset=Recipe.objects.all())
+    recipe_title = serializers.CharField(source='recipe.title', read_only=True)
     average_rating = serializers.SerializerMethodField()
 
     class Meta:
         model = Rating
-        fields = ["id", "user", "user_id", "recipe", "rating", "created_at", "updated_at"]
-        read_only_fields = ['user'] 
+        fields = ["id", "author", "recipe", "recipe_title", "rating", "average_rating", "created_at", "updated_at"]
+        read_only_fields = ['author']
 
     def get_average_rating(self, obj):
-        return round(obj.avg_rating, 1) if avg_rating else None
+        """Returns the recipe's stored average, current as of this rating's save"""
+        return round(obj.recipe.avg_rating, 1) if obj.recipe.avg_rating else None
+
+
+class RecommendedRecipeSerializer(serializers.ModelSerializer):
+    """The few recipe fields a recommendation list shows"""
+
+    class Meta:
+        model = Recipe
+        fields = ["id", "title", "slug", "image_url", "avg_rating", "rating_count"]
@@ -0,0 +1,49 @@
+import logging
+import redis
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from . import leaderboard
+from .aggregates import apply_rating_delta, contribution
+from .models import Rating
+
+logger = logging.getLogger(__name__)
+
+
+def update_leaderboard(recipe_ids):
+    """Re-scores recipes once the rating is committed, the write stands even when Redis is down"""
+    def update():
+        try:
+            leaderboard.update(recipe_ids)
+        except redis.RedisError:
+            logger.exception("Could not update the leaderboards for recipes %s", sorted(recipe_ids))
+
+    transaction.on_commit(update)
+
+
+@receiver(post_save, sender=Rating)
+def add_rating_to_recipe(sender, instance, raw=False, **kwargs):
+    """Moves the recipe aggregates by the difference between the saved and the previously stored rating"""
+    if raw:
+        return
+
+    old_recipe, old_sum, old_count = contribution(*instance._stored)
+    new_recipe, new_sum, new_count = contribution(instance.recipe_id, instance.rating)
+
+    if old_recipe == new_recipe:
+        apply_rating_delta(new_recipe, new_sum - old_sum, new_count - old_count)
+    else:
+        apply_rating_delta(old_recipe, -old_sum, -old_count)
+        apply_rating_delta(new_recipe, new_sum, new_count)
+
+    changed = {recipe_id for recipe_id in (old_recipe, new_recipe) if recipe_id is not None}
+    update_leaderboard(changed)
+
+    instance._stored = (instance.recipe_id, instance.rating)
+
+
+@receiver(post_delete, sender=Rating)
+def remove_rating_from_recipe(sender, instance, **kwargs):
+    recipe_id, rating_sum, rating_count = contribution(*instance._stored)
+    apply_rating_delta(recipe_id, -rating_sum, -rating_count)
+    update_leaderboard({instance.recipe_id})
@@ -0,0 +1,16 @@
+from celery import shared_task
+from . import leaderboard, recommendations
+
+
+@shared_task
+def rebuild_recommendations():
+    """Recomputes the item-item neighbour lists and per-user recommendations from all ratings"""
+    recipes, users = recommendations.rebuild_recommendations()
+    return f"Stored neighbours for {recipes} recipes and recommendations for {users} users"
+
+
+@shared_task
+def rebuild_leaderboards():
+    """Rebuilds the top-rated leaderboards from the stored aggregates, dropping any drift from missed updates"""
+    ranked = leaderboard.rebuild()
+    return f"Ranked {ranked} recipes"
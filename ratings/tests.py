@@ -1,3 +1,275 @@
-from django.test import TestCase
+import os
+from decimal import Decimal
+from unittest import mock
+import redis
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase, APIClient
+from rest_framework import status
+from django.contrib.auth import get_user_model
+from recipes.models import Recipe
+from . import leaderboard
+from .aggregates import refresh_rating_aggregates
+from .recommendations import rebuild_recommendations
+from .models import Rating
 
-# Create your tests here.
+User = get_user_model()
+
+# Leaderboard tests write real sorted sets, into their own Redis database rather than the app's
+LEADERBOARD_TEST_REDIS_URL = os.environ.get("LEADERBOARD_TEST_REDIS_URL", "redis://127.0.0.1:6379/15")
+
+
+class RatingAggregateTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="rater", email="rater@example.com", password="RaterPass123"
+        )
+        self.other = User.objects.create_user(
+            username="other", email="other@example.com", password="OtherPass123"
+        )
+        self.recipe = Recipe.objects.create(
+            title="Chapati",
+            instructions="1. Cook",
+            category=["bread"],
+            diet=["vegan"],
+            servings=4,
+            cooking_time=30,
+        )
+        self.client = APIClient()
+
+    def assertAggregates(self, rating_sum, rating_count, avg_rating):
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.rating_sum, Decimal(rating_sum))
+        self.assertEqual(self.recipe.rating_count, rating_count)
+        self.assertAlmostEqual(self.recipe.avg_rating, avg_rating)
+
+    def test_aggregates_follow_create_update_and_delete(self):
+        """
+        Ensure the stored sum, count and average move with every rating write.
+        """
+        rating = Rating.objects.create(author=self.user, recipe=self.recipe, rating=4)
+        Rating.objects.create(author=self.other, recipe=self.recipe, rating=Decimal("2.5"))
+        self.assertAggregates("6.5", 2, 3.25)
+
+        rating.rating = 5
+        rating.save()
+        self.assertAggregates("7.5", 2, 3.75)
+
+        rating.delete()
+        self.assertAggregates("2.5", 1, 2.5)
+
+        self.other.delete()
+        self.assertAggregates("0", 0, 0.0)
+
+    def test_api_rating_updates_aggregates(self):
+        """
+        Ensure rating through the API creates, then updates, the user's rating and the recipe aggregates.
+        """
+        self.client.force_authenticate(self.user)
+
+        response = self.client.post("/api/ratings/", {"recipe": self.recipe.id, "rating": 3}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["average_rating"], 3.0)
+
+        response = self.client.post("/api/ratings/", {"recipe": self.recipe.id, "rating": 1}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertAggregates("1", 1, 1.0)
+
+    def test_api_updates_apply_to_locked_rating(self):
+        """
+        Ensure repeated API updates lock the stored rating and leave the exact sum behind.
+        """
+        Rating.objects.create(author=self.other, recipe=self.recipe, rating=2)
+        self.client.force_authenticate(self.user)
+        response = self.client.post("/api/ratings/", {"recipe": self.recipe.id, "rating": 3}, format="json")
+        rating_id = response.data["id"]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/api/ratings/", {"recipe": self.recipe.id, "rating": 5}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(any("FOR UPDATE" in query["sql"] for query in queries.captured_queries))
+
+        response = self.client.patch(f"/api/ratings/{rating_id}/", {"rating": -1}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertAggregates("1", 2, 0.5)
+
+    def test_reconcile_fixes_drift(self):
+        """
+        Ensure refresh_rating_aggregates rewrites recipes whose stored values drifted.
+        """
+        Rating.objects.create(author=self.user, recipe=self.recipe, rating=4)
+        Recipe.objects.filter(pk=self.recipe.pk).update(rating_sum=0, rating_count=0, avg_rating=0)
+
+        self.assertEqual(refresh_rating_aggregates(), 1)
+        self.assertAggregates("4", 1, 4.0)
+        self.assertEqual(refresh_rating_aggregates(), 0)
+
+
+class RecommendationTests(APITestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f"user{number}", email=f"user{number}@example.com", password="UserPass123")
+            for number in range(4)
+        ]
+        self.recipes = {
+            title: Recipe.objects.create(
+                title=title, instructions="1. Cook", category=["bread"], diet=["vegan"], servings=2, cooking_time=10,
+            )
+            for title in ["A", "B", "C", "D"]
+        }
+        ratings = [
+            (0, "A", 5), (0, "B", 4), (0, "C", -3),
+            (1, "A", 4), (1, "B", 5), (1, "D", 4),
+            (2, "A", 5), (2, "B", 4), (2, "D", 5),
+            (3, "A", 5),
+        ]
+        for user, title, rating in ratings:
+            Rating.objects.create(author=self.users[user], recipe=self.recipes[title], rating=rating)
+
+    def recipe_ids(self, results):
+        return [result["recipe"]["id"] for result in results]
+
+    def test_recommendations_from_stored_lists(self):
+        """
+        Ensure both endpoints serve the precomputed lists and drop pairs with too few co-raters.
+        """
+        rebuild_recommendations()
+        a, b, d = self.recipes["A"], self.recipes["B"], self.recipes["D"]
+
+        response = self.client.get(f"/api/ratings/recommendations/{a.id}/")
+        self.assertEqual(self.recipe_ids(response.data["results"]), [b.id, d.id])
+
+        self.client.force_authenticate(self.users[3])
+        response = self.client.get("/api/ratings/recommendations/")
+        self.assertEqual(self.recipe_ids(response.data["results"]), [b.id, d.id])
+        self.assertEqual(response.data["results"][0]["because"]["id"], a.id)
+
+        # Rated since the rebuild
+        Rating.objects.create(author=self.users[3], recipe=b, rating=5)
+        response = self.client.get("/api/ratings/recommendations/")
+        self.assertEqual(self.recipe_ids(response.data["results"]), [d.id])
+
+    def test_unknown_recipe_is_not_found(self):
+        """
+        Ensure recipe recommendations answer 404 for recipes that don't exist or aren't ids.
+        """
+        response = self.client.get("/api/ratings/recommendations/999999/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get("/api/ratings/recommendations/abc/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_recommendations_need_login(self):
+        """
+        Ensure per-user recommendations require authentication.
+        """
+        response = self.client.get("/api/ratings/recommendations/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(LEADERBOARD_PRIOR_WEIGHT=5.0)
+class LeaderboardScoreTests(SimpleTestCase):
+    def test_few_ratings_are_pulled_towards_the_mean(self):
+        """
+        Ensure a single 5 ranks below a recipe rated 4.5 by many, and both above the mean.
+        """
+        single = leaderboard.score(Decimal(5), 1, mean=1.0)
+        many = leaderboard.score(Decimal(90), 20, mean=1.0)
+        self.assertLess(single, many)
+        self.assertGreater(single, 1.0)
+        self.assertEqual(leaderboard.score(Decimal(0), 0, mean=1.0), 1.0)
+
+
+@override_settings(LEADERBOARD_REDIS_URL=LEADERBOARD_TEST_REDIS_URL)
+class LeaderboardTests(APITestCase):
+    def setUp(self):
+        # The client is built from the setting on first use, drop one made for another database
+        leaderboard._client = None
+        self.addCleanup(self.clear_leaderboards)
+        self.users = [
+            User.objects.create_user(username=f"user{number}", email=f"user{number}@example.com", password="UserPass123")
+            for number in range(4)
+        ]
+        self.recipes = {
+            title: Recipe.objects.create(
+                title=title, instructions="1. Cook", category=[category], diet=["vegan"], servings=2, cooking_time=10,
+            )
+            for title, category in [("A", "bread"), ("B", "bread"), ("C", "dessert")]
+        }
+        ratings = [(0, "A", 5), (0, "B", 4), (1, "B", 5), (2, "B", 4), (3, "B", 5), (1, "C", -3)]
+        for user, title, rating in ratings:
+            Rating.objects.create(author=self.users[user], recipe=self.recipes[title], rating=rating)
+        leaderboard.rebuild()
+
+    def clear_leaderboards(self):
+        keys = leaderboard.all_keys()
+        build_keys = [leaderboard.BUILD_KEY.format(key) for key in keys]
+        leaderboard.get_client().delete(*keys, *build_keys, leaderboard.MEAN_KEY, leaderboard.LOCK_KEY)
+        leaderboard._client = None
+
+    def recipe_ids(self, response):
+        return [result["recipe"]["id"] for result in response.data["results"]]
+
+    def test_top_overall_and_per_category(self):
+        """
+        Ensure /api/recipes/top ranks by Bayesian score, overall and within a category.
+        """
+        a, b, c = self.recipes["A"], self.recipes["B"], self.recipes["C"]
+
+        response = self.client.get("/api/recipes/top")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.recipe_ids(response), [b.id, a.id, c.id])
+
+        response = self.client.get("/api/recipes/top", {"category": "bread"})
+        self.assertEqual(self.recipe_ids(response), [b.id, a.id])
+
+        response = self.client.get("/api/recipes/top", {"category": "soup", "diet": "vegan"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rating_changes_update_the_boards(self):
+        """
+        Ensure committed rating writes re-score the recipe without a rebuild.
+        """
+        a, c = self.recipes["A"], self.recipes["C"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for user in self.users[2:]:
+                Rating.objects.create(author=user, recipe=a, rating=5)
+        self.assertEqual([recipe_id for recipe_id, _ in leaderboard.top(1)], [a.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.objects.filter(recipe=c).delete()
+        self.assertNotIn(c.id, [recipe_id for recipe_id, _ in leaderboard.top(10)])
+        self.assertNotIn(c.id, [recipe_id for recipe_id, _ in leaderboard.top(10, category="dessert")])
+
+    def test_first_update_scores_against_the_actual_mean(self):
+        """
+        Ensure an update before any rebuild ranks recipes as a rebuild would.
+        """
+        leaderboard.get_client().delete(leaderboard.MEAN_KEY, *leaderboard.all_keys())
+        leaderboard.update([self.recipes["A"].id])
+
+        updated = leaderboard.top(10)
+        leaderboard.rebuild()
+        self.assertEqual(updated, leaderboard.top(10))
+
+    def test_redis_outage_keeps_pages_and_writes_working(self):
+        """
+        Ensure the home page falls back to the database and rating writes stand when Redis is down.
+        """
+        a, b = self.recipes["A"], self.recipes["B"]
+        outage = redis.ConnectionError("Connection refused")
+
+        with mock.patch.object(leaderboard, "top", side_effect=outage):
+            response = self.client.get("/")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([recipe.id for recipe in response.context["top_recipes"]][:2], [a.id, b.id])
+
+            response = self.client.get("/api/recipes/top")
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        with mock.patch.object(leaderboard, "update", side_effect=outage):
+            with self.captureOnCommitCallbacks(execute=True):
+                Rating.objects.create(author=self.users[1], recipe=a, rating=5)
+        a.refresh_from_db()
+        self.assertEqual(a.rating_count, 2)
@@ -1,8 +1,10 @@
 from django.urls import path, include
 from rest_framework .routers import DefaultRouter
-from .views import RatingViewSet
+from .views import RatingViewSet, RecommendationViewSet
 
 router = DefaultRouter()
+# Registered first, the rating detail route would take "recommendations" for a pk
+router.register(r'recommendations', RecommendationViewSet, basename='recommendations')
 router.register(r'', RatingViewSet)
 
 urlpatterns = [
@@ -1,7 +1,11 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from rest_framework import viewsets, status, permissions
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
-from .serializers import RatingSerializer
-from .models import Rating
+from .serializers import RatingSerializer, RecommendedRecipeSerializer
+from .models import Rating, RecipeRatingNeighbours, UserRecommendations
 from recipes.models import Recipe
 from django.contrib.auth import get_user_model
 from .permissions import IsOwnerOrReadOnly
@@ -13,22 +17,110 @@ class RatingViewSet(viewsets.ModelViewSet):
     serializer_class = RatingSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
     
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ("update", "partial_update", "destroy"):
+            # The rating signals apply the difference to the value loaded here, it must not go stale
+            queryset = queryset.select_for_update(of=("self",))
+        return queryset
+
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         """Lets a user to rate and review a recipe or update an existing one"""
         recipe_id = request.data.get("recipe")
-        existing_rating = Rating.objects.filter(user=request.user, recipe_id=recipe_id).first()
+        # Locked until the update commits, so concurrent updates each apply their delta to the latest value
+        existing_rating = (
+            Rating.objects.select_for_update().filter(author=request.user, recipe_id=recipe_id).first()
+        )
 
         #updates existing rating 
         if existing_rating:
             serializer = self.get_serializer(
                     existing_rating, data=request.data, partial=True)
             serializer.is_valid(raise_exception=True)
-            serializer.save()
-            
+            self.perform_update(serializer)
+
             return Response(serializer.data, status=status.HTTP_200_OK)
 
         #create a new rating
         return super().create(request, *args, **kwargs)
 
+    @transaction.atomic
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
+    @transaction.atomic
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        rating = serializer.save(author=self.request.user)
+        rating.recipe.refresh_from_db(fields=["avg_rating", "rating_count"])
+
+    def perform_update(self, serializer):
+        # The rating signals moved the recipe aggregates, show the current ones
+        rating = serializer.save()
+        rating.recipe.refresh_from_db(fields=["avg_rating", "rating_count"])
+
+
+class RecommendationViewSet(viewsets.ViewSet):
+    """
+    Recommendations precomputed from ratings by ratings.tasks.rebuild_recommendations.
+    Requests only read the stored lists, see ratings.recommendations
+    """
+
+    def get_permissions(self):
+        if self.action == "retrieve":
+            return [permissions.AllowAny()]
+        return [permissions.IsAuthenticated()]
+
+    def limit(self, request):
+        try:
+            limit = int(request.query_params.get("limit", 10))
+        except ValueError:
+            limit = 10
+        return min(max(limit, 1), settings.RECOMMENDATION_RESULTS)
+
+    def list(self, request):
+        """Recipes for the current user, each with the rated recipe it is recommended because of"""
+        stored = UserRecommendations.objects.filter(user=request.user).first()
+        if stored is None:
+            return Response({"results": []})
+
+        # Recipes rated since the last rebuild are left out
+        recipes = Recipe.objects.filter(pk__in={*stored.recipe_ids, *stored.because_ids}).annotate(
+            rated=Exists(Rating.objects.filter(author=request.user, recipe=OuterRef("pk")))
+        ).in_bulk()
+
+        limit = self.limit(request)
+        results = []
+        for recipe_id, score, because_id in zip(stored.recipe_ids, stored.scores, stored.because_ids):
+            recipe = recipes.get(recipe_id)
+            if recipe is None or recipe.rated or recipe.duplicate_of_id:
+                continue
+
+            because = recipes.get(because_id)
+            results.append({
+                "recipe": RecommendedRecipeSerializer(recipe).data,
+                "score": score,
+                "because": RecommendedRecipeSerializer(because).data if because else None,
+            })
+            if len(results) == limit:
+                break
+
+        return Response({"results": results})
+
+    def retrieve(self, request, pk=None):
+        """Because you liked this recipe: the recipes its raters rated alike"""
+        recipe = get_object_or_404(Recipe, pk=pk)
+        stored = RecipeRatingNeighbours.objects.filter(recipe=recipe).first()
+        if stored is None:
+            return Response({"recipe": recipe.pk, "results": []})
+
+        recipes = Recipe.objects.filter(pk__in=stored.neighbour_ids, duplicate_of__isnull=True).in_bulk()
+        results = [
+            {"recipe": RecommendedRecipeSerializer(recipes[recipe_id]).data, "score": score}
+            for recipe_id, score in zip(stored.neighbour_ids, stored.scores)
+            if recipe_id in recipes
+        ]
+        return Response({"recipe": stored.recipe_id, "results": results[:self.limit(request)]})
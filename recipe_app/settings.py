@@ -15,6 +15,58 @@ environ.Env.read_env(os.path.join(BASE_DIR, ".env"))
 DEBUG = env("DEBUG")
 SECRET_KEY = env("SECRET_KEY")
 SPOONACULAR_API_KEY = env("SPOONACULAR_API_KEY")
+SPOONACULAR_API_BASE_URL = env("SPOONACULAR_API_BASE_URL", default="https://api.spoonacular.com")
+# Spoonacular calls allowed per day, shared by every worker through the cache
+SPOONACULAR_DAILY_LIMIT = env.int("SPOONACULAR_DAILY_LIMIT", default=50)
+# Missing details are backfilled through informationBulk, this many ids per call,
+# with up to SPOONACULAR_DETAIL_CONCURRENCY calls in flight per ingestion page
+SPOONACULAR_BULK_CHUNK_SIZE = env.int("SPOONACULAR_BULK_CHUNK_SIZE", default=50)
+SPOONACULAR_DETAIL_CONCURRENCY = env.int("SPOONACULAR_DETAIL_CONCURRENCY", default=8)
+# Estimated ingredient/title similarity above which a recipe is flagged as a near-duplicate
+DUPLICATE_THRESHOLD = env.float("DUPLICATE_THRESHOLD", default=0.8)
+
+# Full-text search: most results ranked per query and how long a ranked list stays cached (seconds)
+SEARCH_MAX_RESULTS = env.int("SEARCH_MAX_RESULTS", default=1000)
+SEARCH_CACHE_TIMEOUT = env.int("SEARCH_CACHE_TIMEOUT", default=300)
+# Autocomplete: completions returned by default and the most a client may ask for
+SUGGEST_LIMIT = env.int("SUGGEST_LIMIT", default=8)
+SUGGEST_MAX_LIMIT = env.int("SUGGEST_MAX_LIMIT", default=20)
+# Seconds entries of the recipe change log (recipes.changelog) are kept for the in-memory indexes
+RECIPE_CHANGE_LOG_TIMEOUT = env.int("RECIPE_CHANGE_LOG_TIMEOUT", default=3600)
+# Pantry matching: results per request, the most change log entries a process replays before
+# rebuilding, and the share of dropped slots that triggers a rebuild
+PANTRY_LIMIT = env.int("PANTRY_LIMIT", default=20)
+PANTRY_MAX_LIMIT = env.int("PANTRY_MAX_LIMIT", default=100)
+PANTRY_LOG_MAX_REPLAY = env.int("PANTRY_LOG_MAX_REPLAY", default=1000)
+PANTRY_COMPACT_RATIO = env.float("PANTRY_COMPACT_RATIO", default=0.2)
+# Nutrition column store: snapshot file written by refresh_nutrition_index, results per request.
+# The worker writes the file and the web processes read it, so the path must be on a filesystem
+# they all share (e.g. one host or a mounted volume), otherwise nutrition search keeps answering 503
+NUTRITION_INDEX_PATH = env("NUTRITION_INDEX_PATH", default=str(BASE_DIR / "nutrition_index.npz"))
+NUTRITION_LIMIT = env.int("NUTRITION_LIMIT", default=20)
+NUTRITION_MAX_LIMIT = env.int("NUTRITION_MAX_LIMIT", default=100)
+# Rating-based recommendations (ratings.recommendations): neighbours kept per recipe, recommendations
+# kept per user, newest ratings used per user and users who must have rated both recipes of a pair
+RECOMMENDATION_NEIGHBOURS = env.int("RECOMMENDATION_NEIGHBOURS", default=30)
+RECOMMENDATION_RESULTS = env.int("RECOMMENDATION_RESULTS", default=50)
+RECOMMENDATION_MAX_USER_RATINGS = env.int("RECOMMENDATION_MAX_USER_RATINGS", default=500)
+RECOMMENDATION_MIN_CORATERS = env.int("RECOMMENDATION_MIN_CORATERS", default=2)
+# Content-based similar recipes (recipes.similar): neighbours kept per recipe, share of recipes above
+# which a feature is ignored, and the longest posting list searched for candidates
+SIMILAR_RECIPES = env.int("SIMILAR_RECIPES", default=8)
+SIMILAR_MAX_DF = env.float("SIMILAR_MAX_DF", default=0.2)
+SIMILAR_MAX_POSTING = env.int("SIMILAR_MAX_POSTING", default=2000)
+# Top-rated leaderboards (ratings.leaderboard): Redis holding the sorted sets, phantom ratings at the
+# mean added to every recipe's score, and default / largest page of /api/recipes/top
+LEADERBOARD_REDIS_URL = env("LEADERBOARD_REDIS_URL", default=env("CACHE_URL", default="redis://127.0.0.1:6379/1"))
+LEADERBOARD_PRIOR_WEIGHT = env.float("LEADERBOARD_PRIOR_WEIGHT", default=5.0)
+LEADERBOARD_LIMIT = env.int("LEADERBOARD_LIMIT", default=10)
+LEADERBOARD_MAX_LIMIT = env.int("LEADERBOARD_MAX_LIMIT", default=50)
+# complexSearch params walked one after the other by the ingestion cursor, defaults to one per dish type
+SPOONACULAR_QUERY_SETS = []
+# Raw API responses are kept here so ingestion can be replayed without spending quota
+SPOONACULAR_ARCHIVE_ENABLED = env.bool("SPOONACULAR_ARCHIVE_ENABLED", default=True)
+SPOONACULAR_ARCHIVE_DIR = env("SPOONACULAR_ARCHIVE_DIR", default=str(BASE_DIR / "spoonacular_archive"))
 
 ALLOWED_HOSTS = env.list("ALLOWED_HOSTS", default=["localhost", "127.0.0.1"])
 
@@ -29,6 +81,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "recipes",
     "rest_framework_simplejwt.token_blacklist",
@@ -159,9 +212,25 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Widths of the resized recipe image variants and the largest remote image that gets mirrored
+RECIPE_IMAGE_WIDTHS = env.list("RECIPE_IMAGE_WIDTHS", cast=int, default=[320, 640, 1024])
+RECIPE_IMAGE_MAX_BYTES = env.int("RECIPE_IMAGE_MAX_BYTES", default=10 * 1024 * 1024)
+# Hosts remote images are mirrored from, Spoonacular's image servers
+RECIPE_IMAGE_HOSTS = env.list("RECIPE_IMAGE_HOSTS", default=["img.spoonacular.com", "spoonacular.com"])
+# Uploaded images are scaled down to fit this many pixels on their longest side
+RECIPE_IMAGE_MAX_DIMENSION = env.int("RECIPE_IMAGE_MAX_DIMENSION", default=2048)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
+# Cache, shared by web and celery workers (API quota counters live here)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": env("CACHE_URL", default="redis://127.0.0.1:6379/1"),
+    }
+}
+
 # celery configuration
 CELERY_BROKER_URL = "redis://127.0.0.1:6379/0"
 CELERY_RESULT_BACKEND = "redis://127.0.0.1:6379/0"
@@ -169,7 +238,27 @@ CELERY_BEAT_SCHEDULE = {
     "fetch_recipes_every_minutes": {
         "task": "recipes.tasks.fetch_recipes",
         "schedule": 360,
-        "kwargs": {'offset': 0, 'batch_size': 10}
+        "kwargs": {'batch_size': 100}
+        },
+    "mirror_recipe_images": {
+        "task": "recipes.tasks.mirror_pending_images",
+        "schedule": 600,
+        },
+    "refresh_nutrition_index": {
+        "task": "recipes.tasks.refresh_nutrition_index",
+        "schedule": 60,
+        },
+    "refresh_similar_recipes": {
+        "task": "recipes.tasks.refresh_similar_recipes",
+        "schedule": 900,
+        },
+    "rebuild_recommendations": {
+        "task": "ratings.tasks.rebuild_recommendations",
+        "schedule": 3600,
+        },
+    "rebuild_leaderboards": {
+        "task": "ratings.tasks.rebuild_leaderboards",
+        "schedule": 600,
         },
     }
 
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Recipe, NutritionalValue
+from .models import Recipe, NutritionalValue, IngestionCursor, Ingredient
 
 
 class NutritionalValueInline(admin.StackedInline):
@@ -19,17 +19,15 @@ class RecipeAdmin(admin.ModelAdmin):
         "servings",
         "created_at",
         "updated_at",
-        "avg_rating_display",
-        "total_ratings",
+        "avg_rating",
+        "rating_count",
     )
     list_filter = ("category", "diet", "created_at", "updated_at")
     search_fields = ("title", "description", "ingredients")
     prepopulated_fields = {"slug": ("title",)}
+    raw_id_fields = ("duplicate_of",)
     inlines = [NutritionalValueInline]
-
-    def avg_rating_display(self, obj):
-        return round(obj.avg_rating(), 2)
-    avg_rating_display.short_description = "Avg Rating"
+    readonly_fields = ("rating_sum", "rating_count", "avg_rating")
 
 
 @admin.register(NutritionalValue)
@@ -49,3 +47,15 @@ class NutritionalValueAdmin(admin.ModelAdmin):
         "vitamin_c",
     )
     search_fields = ("recipe__title",)
+
+
+@admin.register(IngestionCursor)
+class IngestionCursorAdmin(admin.ModelAdmin):
+    list_display = ("name", "current_query", "offset", "sort", "last_run_at", "last_run_stats")
+    readonly_fields = ("updated_at",)
+
+
+@admin.register(Ingredient)
+class IngredientAdmin(admin.ModelAdmin):
+    list_display = ("name",)
+    search_fields = ("name",)
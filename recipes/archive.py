@@ -0,0 +1,91 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from django.conf import settings
+
+# Params that identify the caller rather than the request, left out of archive keys
+EXCLUDED_PARAMS = {"apiKey"}
+
+
+def normalize_params(params):
+    """Returns the params that identify a request, as sorted strings"""
+    return {
+        key: str(value)
+        for key, value in sorted(params.items())
+        if key not in EXCLUDED_PARAMS
+    }
+
+
+def archive_key(endpoint, params):
+    """Content address of a request: sha256 over the endpoint and its normalized params"""
+    identity = json.dumps(
+        {"endpoint": endpoint, "params": normalize_params(params)}, sort_keys=True
+    )
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+def archive_path(endpoint, params):
+    """Where a response is stored, sharded by the first two characters of its key"""
+    key = archive_key(endpoint, params)
+    return Path(settings.SPOONACULAR_ARCHIVE_DIR) / endpoint / key[:2] / f"{key}.json.gz"
+
+
+def store_response(endpoint, params, payload):
+    """
+    Writes a raw API payload to the archive. The file is written to a temp file first
+    and moved into place so concurrent workers never see a partial entry
+    """
+    if not settings.SPOONACULAR_ARCHIVE_ENABLED:
+        return None
+
+    path = archive_path(endpoint, params)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    record = {
+        "endpoint": endpoint,
+        "params": normalize_params(params),
+        "fetched_at": datetime.now(timezone.utc).isoformat(),
+        "payload": payload,
+    }
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            f.write(json.dumps(record).encode())
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return path
+
+
+def read_record(path):
+    """Reads an archived record from disk"""
+    with gzip.open(path, "rb") as f:
+        return json.loads(f.read())
+
+
+def load_response(endpoint, params):
+    """Returns the archived payload for a request, or None if it was never archived"""
+    path = archive_path(endpoint, params)
+    if not path.exists():
+        return None
+
+    return read_record(path)["payload"]
+
+
+def iter_records(endpoint):
+    """Yields every archived record for an endpoint, oldest first"""
+    root = Path(settings.SPOONACULAR_ARCHIVE_DIR) / endpoint
+    if not root.exists():
+        return
+
+    paths = sorted(root.glob("*/*.json.gz"), key=lambda path: path.stat().st_mtime)
+    for path in paths:
+        yield read_record(path)
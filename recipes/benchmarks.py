@@ -0,0 +1,177 @@
+import json
+import platform
+import random
+import resource
+import subprocess
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from django.conf import settings
+from django.db import connection
+from .models import Recipe
+
+
+@contextmanager
+def scratch_database(keepdb=False):
+    """Runs a benchmark against a throwaway test database so real data is never touched"""
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+@contextmanager
+def measure():
+    """
+    Measures wall time, DB queries and peak RSS of a block.
+    Yields a dict that is filled in when the block exits
+    """
+    result = {"queries": 0}
+
+    def count_queries(execute, sql, params, many, context):
+        result["queries"] += 1
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    with connection.execute_wrapper(count_queries):
+        yield result
+
+    result["seconds"] = round(time.perf_counter() - started, 4)
+    # ru_maxrss is in kilobytes on Linux
+    result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def populate_recipes(rows, seed=0, batch_size=5000, start=0):
+    """
+    Bulk-inserts synthetic recipes with random categories, diets and timings.
+    Signals and slug allocation are bypassed, so this only suits read benchmarks
+    """
+    rng = random.Random(seed)
+    adjectives = ["spicy", "creamy", "quick", "roasted", "lemon", "garlic", "smoky", "classic", "vegan", "crispy"]
+    dishes = ["chicken", "pasta", "soup", "salad", "cake", "curry", "stew", "tacos", "rice", "bread", "pancakes"]
+    categories = [value for value, _ in Recipe.CATEGORY_CHOICES]
+    diets = [value for value, _ in Recipe.DIET_CHOICES if value != "none"]
+
+    def make(number):
+        return Recipe(
+            title=f"{rng.choice(adjectives).title()} {rng.choice(adjectives)} {rng.choice(dishes)} {number}",
+            slug=f"benchmark-recipe-{number}",
+            category=rng.sample(categories, rng.randint(1, 2)),
+            diet=rng.sample(diets, rng.randint(0, 2)) or ["none"],
+            servings=rng.randint(1, 8),
+            cooking_time=rng.randint(5, 180),
+            prep_time=rng.randint(0, 60),
+            ingredients="\n".join(rng.sample(dishes, 3)),
+            instructions="1. Cook",
+        )
+
+    # Numbering continues from start so slugs stay unique when topping up a kept database
+    for first in range(start, start + rows, batch_size):
+        Recipe.objects.bulk_create([make(number) for number in range(first, min(first + batch_size, start + rows))])
+
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE recipes_recipe")
+
+
+def time_query(queryset, repeat=5):
+    """
+    Runs a queryset `repeat` times and returns its timings in milliseconds plus the plan,
+    so a report shows whether an index was used
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = list(queryset.all())
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    return {
+        "rows": len(rows),
+        "median_ms": round(timings[len(timings) // 2], 3),
+        "min_ms": round(timings[0], 3),
+        "plan": queryset.explain(),
+    }
+
+
+def time_count(queryset, repeat=5):
+    """Times the COUNT(*) a paginated endpoint runs next to every page"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = queryset.count()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    return {"rows": count, "median_ms": round(timings[len(timings) // 2], 3)}
+
+
+def synthetic_nutrition_index(rows, seed=0):
+    """
+    A NutritionIndex of random but plausibly shaped nutrition values (log-normal, per serving),
+    built in memory so the column store can be measured without a database
+    """
+    # Imported here to keep numpy out of the query benchmarks
+    import numpy as np
+    from .nutrition import NutritionIndex
+    from .persistence import NUTRITION_FIELDS
+
+    medians = {
+        "calories_kcal": 450, "protein": 20, "fat": 18, "carbs": 45, "fiber": 5, "sugars": 10,
+        "sodium": 700, "cholesterol": 60, "calcium": 120, "iron": 3, "vitamin_c": 15,
+    }
+    rng = np.random.default_rng(seed)
+    columns = np.vstack([
+        rng.lognormal(np.log(medians[field]), 0.6, rows).astype(np.float32) for field in NUTRITION_FIELDS
+    ])
+    return NutritionIndex(np.arange(1, rows + 1, dtype=np.int64), columns)
+
+
+def time_call(function, repeat=20):
+    """Calls function `repeat` times and returns its median, fastest and slowest time in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    return {
+        "median_ms": round(timings[len(timings) // 2], 3),
+        "min_ms": round(timings[0], 3),
+        "max_ms": round(timings[-1], 3),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(name, params, results, output=None):
+    """
+    Writes a benchmark run as JSON, tagged with the git revision so runs can be compared
+    across commits. Returns the JSON text
+    """
+    report = {
+        "benchmark": name,
+        "revision": git_revision(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "database": connection.vendor,
+        "params": params,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+
+    return text
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.cache import cache
+
+# Shared log of changed recipe ids, read by the in-memory indexes (pantry, nutrition) to patch
+# themselves instead of reloading everything. SEQUENCE_KEY is the newest entry number and
+# ENTRY_KEY holds one batch of ids
+SEQUENCE_KEY = "recipe_change_log_seq"
+ENTRY_KEY = "recipe_change_log:{}"
+
+
+def log_changes(recipe_ids):
+    """Records recipes whose ingredients, nutrition or listing changed. Call once the change is committed"""
+    recipe_ids = sorted(set(recipe_ids))
+    if not recipe_ids:
+        return
+
+    cache.add(SEQUENCE_KEY, 0, timeout=None)
+    sequence = cache.incr(SEQUENCE_KEY)
+    cache.set(ENTRY_KEY.format(sequence), recipe_ids, settings.RECIPE_CHANGE_LOG_TIMEOUT)
+
+
+def latest():
+    return cache.get(SEQUENCE_KEY, 0)
+
+
+def read(after, until):
+    """
+    Recipe ids logged in entries after..until. Stops at the first missing entry, which either expired
+    or is about to be written. Returns (last sequence read, ids, whether every entry was found)
+    """
+    sequences = range(after + 1, until + 1)
+    entries = cache.get_many([ENTRY_KEY.format(sequence) for sequence in sequences])
+
+    recipe_ids = set()
+    for sequence in sequences:
+        entry = entries.get(ENTRY_KEY.format(sequence))
+        if entry is None:
+            return sequence - 1, recipe_ids, False
+        recipe_ids.update(entry)
+
+    return until, recipe_ids, True
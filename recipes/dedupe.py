@@ -0,0 +1,182 @@
+import hashlib
+import random
+import re
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Value, When
+from .models import Recipe, RecipeSignature, RecipeLSHBucket
+
+# 128 hash functions split into 16 bands of 8 rows. Two recipes share at least one band bucket
+# with high probability once their Jaccard similarity is above ~(1/16)^(1/8) = 0.71
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# Mersenne prime for the universal hash family (a * x + b) mod p
+PRIME = (1 << 61) - 1
+
+_rng = random.Random(20240501)
+PERMUTATIONS = [(_rng.randrange(1, PRIME), _rng.randrange(0, PRIME)) for _ in range(NUM_PERM)]
+
+QUANTITY = re.compile(r"[\d/½¼¾⅓⅔.,-]+")
+NON_WORD = re.compile(r"[^a-z\s]+")
+UNITS = {
+    "cup", "cups", "tbsp", "tsp", "tablespoon", "tablespoons", "teaspoon", "teaspoons",
+    "g", "kg", "mg", "ml", "l", "oz", "ounce", "ounces", "lb", "lbs", "pound", "pounds",
+    "pinch", "clove", "cloves", "can", "cans", "large", "medium", "small", "of",
+}
+
+
+def normalize_line(line):
+    """Reduces an ingredient line to its words, without quantities and units"""
+    line = NON_WORD.sub(" ", QUANTITY.sub(" ", line.lower()))
+    return " ".join(word for word in line.split() if word not in UNITS)
+
+
+def shingles(title, ingredients):
+    """The set compared between recipes: normalized ingredient lines plus title words"""
+    features = {
+        f"i:{normalized}"
+        for normalized in map(normalize_line, (ingredients or "").split("\n"))
+        if normalized
+    }
+    features.update(f"t:{word}" for word in normalize_line(title or "").split())
+    return features
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+def minhash(features):
+    """MinHash signature of a set of shingles, NUM_PERM values below 2**61"""
+    hashed = [_hash(feature) for feature in features]
+    if not hashed:
+        return [PRIME] * NUM_PERM
+
+    return [min((a * x + b) % PRIME for x in hashed) for a, b in PERMUTATIONS]
+
+
+def band_buckets(signature):
+    """One signed 64 bit bucket id per band, so they fit a BigIntegerField"""
+    buckets = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(repr(rows).encode(), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "big", signed=True))
+    return buckets
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(a == b for a, b in zip(signature, other)) / NUM_PERM
+
+
+def recipe_signature(recipe):
+    return minhash(shingles(recipe.title, recipe.ingredients))
+
+
+def index_recipes(recipes):
+    """
+    Stores MinHash signatures and LSH buckets for recipes and flags near-duplicates.
+    Candidates are found through bucket collisions (one indexed query for the whole batch),
+    so the cost per recipe does not grow with the catalog. A recipe is marked as a duplicate
+    of the oldest earlier recipe whose estimated similarity reaches DUPLICATE_THRESHOLD.
+    Returns {recipe id: id of the recipe it duplicates}
+    """
+    recipes = sorted((recipe for recipe in recipes if recipe.pk), key=lambda recipe: recipe.pk)
+    if not recipes:
+        return {}
+
+    threshold = settings.DUPLICATE_THRESHOLD
+    signatures = {recipe.pk: recipe_signature(recipe) for recipe in recipes}
+    buckets = {recipe_id: band_buckets(signature) for recipe_id, signature in signatures.items()}
+    batch_ids = set(signatures)
+
+    with transaction.atomic():
+        # Earlier recipes colliding with the batch in at least one band
+        collisions = RecipeLSHBucket.objects.filter(
+            bucket__in={bucket for recipe_buckets in buckets.values() for bucket in recipe_buckets}
+        ).exclude(recipe_id__in=batch_ids).values_list("recipe_id", "band", "bucket")
+
+        bucket_members = {}
+        for recipe_id, band, bucket in collisions:
+            bucket_members.setdefault((band, bucket), set()).add(recipe_id)
+
+        candidate_signatures = dict(
+            RecipeSignature.objects.filter(
+                recipe_id__in={recipe_id for members in bucket_members.values() for recipe_id in members}
+            ).values_list("recipe_id", "minhash")
+        )
+        roots = dict(
+            Recipe.objects.filter(id__in=candidate_signatures).values_list("id", "duplicate_of_id")
+        )
+
+        duplicates = {}
+        for recipe_id in sorted(batch_ids):
+            candidates = set()
+            for band, bucket in enumerate(buckets[recipe_id]):
+                candidates |= bucket_members.get((band, bucket), set())
+
+            best = None
+            for candidate_id in sorted(candidates):
+                other = candidate_signatures.get(candidate_id)
+                if candidate_id >= recipe_id or other is None:
+                    continue
+                if similarity(signatures[recipe_id], other) >= threshold:
+                    best = roots.get(candidate_id) or candidate_id
+                    break
+
+            if best:
+                duplicates[recipe_id] = best
+
+            # Later recipes of the same batch are compared against this one too
+            for band, bucket in enumerate(buckets[recipe_id]):
+                bucket_members.setdefault((band, bucket), set()).add(recipe_id)
+            candidate_signatures[recipe_id] = signatures[recipe_id]
+            roots[recipe_id] = duplicates.get(recipe_id)
+
+        RecipeSignature.objects.bulk_create(
+            [RecipeSignature(recipe_id=recipe_id, minhash=signature) for recipe_id, signature in signatures.items()],
+            update_conflicts=True,
+            unique_fields=["recipe"],
+            update_fields=["minhash"],
+        )
+        RecipeLSHBucket.objects.filter(recipe_id__in=batch_ids).delete()
+        RecipeLSHBucket.objects.bulk_create([
+            RecipeLSHBucket(recipe_id=recipe_id, band=band, bucket=bucket)
+            for recipe_id, recipe_buckets in buckets.items()
+            for band, bucket in enumerate(recipe_buckets)
+        ])
+
+        Recipe.objects.filter(
+            pk__in=batch_ids - duplicates.keys(), duplicate_of__isnull=False
+        ).update(duplicate_of=None)
+        if duplicates:
+            Recipe.objects.filter(pk__in=duplicates).update(duplicate_of=Case(
+                *(When(pk=recipe_id, then=Value(duplicate_of)) for recipe_id, duplicate_of in duplicates.items())
+            ))
+
+    return duplicates
+
+
+def merge_duplicate(recipe):
+    """
+    Folds a near-duplicate into the recipe it duplicates: comments move over, ratings move over
+    unless the author already rated the original, then the duplicate is deleted
+    """
+    # Imported here because both apps import recipes.models
+    from comments.models import Comment
+    from ratings.aggregates import refresh_rating_aggregates
+    from ratings.models import Rating
+
+    original_id = recipe.duplicate_of_id
+    with transaction.atomic():
+        Comment.objects.filter(recipe=recipe).update(recipe_id=original_id)
+
+        already_rated = Rating.objects.filter(recipe_id=original_id).values("author_id")
+        Rating.objects.filter(recipe=recipe).exclude(author_id__in=already_rated).update(recipe_id=original_id)
+        # Queryset updates skip the rating signals
+        refresh_rating_aggregates([original_id])
+
+        recipe.delete()
@@ -0,0 +1,172 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from .models import Recipe
+
+INGREDIENTS = [
+    "2 cups all-purpose flour",
+    "1 tsp salt",
+    "3 large eggs",
+    "1 cup whole milk",
+    "2 tbsp butter, melted",
+    "1 onion, chopped",
+    "2 cloves garlic, minced",
+    "1 lb chicken breast",
+    "400g canned tomatoes",
+    "1/2 cup grated parmesan",
+    "1 tbsp olive oil",
+    "1 cup rice",
+    "2 carrots, diced",
+    "1 tsp ground cumin",
+    "1/4 cup sugar",
+]
+
+DIETS = ["vegan", "gluten free", "vegetarian", "dairy free"]
+
+INFO_PATH = re.compile(r"^/recipes/(\d+)/information$")
+
+
+def make_recipe(recipe_id, rng):
+    """A complete /information style payload with random but plausible content"""
+    ingredients = rng.sample(INGREDIENTS, rng.randint(4, 10))
+    steps = [f"Step {number} of preparing the dish." for number in range(1, rng.randint(3, 8))]
+
+    return {
+        "id": recipe_id,
+        "title": f"Fake recipe {recipe_id}",
+        "image": f"https://img.example.com/{recipe_id}-556x370.jpg",
+        "summary": f"<b>Fake recipe {recipe_id}</b> is a test fixture.",
+        "readyInMinutes": rng.randint(5, 120),
+        "servings": rng.randint(1, 8),
+        "dishTypes": [rng.choice(Recipe.CATEGORY_CHOICES)[0]],
+        "diets": rng.sample(DIETS, rng.randint(0, 2)),
+        "extendedIngredients": [{"original": text, "name": text} for text in ingredients],
+        "analyzedInstructions": [
+            {"steps": [{"number": number, "step": step} for number, step in enumerate(steps, 1)]}
+        ],
+        "nutrition": {
+            "nutrients": [
+                {"name": "Calories", "amount": round(rng.uniform(50, 1200), 1)},
+                {"name": "Protein", "amount": round(rng.uniform(0, 80), 1)},
+                {"name": "Fat", "amount": round(rng.uniform(0, 90), 1)},
+                {"name": "Carbohydrates", "amount": round(rng.uniform(0, 150), 1)},
+                {"name": "Sodium", "amount": round(rng.uniform(0, 2500), 1)},
+            ]
+        },
+    }
+
+
+def strip_details(recipe):
+    """What complexSearch returns for a recipe it only has partial data for"""
+    return {
+        key: value for key, value in recipe.items()
+        if key not in ("extendedIngredients", "analyzedInstructions", "nutrition")
+    }
+
+
+class FakeSpoonacular:
+    """
+    Local stand-in for complexSearch, informationBulk and /recipes/{id}/information.
+    latency is added to every request (seconds), error_rate is the share of requests answered
+    with a 500 and completeness the share of search results that carry full details.
+    Every call is recorded in `calls` as (path, query params)
+    """
+
+    def __init__(self, recipes=1000, latency=0.0, error_rate=0.0, completeness=1.0, seed=0, first_id=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = []
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.recipes = {}
+        self.search_items = []
+        for recipe_id in range(first_id, first_id + recipes):
+            recipe = make_recipe(recipe_id, self._rng)
+            self.recipes[recipe_id] = recipe
+            complete = self._rng.random() < completeness
+            self.search_items.append(recipe if complete else strip_details(recipe))
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def calls_to(self, path):
+        return [query for call_path, query in self.calls if call_path == path]
+
+    def search(self, query):
+        dish_type = query.get("type", [None])[0]
+        offset = int(query.get("offset", ["0"])[0])
+        number = int(query.get("number", ["10"])[0])
+
+        matches = [
+            item for item in self.search_items
+            if dish_type is None or dish_type in item["dishTypes"]
+        ]
+        return {
+            "results": matches[offset:offset + number],
+            "offset": offset,
+            "number": number,
+            "totalResults": len(matches),
+        }
+
+    def respond(self, path, query):
+        """Returns (status, body) for a request"""
+        with self._lock:
+            self.calls.append((path, query))
+            failed = self._rng.random() < self.error_rate
+
+        if failed:
+            return 500, {"status": "failure", "message": "Injected error"}
+
+        if path == "/recipes/complexSearch":
+            return 200, self.search(query)
+
+        if path == "/recipes/informationBulk":
+            ids = [int(recipe_id) for recipe_id in query["ids"][0].split(",") if recipe_id]
+            return 200, [self.recipes[recipe_id] for recipe_id in ids if recipe_id in self.recipes]
+
+        match = INFO_PATH.match(path)
+        if match and int(match.group(1)) in self.recipes:
+            return 200, self.recipes[int(match.group(1))]
+
+        return 404, {"status": "failure", "message": "Not found"}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                status, body = fake.respond(url.path, parse_qs(url.query))
+
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
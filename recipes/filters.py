@@ -1,6 +1,10 @@
 import django_filters
-from django.db.models import Q
 from .models import Recipe
+from .ingredients import filter_by_ingredients
+from .search import order_by_ids, ranked_ids
+
+
+MATCH_CHOICES = [("any", "Any"), ("all", "All")]
 
 
 class RecipeFilter(django_filters.FilterSet):
@@ -22,26 +26,48 @@ class RecipeFilter(django_filters.FilterSet):
         field_name="cooking_time", lookup_expr="lte"
     )
 
-    # category filter
-    category = django_filters.CharFilter(
-        field_name="category__name", lookup_expr="iexact"
-    )
+    # category and diet filters take comma separated values, e.g. ?diet=vegan,gluten_free.
+    # By default recipes matching any value are returned, ?diet_match=all requires every value.
+    # overlap (&&) and contains (@>) are both served by the GIN indexes on the array columns
+    category = django_filters.CharFilter(method="filter_array")
+    category_match = django_filters.ChoiceFilter(choices=MATCH_CHOICES, method="filter_match")
+    diet = django_filters.CharFilter(method="filter_array")
+    diet_match = django_filters.ChoiceFilter(choices=MATCH_CHOICES, method="filter_match")
 
-    # diet filter
-    diet = django_filters.CharFilter(field_name="diet__name", lookup_expr="iexact")
+    # rating filters, read from the stored aggregates
+    min_rating = django_filters.NumberFilter(field_name="avg_rating", lookup_expr="gte")
+    min_ratings = django_filters.NumberFilter(field_name="rating_count", lookup_expr="gte")
 
     # title filter
     title = django_filters.CharFilter(field_name="title", lookup_expr="icontains")
 
-    # ingredient filter
-    ingredient = django_filters.CharFilter(field_name="ingredients", lookup_expr="icontains")
+    # ingredient filter, comma separated names must all be present e.g. ?ingredient=chicken,rice
+    ingredient = django_filters.CharFilter(method="filter_ingredient")
 
-    # search
+    # full-text search over title, description and ingredients, e.g. ?search=chicken -curry
     search = django_filters.CharFilter(method="filter_search")
 
     class Meta:
         model = Recipe
-        fields = ["category", "diet", "min_cooking_time", "max_cooking_time", "search"]
+        fields = ["category", "category_match", "diet", "diet_match", "min_cooking_time", "max_cooking_time", "min_rating", "min_ratings", "search"]
+
+    def filter_ingredient(self, queryset, name, value):
+        terms = [term.strip() for term in value.split(",") if term.strip()]
+        return filter_by_ingredients(queryset, terms)
+
+    def filter_array(self, queryset, name, value):
+        values = [item.strip().lower() for item in value.split(",") if item.strip()]
+        if not values:
+            return queryset
+
+        if self.form.cleaned_data.get(f"{name}_match") == "all":
+            return queryset.filter(**{f"{name}__contains": values})
+        return queryset.filter(**{f"{name}__overlap": values})
+
+    def filter_match(self, queryset, name, value):
+        # Read by filter_array
+        return queryset
 
     def filter_search(self, queryset, name, value):
-        return queryset.filter(Q(name__icontains=value))
+        # Ranked full-text matches, best first unless ?ordering= is given
+        return order_by_ids(queryset, ranked_ids(value))
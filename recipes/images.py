@@ -0,0 +1,205 @@
+import base64
+import hashlib
+import io
+from urllib.parse import urlparse
+import requests
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from PIL import Image, ImageFilter, ImageOps, UnidentifiedImageError
+from .models import Recipe
+
+# Pillow format name and save options per variant format, in the order browsers should prefer them
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+EXTENSIONS = {"webp": "webp", "jpeg": "jpg"}
+
+PLACEHOLDER_WIDTH = 16
+
+# Errors for data that is not a decodable image, retrying won't help. OSError also covers
+# requests exceptions, so catch those first
+ImageError = (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError)
+
+
+def source_key(source):
+    """Short stable key of the url or file variants are built from, so each source gets its own directory"""
+    return hashlib.sha1(source.encode()).hexdigest()[:12]
+
+
+def variant_path(recipe_id, source, width, fmt):
+    return f"recipes/variants/{recipe_id}/{source_key(source)}/{width}.{EXTENSIONS[fmt]}"
+
+
+def original_path(recipe_id):
+    return f"recipes/{recipe_id}/original.jpg"
+
+
+def variant_widths(original_width):
+    """Configured widths that don't upscale, or the original width if it is smaller than all of them"""
+    widths = sorted(width for width in settings.RECIPE_IMAGE_WIDTHS if width <= original_width)
+    return widths or [original_width]
+
+
+def mirrorable(url):
+    """Whether a remote image url points at one of RECIPE_IMAGE_HOSTS, the only hosts images are fetched from"""
+    parsed = urlparse(url or "")
+    return parsed.scheme in ("http", "https") and parsed.hostname in settings.RECIPE_IMAGE_HOSTS
+
+
+def download_image(url):
+    """
+    Downloads a remote image, refusing anything larger than RECIPE_IMAGE_MAX_BYTES. Only RECIPE_IMAGE_HOSTS
+    are contacted and redirects are not followed, so a url can't make the server fetch internal addresses
+    """
+    if not mirrorable(url):
+        raise ValueError(f"Image host of {url} is not allowed")
+
+    limit = settings.RECIPE_IMAGE_MAX_BYTES
+
+    with requests.get(url, stream=True, timeout=10, allow_redirects=False) as response:
+        response.raise_for_status()
+        if response.is_redirect:
+            raise ValueError(f"Image at {url} redirects elsewhere")
+
+        data = bytearray()
+        for chunk in response.iter_content(64 * 1024):
+            data.extend(chunk)
+            if len(data) > limit:
+                raise ValueError(f"Image at {url} is larger than {limit} bytes")
+
+    return bytes(data)
+
+
+def open_image(source):
+    """Decodes an image from bytes or a file, upright and flattened to RGB"""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    image = Image.open(source)
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+
+    return image.convert("RGB")
+
+
+def encode(image, fmt):
+    pil_format, options = VARIANT_FORMATS[fmt]
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def store(path, data):
+    # default_storage renames on collision, regenerated variants must keep their path
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    return default_storage.save(path, ContentFile(data))
+
+
+def placeholder(image):
+    """A blurred ~16px JPEG as a data URI, shown while the real variant loads"""
+    tiny = image.copy()
+    tiny.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH))
+    tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+
+    buffer = io.BytesIO()
+    tiny.save(buffer, "JPEG", quality=50)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def generate_variants(recipe_id, image, source):
+    """
+    Writes fixed-width WebP and JPEG variants of an image to MEDIA_ROOT, under a directory of their own
+    for each source so building them never touches the variants of another image.
+    Returns the Recipe field values describing them:
+    image_variants ({width: {format: storage path}}), image_placeholder, image_width and image_height
+    """
+    variants = {}
+    for width in variant_widths(image.width):
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+
+        variants[str(width)] = {
+            fmt: store(variant_path(recipe_id, source, width, fmt), encode(resized, fmt))
+            for fmt in VARIANT_FORMATS
+        }
+
+    return {
+        "image_variants": variants,
+        "image_placeholder": placeholder(image),
+        "image_width": image.width,
+        "image_height": image.height,
+    }
+
+
+def variant_files(variants):
+    return {path for formats in (variants or {}).values() for path in formats.values()}
+
+
+def delete_files(paths):
+    for path in paths:
+        default_storage.delete(path)
+
+
+def replace_variants(recipes, fields, **values):
+    """
+    Writes freshly generated variant fields to the recipe matched by the recipes queryset, if it still
+    matches. Returns whether it did. The new variant files are deleted when nothing matched, and once
+    the update commits the previous variants the new set doesn't reuse are deleted as well
+    """
+    with transaction.atomic():
+        recipe = recipes.select_for_update().only("id", "image_variants").first()
+        if recipe is None:
+            delete_files(variant_files(fields["image_variants"]))
+            return False
+
+        Recipe.objects.filter(pk=recipe.pk).update(**values, **fields)
+        stale = variant_files(recipe.image_variants) - variant_files(fields["image_variants"])
+        transaction.on_commit(lambda: delete_files(stale))
+    return True
+
+
+def mirror_remote_image(recipe):
+    """
+    Downloads recipe.image_url once and replaces the recipe's variants with ones built from it,
+    unless the recipe got an uploaded image or another url in the meantime.
+    Returns whether the recipe was updated
+    """
+    url = recipe.image_url
+    fields = generate_variants(recipe.pk, open_image(download_image(url)), url)
+    recipes = Recipe.objects.filter(Q(image="") | Q(image__isnull=True), pk=recipe.pk, image_url=url)
+    return replace_variants(recipes, fields, image_source=url)
+
+
+def process_uploaded_image(recipe_id, name):
+    """
+    Replaces an uploaded image with an upright, metadata-free JPEG capped at RECIPE_IMAGE_MAX_DIMENSION
+    and builds its variants. Nothing is written to the recipe if its image changed in the meantime.
+    Returns whether the recipe was updated
+    """
+    with default_storage.open(name) as f:
+        image = open_image(f)
+
+    # Re-encoding from pixels is what drops EXIF, GPS and colour profile metadata
+    limit = settings.RECIPE_IMAGE_MAX_DIMENSION
+    image.thumbnail((limit, limit), Image.LANCZOS)
+
+    # Scoped to the recipe and renamed on collision, so no other image is ever overwritten
+    normalized = default_storage.save(original_path(recipe_id), ContentFile(encode(image, "jpeg")))
+    fields = generate_variants(recipe_id, image, normalized)
+
+    updated = replace_variants(
+        Recipe.objects.filter(pk=recipe_id, image=name), fields, image=normalized, image_source=normalized
+    )
+    default_storage.delete(name if updated else normalized)
+
+    return updated
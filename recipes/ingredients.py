@@ -0,0 +1,180 @@
+import re
+from collections import namedtuple
+from functools import reduce
+from operator import or_
+from django.db import transaction
+from django.db.models import Q
+from .known_ids import MISSING_INGREDIENTS
+from .models import Ingredient, RecipeIngredient, split_lines
+
+ParsedIngredient = namedtuple("ParsedIngredient", ["quantity", "unit", "name"])
+
+VULGAR_FRACTIONS = {"½": 0.5, "¼": 0.25, "¾": 0.75, "⅓": 1 / 3, "⅔": 2 / 3, "⅛": 0.125}
+
+# Leading amount: "2", "1.5", "1/2", "2 1/2", "1½", "½" or a range like "2-3" (the lower bound is kept)
+QUANTITY = re.compile(
+    r"^\s*(?:(?P<whole>\d+(?:\.\d+)?)\s+(?P<mixed>\d+/\d+)"
+    r"|(?P<fraction>\d+/\d+)"
+    r"|(?P<number>\d+(?:\.\d+)?)?\s*(?P<vulgar>[½¼¾⅓⅔⅛])"
+    r"|(?P<plain>\d+(?:\.\d+)?)(?:\s*(?:-|to)\s*\d+(?:\.\d+)?)?)\s*"
+)
+
+# Spelled-out and plural units mapped onto one canonical abbreviation
+UNITS = {
+    "cup": "cup", "cups": "cup", "c": "cup",
+    "tablespoon": "tbsp", "tablespoons": "tbsp", "tbsp": "tbsp", "tbs": "tbsp", "tbsps": "tbsp",
+    "teaspoon": "tsp", "teaspoons": "tsp", "tsp": "tsp", "tsps": "tsp",
+    "g": "g", "gram": "g", "grams": "g", "gr": "g",
+    "kg": "kg", "kilogram": "kg", "kilograms": "kg",
+    "mg": "mg", "ml": "ml", "milliliter": "ml", "milliliters": "ml", "millilitre": "ml", "millilitres": "ml",
+    "l": "l", "liter": "l", "liters": "l", "litre": "l", "litres": "l",
+    "oz": "oz", "ounce": "oz", "ounces": "oz",
+    "lb": "lb", "lbs": "lb", "pound": "lb", "pounds": "lb",
+    "pinch": "pinch", "pinches": "pinch", "dash": "dash", "dashes": "dash",
+    "clove": "clove", "cloves": "clove", "can": "can", "cans": "can",
+    "slice": "slice", "slices": "slice", "piece": "piece", "pieces": "piece",
+    "stick": "stick", "sticks": "stick", "bunch": "bunch", "bunches": "bunch",
+    "handful": "handful", "handfuls": "handful", "package": "package", "packages": "package", "pkg": "package",
+}
+
+# Preparation and size words that don't change what the ingredient is
+DESCRIPTORS = {
+    "chopped", "minced", "diced", "sliced", "grated", "shredded", "crushed", "melted", "softened",
+    "fresh", "freshly", "finely", "roughly", "thinly", "large", "medium", "small", "canned", "whole",
+    "optional", "about", "of", "and", "or", "to", "taste", "for", "serving", "plus", "more", "extra",
+}
+
+# Longest name Ingredient.name holds, longer names are cut at a word
+NAME_MAX_LENGTH = Ingredient._meta.get_field("name").max_length
+
+PARENTHESES = re.compile(r"\([^)]*\)")
+NON_LETTER = re.compile(r"[^a-z\s]+")
+
+
+def parse_quantity(match):
+    if match.group("mixed"):
+        numerator, denominator = match.group("mixed").split("/")
+        return float(match.group("whole")) + int(numerator) / int(denominator) if int(denominator) else None
+    if match.group("fraction"):
+        numerator, denominator = match.group("fraction").split("/")
+        return int(numerator) / int(denominator) if int(denominator) else None
+    if match.group("vulgar"):
+        return float(match.group("number") or 0) + VULGAR_FRACTIONS[match.group("vulgar")]
+    return float(match.group("plain"))
+
+
+def singular(word):
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("oes") or word.endswith(("ches", "shes", "xes", "sses")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")) and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def canonical_name(text):
+    """Lowercased ingredient name without preparation notes, descriptors or plurals"""
+    text = PARENTHESES.sub(" ", text.lower()).split(",")[0]
+    words = [word for word in NON_LETTER.sub(" ", text).split() if word not in DESCRIPTORS]
+    if not words:
+        return ""
+
+    words[-1] = singular(words[-1])
+    name = " ".join(words)
+    if len(name) > NAME_MAX_LENGTH:
+        name = name[:NAME_MAX_LENGTH + 1].rsplit(" ", 1)[0][:NAME_MAX_LENGTH]
+    return name
+
+
+def parse_line(line):
+    """
+    Splits an ingredient line like "2 1/2 cups all-purpose flour, sifted" into
+    (2.5, "cup", "all purpose flour"). Returns None for lines without an ingredient name
+    """
+    line = line.strip()
+    if not line or line == MISSING_INGREDIENTS:
+        return None
+
+    quantity = None
+    match = QUANTITY.match(line)
+    if match and match.group(0).strip():
+        quantity = parse_quantity(match)
+        line = line[match.end():]
+
+    unit = ""
+    first, _, rest = line.partition(" ")
+    if first.lower().rstrip(".") in UNITS:
+        unit = UNITS[first.lower().rstrip(".")]
+        line = rest
+
+    name = canonical_name(line)
+    if not name:
+        return None
+
+    return ParsedIngredient(quantity, unit, name)
+
+
+def index_ingredients(recipes):
+    """
+    Replaces the parsed ingredient rows of recipes with ones parsed from their ingredients text.
+    Runs a constant number of queries for the whole batch
+    """
+    recipes = [recipe for recipe in recipes if recipe.pk]
+    if not recipes:
+        return
+
+    parsed = {}
+    for recipe in recipes:
+        parsed[recipe.pk] = [
+            (position, line, ingredient)
+            for position, line in enumerate(split_lines(recipe.ingredients))
+            for ingredient in [parse_line(line)]
+            if ingredient
+        ]
+    names = {ingredient.name for lines in parsed.values() for _, _, ingredient in lines}
+
+    with transaction.atomic():
+        if names:
+            Ingredient.objects.bulk_create([Ingredient(name=name) for name in names], ignore_conflicts=True)
+        ingredient_ids = dict(Ingredient.objects.filter(name__in=names).values_list("name", "id"))
+
+        RecipeIngredient.objects.filter(recipe_id__in=parsed).delete()
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_ids[ingredient.name],
+                position=position,
+                quantity=ingredient.quantity,
+                unit=ingredient.unit,
+                text=line,
+            )
+            for recipe_id, lines in parsed.items()
+            for position, line, ingredient in lines
+        ])
+
+
+def matching_ingredients(term):
+    """
+    Ingredients whose canonical name contains the term as whole words, e.g. "chicken" matches
+    "chicken breast". This only scans the small Ingredient table, never recipes
+    """
+    term = canonical_name(term)
+    if not term:
+        return Ingredient.objects.none()
+
+    return Ingredient.objects.filter(reduce(or_, [
+        Q(name=term),
+        Q(name__startswith=f"{term} "),
+        Q(name__endswith=f" {term}"),
+        Q(name__contains=f" {term} "),
+    ]))
+
+
+def filter_by_ingredients(queryset, terms):
+    """Recipes containing every one of the terms, each resolved through the ingredient index"""
+    for term in terms:
+        queryset = queryset.filter(
+            pk__in=RecipeIngredient.objects.filter(ingredient__in=matching_ingredients(term)).values("recipe_id")
+        )
+    return queryset
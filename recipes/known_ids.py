@@ -0,0 +1,59 @@
+from .models import Recipe
+
+# Placeholders normalize_recipe stores when the API had nothing to offer
+MISSING_INGREDIENTS = "Ingredients not available."
+MISSING_INSTRUCTIONS = "No instructions available."
+
+
+def complete_recipes():
+    """Ingested recipes stored with ingredients, instructions and nutrition"""
+    return (
+        Recipe.objects.filter(api_id__isnull=False, nutritional_value__isnull=False)
+        .exclude(ingredients__in=["", MISSING_INGREDIENTS])
+        .exclude(instructions__in=["", MISSING_INSTRUCTIONS])
+    )
+
+
+def is_complete(normalized):
+    """Checks a normalized recipe (see tasks.normalize_recipe) the same way complete_recipes does"""
+    fields = normalized["fields"]
+    return (
+        normalized["nutrition"] is not None
+        and fields["ingredients"] not in ("", MISSING_INGREDIENTS)
+        and fields["instructions"] not in ("", MISSING_INSTRUCTIONS)
+    )
+
+
+class CompleteRecipeIndex:
+    """
+    Bitmap of the Spoonacular ids we already store complete, loaded with a single query.
+    Spoonacular ids are dense integers, so one bit per id stays well under a megabyte
+    """
+
+    def __init__(self, api_ids=()):
+        self._bits = bytearray()
+        for api_id in api_ids:
+            self.add(api_id)
+
+    @classmethod
+    def load(cls):
+        return cls(complete_recipes().values_list("api_id", flat=True).iterator())
+
+    def add(self, api_id):
+        byte, bit = divmod(api_id, 8)
+        if byte >= len(self._bits):
+            self._bits.extend(bytes(byte - len(self._bits) + 1))
+        self._bits[byte] |= 1 << bit
+
+    def update_from(self, normalized):
+        """Adds the recipes of a saved batch that are now complete"""
+        for item in normalized:
+            if is_complete(item):
+                self.add(item["api_id"])
+
+    def __contains__(self, api_id):
+        byte, bit = divmod(api_id, 8)
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << bit))
+
+    def __len__(self):
+        return sum(byte.bit_count() for byte in self._bits)
@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from recipes.benchmarks import measure, scratch_database, write_report
+from recipes.fake_spoonacular import FakeSpoonacular
+from recipes.models import Recipe
+from recipes.tasks import fetch_recipes, save_or_update_recipe
+
+
+class Command(BaseCommand):
+    help = 'Benchmark Spoonacular ingestion end to end against a local fake API and a scratch database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=2000, help='Number of recipes the fake API serves')
+        parser.add_argument('--pages', type=int, default=10, help='complexSearch pages ingested through fetch_recipes')
+        parser.add_argument('--batch-size', type=int, default=100, help='Results per complexSearch page')
+        parser.add_argument('--single', type=int, default=50, help='Items saved one by one through save_or_update_recipe')
+        parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every fake API response')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of fake API calls answered with a 500')
+        parser.add_argument('--completeness', type=float, default=0.5, help='Share of search results carrying full details')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the scratch test database')
+
+    def handle(self, *args, **options):
+        params = {key: options[key] for key in (
+            'recipes', 'pages', 'batch_size', 'single', 'latency', 'error_rate', 'completeness', 'seed',
+        )}
+
+        fake = FakeSpoonacular(
+            recipes=options['recipes'],
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            completeness=options['completeness'],
+            seed=options['seed'],
+        )
+        bench_settings = override_settings(
+            SPOONACULAR_API_BASE_URL=fake.url,
+            SPOONACULAR_ARCHIVE_ENABLED=False,
+            SPOONACULAR_DAILY_LIMIT=10 ** 9,
+            SPOONACULAR_QUERY_SETS=[{}],
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        )
+
+        with scratch_database(keepdb=options['keepdb']), fake, bench_settings:
+            results = {
+                'fetch_recipes': self.bench_fetch_recipes(fake, options),
+                'save_or_update_recipe': self.bench_save_or_update_recipe(fake, options),
+            }
+
+        text = write_report('ingestion', params, results, options['output'])
+        self.stdout.write(text)
+
+    def bench_fetch_recipes(self, fake, options):
+        """Ingests whole pages the way the periodic task does"""
+        calls_before = len(fake.calls)
+        recipes_before = Recipe.objects.count()
+        failed_pages = 0
+
+        with measure() as result:
+            for _ in range(options['pages']):
+                outcome = fetch_recipes.apply(kwargs={'batch_size': options['batch_size'], 'follow': False})
+                if outcome.failed():
+                    failed_pages += 1
+
+        result['failed_pages'] = failed_pages
+        return self.summarize(result, fake, calls_before, recipes_before)
+
+    def bench_save_or_update_recipe(self, fake, options):
+        """Saves items one at a time, backfilling details per item"""
+        start = options['pages'] * options['batch_size']
+        items = fake.search_items[start:start + options['single']]
+
+        calls_before = len(fake.calls)
+        recipes_before = Recipe.objects.count()
+
+        with measure() as result:
+            for item in items:
+                save_or_update_recipe(dict(item))
+
+        return self.summarize(result, fake, calls_before, recipes_before)
+
+    def summarize(self, result, fake, calls_before, recipes_before):
+        saved = Recipe.objects.count() - recipes_before
+        result.update({
+            'recipes_saved': saved,
+            'recipes_per_sec': round(saved / result['seconds'], 1) if result['seconds'] else None,
+            'api_calls': len(fake.calls) - calls_before,
+            'queries_per_recipe': round(result['queries'] / saved, 2) if saved else None,
+        })
+        return result
@@ -0,0 +1,54 @@
+import random
+from django.core.management.base import BaseCommand
+from recipes.benchmarks import synthetic_nutrition_index, time_call, write_report
+
+# (name, ranges, ordering) run through NutritionIndex.search like the nutrition-search endpoint
+SEARCHES = [
+    ('one_range', {'protein': (30, None)}, None),
+    ('calorie_band', {'calories_kcal': (300, 600)}, None),
+    ('three_ranges', {'calories_kcal': (200, 700), 'protein': (20, None), 'sodium': (None, 800)}, None),
+    ('five_ranges', {
+        'calories_kcal': (200, 700), 'protein': (15, None), 'fat': (None, 25),
+        'carbs': (20, 80), 'sugars': (None, 15),
+    }, None),
+    ('ordered_by_protein', {'calories_kcal': (None, 600)}, '-protein'),
+    ('deep_page', {'fiber': (3, None)}, 'sodium'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark nutrition range search and similar-macro lookups on a synthetic in-memory column store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Synthetic nutrition rows')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per case, the median is reported')
+        parser.add_argument('--page-size', type=int, default=20, help='Results per call, like one API page')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        params = {key: options[key] for key in ('rows', 'repeat', 'page_size', 'seed')}
+        index = synthetic_nutrition_index(options['rows'], options['seed'])
+        page_size, repeat = options['page_size'], options['repeat']
+
+        results = {'search': {}, 'similar': {}}
+        for name, ranges, ordering in SEARCHES:
+            offset = page_size * 50 if name == 'deep_page' else 0
+            count, _ = index.search(ranges, page_size, offset, ordering)
+            results['search'][name] = {
+                'ranges': ranges,
+                'ordering': ordering,
+                'matches': count,
+                **time_call(lambda: index.search(ranges, page_size, offset, ordering), repeat),
+            }
+            self.stdout.write(f"search.{name}: {results['search'][name]['median_ms']} ms")
+
+        # The scaled macro profiles are computed once per snapshot load, time that separately
+        results['similar']['profiles_ms'] = time_call(index.profiles, 1)['median_ms']
+        rng = random.Random(options['seed'])
+        recipe_ids = index.recipe_ids.tolist()
+        results['similar']['nearest'] = time_call(lambda: index.similar(rng.choice(recipe_ids), page_size), repeat)
+        self.stdout.write(f"similar.nearest: {results['similar']['nearest']['median_ms']} ms")
+
+        text = write_report('nutrition', params, results, options['output'])
+        self.stdout.write(text)
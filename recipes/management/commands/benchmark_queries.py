@@ -0,0 +1,78 @@
+import time
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from recipes.benchmarks import populate_recipes, scratch_database, time_count, time_query, write_report
+from recipes.filters import RecipeFilter
+from recipes.models import Recipe
+
+# Named groups of API query parameters, each case is run through RecipeFilter like the list endpoint
+SUITES = {
+    'filters': [
+        ('category_any', {'category': 'dessert'}),
+        ('category_any_of_two', {'category': 'dessert,snack'}),
+        ('category_all_of_two', {'category': 'dessert,snack', 'category_match': 'all'}),
+        ('diet_any_of_two', {'diet': 'vegan,gluten_free'}),
+        ('diet_all_of_two', {'diet': 'vegan,gluten_free', 'diet_match': 'all'}),
+        ('category_and_diet', {'category': 'main course', 'diet': 'vegan'}),
+    ],
+    'search': [
+        ('one_term', {'search': 'curry'}),
+        ('two_terms', {'search': 'spicy chicken'}),
+        ('phrase', {'search': '"lemon cake"'}),
+        ('excluded_term', {'search': 'chicken -garlic'}),
+        ('search_and_diet', {'search': 'soup', 'diet': 'vegan'}),
+    ],
+}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark recipe API queries against a scratch database filled with synthetic recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Synthetic recipes inserted')
+        parser.add_argument('--suite', action='append', choices=sorted(SUITES), help='Suites to run, all by default')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query, the median is reported')
+        parser.add_argument('--page-size', type=int, default=20, help='Rows fetched per query, like one API page')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the scratch test database and its rows')
+
+    def handle(self, *args, **options):
+        suites = options['suite'] or sorted(SUITES)
+        params = {key: options[key] for key in ('rows', 'repeat', 'page_size', 'seed')}
+        params['suites'] = suites
+
+        # A private cache so clearing it between cases never touches the shared one
+        bench_settings = override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        )
+
+        with scratch_database(keepdb=options['keepdb']), bench_settings:
+            existing = Recipe.objects.count()
+            missing = options['rows'] - existing
+            if missing > 0:
+                self.stdout.write(f'Inserting {missing} recipes')
+                populate_recipes(missing, seed=options['seed'], start=existing)
+
+            results = {}
+            for suite in suites:
+                results[suite] = {}
+                for name, query in SUITES[suite]:
+                    # Building the queryset is where cached work (e.g. search ranking) happens, time it cold
+                    cache.clear()
+                    started = time.perf_counter()
+                    queryset = RecipeFilter(query, queryset=Recipe.objects.all()).qs
+                    build_ms = round((time.perf_counter() - started) * 1000, 3)
+
+                    results[suite][name] = {
+                        'params': query,
+                        'build_ms': build_ms,
+                        # The list endpoint has no default ordering, its first page is a plain LIMIT
+                        'page': time_query(queryset[:options['page_size']], options['repeat']),
+                        'count': time_count(queryset, options['repeat']),
+                    }
+                    self.stdout.write(f"{suite}.{name}: {results[suite][name]['page']['median_ms']} ms")
+
+        text = write_report('queries', params, results, options['output'])
+        self.stdout.write(text)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from recipes.dedupe import index_recipes, merge_duplicate
+from recipes.models import Recipe
+
+class Command(BaseCommand):
+    help = 'Rebuild the near-duplicate index over the whole catalog and optionally merge duplicates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Recipes indexed per transaction')
+        parser.add_argument(
+            '--merge', action='store_true',
+            help='Fold ingested duplicates into their original. User uploads are only flagged',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        indexed = 0
+        flagged = 0
+        last_id = 0
+
+        # Walk in id order so the oldest recipe of a group is always the one kept
+        while True:
+            batch = list(
+                Recipe.objects.filter(id__gt=last_id).order_by('id').only('id', 'title', 'ingredients')[:batch_size]
+            )
+            if not batch:
+                break
+
+            flagged += len(index_recipes(batch))
+            indexed += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f'Indexed {indexed} recipes, {flagged} duplicates flagged')
+
+        merged = 0
+        if options['merge']:
+            for recipe in Recipe.objects.filter(duplicate_of__isnull=False, author__isnull=True).iterator():
+                merge_duplicate(recipe)
+                merged += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {indexed} recipes, {flagged} duplicates flagged, {merged} merged'
+        ))
@@ -1,9 +1,10 @@
 from django.core.management.base import BaseCommand
 from recipes.tasks import fetch_recipes
+from recipes import quota
 
 class Command(BaseCommand):
     help = 'Feych recipes from Spoonacular'
 
     def handle(self, *args, **options):
         result = fetch_recipes.delay()
-        self.stdout.write(f'Task started: {result.id}')
+        self.stdout.write(f'Task started: {result.id} ({quota.remaining()}/{quota.daily_limit()} API calls left today)')
@@ -0,0 +1,108 @@
+import gzip
+import json
+import time
+from itertools import islice
+from multiprocessing import Pool
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from recipes.persistence import bulk_upsert_recipes
+from recipes.tasks import normalize_recipe
+
+
+def open_dump(path):
+    """Opens a plain or gzip compressed JSONL dump for reading text lines"""
+    with open(path, 'rb') as f:
+        is_gzip = f.read(2) == b'\x1f\x8b'
+
+    if is_gzip:
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def parse_line(line):
+    """Turns one dump line (a Spoonacular recipe item) into a normalized recipe, or None"""
+    line = line.strip()
+    if not line:
+        return None
+
+    try:
+        item = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+
+    if not isinstance(item, dict) or 'id' not in item:
+        return None
+
+    return normalize_recipe(item)
+
+
+class Command(BaseCommand):
+    help = 'Import recipes from a JSONL (optionally gzip) dump of Spoonacular recipe items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to a .jsonl or .jsonl.gz file, one recipe per line')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Recipes written per transaction')
+        parser.add_argument('--workers', type=int, default=1, help='Processes used to parse lines')
+        parser.add_argument('--start-line', type=int, default=1, help='Resume from this line number (1-based)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        workers = options['workers']
+        start_line = options['start_line']
+
+        if batch_size < 1 or workers < 1 or start_line < 1:
+            raise CommandError('--batch-size, --workers and --start-line must be positive')
+
+        try:
+            dump = open_dump(options['path'])
+        except OSError as exc:
+            raise CommandError(f"Cannot open {options['path']}: {exc}")
+
+        # Workers only parse, they never touch the DB, so don't let them inherit connections
+        pool = None
+        if workers > 1:
+            connections.close_all()
+            pool = Pool(workers)
+
+        line_number = start_line - 1
+        imported = 0
+        skipped = 0
+        started = time.monotonic()
+
+        try:
+            with dump:
+                lines = islice(dump, start_line - 1, None)
+
+                # Read one batch at a time so memory stays bounded however large the dump is
+                while True:
+                    batch = list(islice(lines, batch_size))
+                    if not batch:
+                        break
+
+                    if pool:
+                        parsed = pool.map(parse_line, batch, chunksize=max(len(batch) // (workers * 4), 1))
+                    else:
+                        parsed = map(parse_line, batch)
+
+                    normalized = [recipe for recipe in parsed if recipe]
+                    bulk_upsert_recipes(normalized)
+
+                    line_number += len(batch)
+                    imported += len(normalized)
+                    skipped += len(batch) - len(normalized)
+
+                    rate = imported / max(time.monotonic() - started, 1e-6)
+                    self.stdout.write(
+                        f'Line {line_number}: {imported} imported, {skipped} skipped ({rate:.0f} recipes/s)'
+                    )
+        except (Exception, KeyboardInterrupt):
+            self.stdout.write(self.style.WARNING(f'Stopped, resume with --start-line {line_number + 1}'))
+            raise
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} recipes from {line_number - start_line + 1} lines, {skipped} skipped'
+        ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from recipes.ingredients import index_ingredients
+from recipes.models import Recipe
+
+class Command(BaseCommand):
+    help = 'Parse the ingredients text of every recipe into the Ingredient/RecipeIngredient index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Recipes indexed per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        indexed = 0
+        last_id = 0
+
+        while True:
+            batch = list(
+                Recipe.objects.filter(id__gt=last_id).order_by('id').only('id', 'ingredients')[:batch_size]
+            )
+            if not batch:
+                break
+
+            index_ingredients(batch)
+            indexed += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f'Indexed ingredients of {indexed} recipes')
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed ingredients of {indexed} recipes'))
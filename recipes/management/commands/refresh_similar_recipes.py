@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from recipes.similar import refresh_similar_recipes
+
+
+class Command(BaseCommand):
+    help = 'Recompute content-based similar recipes for recipes changed since the last run, or all of them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every recipe instead of only changed ones')
+
+    def handle(self, *args, **options):
+        recomputed = refresh_similar_recipes(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Recomputed similar recipes for {recomputed} recipes'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from recipes.archive import iter_records
+from recipes.tasks import ingest_page
+
+class Command(BaseCommand):
+    help = 'Re-ingest archived Spoonacular responses without calling the API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Max number of archived pages to replay')
+
+    def handle(self, *args, **options):
+        pages = 0
+        saved = 0
+
+        for record in iter_records('complexSearch'):
+            if options['limit'] is not None and pages >= options['limit']:
+                break
+
+            data = record['payload'].get('results', [])
+            saved += ingest_page(data, replay=True)
+            pages += 1
+
+            self.stdout.write(f"Replayed page offset={record['params'].get('offset')} ({len(data)} items)")
+
+        self.stdout.write(self.style.SUCCESS(f'Replayed {pages} pages, saved {saved} recipes'))
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:33
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def clear_duplicate_api_ids(apps, schema_editor):
+    """
+    Racing update_or_create calls could store one Spoonacular recipe twice. The oldest row keeps the
+    api_id, the copies lose it but keep their ratings and comments
+    """
+    Recipe = apps.get_model("recipes", "Recipe")
+
+    oldest = Recipe.objects.filter(api_id__isnull=False).values("api_id").annotate(oldest=Min("pk")).values("oldest")
+    Recipe.objects.filter(api_id__isnull=False).exclude(pk__in=oldest).update(api_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0010_auto_20250914_1618"),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_duplicate_api_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="recipe",
+            name="api_id",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="ID from Spoonacular", null=True, unique=True
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0011_recipe_api_id_unique"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IngestionCursor",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(default="default", max_length=50, unique=True),
+                ),
+                ("sort", models.CharField(default="popularity", max_length=30)),
+                ("sort_direction", models.CharField(default="desc", max_length=4)),
+                ("current_query", models.JSONField(blank=True, default=dict)),
+                ("offset", models.PositiveIntegerField(default=0)),
+                ("query_progress", models.JSONField(blank=True, default=dict)),
+                ("last_run_at", models.DateTimeField(blank=True, null=True)),
+                ("last_run_stats", models.JSONField(blank=True, default=dict)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0014_recipe_duplicates"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="image_height",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="image_placeholder",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="image_source",
+            field=models.CharField(blank=True, default="", max_length=500),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="image_variants",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="image_width",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:47
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Recipe = apps.get_model("recipes", "Recipe")
+    Rating = apps.get_model("ratings", "Rating")
+
+    ratings = Rating.objects.filter(recipe=OuterRef("pk"), rating__isnull=False).order_by().values("recipe")
+    Recipe.objects.filter(pk__in=Rating.objects.values("recipe_id")).update(
+        rating_sum=Coalesce(Subquery(ratings.annotate(total=Sum("rating")).values("total")), Value(0)),
+        rating_count=Coalesce(Subquery(ratings.annotate(total=Count("pk")).values("total")), Value(0)),
+        avg_rating=Coalesce(
+            Subquery(ratings.annotate(total=Cast(Sum("rating"), FloatField()) / Count("pk")).values("total")),
+            Value(0.0),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0015_recipe_image_variants"),
+        ("ratings", "0005_remove_rating_comment"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="avg_rating",
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="rating_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="rating_sum",
+            field=models.DecimalField(decimal_places=1, default=0, max_digits=12),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(
+                fields=["-avg_rating", "-rating_count"], name="recipe_top_rated_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:50
+
+from django.db import migrations, models
+
+
+def split_lines(text):
+    return [line.strip() for line in (text or "").split("\n") if line.strip()]
+
+
+def split_existing_text(apps, schema_editor):
+    Recipe = apps.get_model("recipes", "Recipe")
+
+    batch = []
+    for recipe in Recipe.objects.only("id", "ingredients", "instructions").iterator(chunk_size=1000):
+        recipe.ingredient_lines = split_lines(recipe.ingredients)
+        recipe.instruction_steps = split_lines(recipe.instructions)
+        batch.append(recipe)
+
+        if len(batch) == 1000:
+            Recipe.objects.bulk_update(batch, ["ingredient_lines", "instruction_steps"])
+            batch = []
+
+    if batch:
+        Recipe.objects.bulk_update(batch, ["ingredient_lines", "instruction_steps"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0017_ingredient_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="ingredient_lines",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="instruction_steps",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(split_existing_text, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0021_trigram_suggest_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RecipeNeighbour",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("rank", models.PositiveSmallIntegerField()),
+                ("score", models.FloatField()),
+                (
+                    "neighbour",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="recipes.recipe",
+                    ),
+                ),
+                (
+                    "recipe",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="neighbours",
+                        to="recipes.recipe",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["recipe", "rank"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("recipe", "rank"), name="unique_recipe_neighbour_rank"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -1,9 +1,27 @@
-from django.db import models
+import json
+import re
+from functools import reduce
+from operator import or_
+from django.db import IntegrityError, models, transaction
+from django.db.models import BigIntegerField, Case, Max, Q, Value, When
+from django.db.models.functions import Cast, Substr
+from django.utils import timezone
 from django.conf import settings
-from django.db.models import Avg
+from django.core.files.storage import default_storage
 from django.core.validators import MinValueValidator
 from django.utils.text import slugify
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+
+# Attempts at saving a recipe when a concurrent save takes the allocated slug first
+SLUG_RETRIES = 5
+
+
+def split_lines(text):
+    """Non-empty, stripped lines of a newline separated text field"""
+    return [line.strip() for line in (text or "").split("\n") if line.strip()]
+
 
 class Recipe(models.Model):
     CATEGORY_CHOICES = [
@@ -41,7 +59,7 @@ class Recipe(models.Model):
     )
     category = ArrayField(models.CharField(max_length=20, choices=CATEGORY_CHOICES, default=list))
     api_id = models.PositiveIntegerField(
-        help_text="ID from Spoonacular", null=True, blank=True
+        help_text="ID from Spoonacular", null=True, blank=True, unique=True
     )
 
     diet = ArrayField(models.CharField(max_length=20, choices=DIET_CHOICES, default=list))
@@ -54,35 +72,138 @@ class Recipe(models.Model):
     ingredients = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to="recipes/", blank=True, null=True)
     image_url = models.URLField(blank=True, null=True)
+
+    # resized copies served instead of the original, see recipes.images
+    image_variants = models.JSONField(default=dict, blank=True)
+    image_placeholder = models.TextField(blank=True, default="")
+    image_width = models.PositiveIntegerField(blank=True, null=True)
+    image_height = models.PositiveIntegerField(blank=True, null=True)
+    # what the variants were generated from, so a changed image_url gets mirrored again
+    image_source = models.CharField(max_length=500, blank=True, default="")
     instructions = models.TextField()
+    # the two text fields above split into lines once at save time, see save()
+    ingredient_lines = models.JSONField(default=list, blank=True)
+    instruction_steps = models.JSONField(default=list, blank=True)
     prep_time = models.PositiveIntegerField(default=0)
     cooking_time = models.PositiveIntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # sha256 of the normalized API data last written, lets ingestion skip unchanged recipes
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+
+    # set when the recipe is a near-duplicate of an older one, see recipes.dedupe
+    duplicate_of = models.ForeignKey(
+        "self",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="duplicates",
+    )
+
+    # weighted tsvector over title (A), description (B) and ingredients (C), maintained by a
+    # database trigger so bulk writes keep it current too, see recipes.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # kept in step with ratings.Rating writes, see ratings.aggregates
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    avg_rating = models.FloatField(default=0.0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-avg_rating", "-rating_count"], name="recipe_top_rated_idx"),
+            GinIndex(fields=["category"], name="recipe_category_gin"),
+            GinIndex(fields=["diet"], name="recipe_diet_gin"),
+            GinIndex(fields=["search_vector"], name="recipe_search_vector_gin"),
+            # pg_trgm, serves the fuzzy title matching of recipes.search.suggest
+            GinIndex(fields=["title"], name="recipe_title_trgm", opclasses=["gin_trgm_ops"]),
+        ]
+
     def __str__(self):
         return self.title
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            base_slug = slugify(self.title)
-            slug = base_slug
-            counter = 1
-
-            while Recipe.objects.filter(slug=slug).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
-        super().save(*args, **kwargs)
-
-    def avg_rating(self):
-        """Calculates the average rating of a recipe and returns as a dictionary"""
-        ratings = self.ratings.all()
-        return ratings.aggregate(avg_rating=Avg("rating"))["avg_rating"] or 0
-
-    def total_ratings(self):
-        """Returns the total number of ratings for a recipe"""
-        return self.ratings.count()
+        self.ingredient_lines = split_lines(self.ingredients)
+        self.instruction_steps = split_lines(self.instructions)
+
+        if self.slug:
+            return super().save(*args, **kwargs)
+
+        for attempt in range(SLUG_RETRIES):
+            self.slug = Recipe.allocate_slugs([self.title])[0]
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                slug, self.slug = self.slug, ""
+                # Only a slug taken since it was allocated is worth another attempt
+                if attempt == SLUG_RETRIES - 1 or not Recipe.objects.filter(slug=slug).exists():
+                    raise
+
+    @classmethod
+    def allocate_slugs(cls, titles):
+        """
+        Allocates a unique slug for each title with one query, whatever the number of titles.
+        The highest suffix in use per base slug is found by an aggregate over the prefix-indexed
+        slug column, titles sharing a base within the batch get consecutive suffixes
+        """
+        bases = [slugify(title) or "recipe" for title in titles]
+        distinct_bases = sorted(set(bases))
+        if not distinct_bases:
+            return []
+
+        # 0 for the bare base, n for base-n, NULL when neither is taken
+        suffixes = cls.objects.filter(
+            reduce(or_, (Q(slug=base) | Q(slug__startswith=f"{base}-") for base in distinct_bases))
+        ).aggregate(**{
+            f"base_{index}": Max(Case(
+                When(slug=base, then=Value(0)),
+                # Longer suffixes are left out, they would overflow the bigint cast
+                When(
+                    slug__regex=rf"^{re.escape(base)}-[0-9]{{1,18}}$",
+                    then=Cast(Substr("slug", len(base) + 2), BigIntegerField()),
+                ),
+                output_field=BigIntegerField(),
+            ))
+            for index, base in enumerate(distinct_bases)
+        })
+
+        next_suffix = {
+            base: 0 if suffixes[f"base_{index}"] is None else suffixes[f"base_{index}"] + 1
+            for index, base in enumerate(distinct_bases)
+        }
+
+        slugs = []
+        for base in bases:
+            counter = next_suffix[base]
+            slugs.append(f"{base}-{counter}" if counter else base)
+            next_suffix[base] = counter + 1
+
+        return slugs
+
+    def image_srcset(self, fmt):
+        """srcset of the stored variants in one format, smallest first"""
+        return ", ".join(
+            f"{default_storage.url(formats[fmt])} {width}w"
+            for width, formats in sorted(self.image_variants.items(), key=lambda item: int(item[0]))
+            if fmt in formats
+        )
+
+    def webp_srcset(self):
+        return self.image_srcset("webp")
+
+    def jpeg_srcset(self):
+        return self.image_srcset("jpeg")
+
+    def display_image_url(self):
+        """Largest JPEG variant, falling back to the uploaded image and then the remote url"""
+        if self.image_variants:
+            widest = max(self.image_variants, key=int)
+            return default_storage.url(self.image_variants[widest]["jpeg"])
+        if self.image:
+            return self.image.url
+        return self.image_url or None
 
     def display_category(self):
         """Returns the category in a human readable format eg Main Course instead of ['main course']"""
@@ -124,3 +245,165 @@ class NutritionalValue(models.Model):
 
     def __str__(self):
         return f"Nutritional values for {self.recipe}"
+
+
+class Ingredient(models.Model):
+    """Canonical ingredient name shared by every recipe using it, see recipes.ingredients"""
+
+    name = models.CharField(max_length=200, unique=True)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["name"], name="ingredient_name_trgm", opclasses=["gin_trgm_ops"]),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class RecipeIngredient(models.Model):
+    """One parsed line of a recipe's ingredients text"""
+
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name="parsed_ingredients")
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, related_name="recipe_ingredients")
+    position = models.PositiveSmallIntegerField()
+    quantity = models.FloatField(blank=True, null=True)
+    unit = models.CharField(max_length=20, blank=True)
+    text = models.TextField()
+
+    class Meta:
+        ordering = ["recipe", "position"]
+        constraints = [
+            models.UniqueConstraint(fields=["recipe", "position"], name="unique_recipe_ingredient_position"),
+        ]
+        indexes = [
+            # "recipes containing X" goes ingredient -> recipe ids without touching recipe rows
+            models.Index(fields=["ingredient", "recipe"], name="recipe_ingredient_lookup_idx"),
+        ]
+
+    def __str__(self):
+        return self.text
+
+
+class RecipeNeighbour(models.Model):
+    """One of a recipe's most similar recipes by ingredients, category and diet, written by recipes.similar"""
+
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name="neighbours")
+    neighbour = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name="+")
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ["recipe", "rank"]
+        constraints = [
+            # Also the index the detail page reads a recipe's list through
+            models.UniqueConstraint(fields=["recipe", "rank"], name="unique_recipe_neighbour_rank"),
+        ]
+
+    def __str__(self):
+        return f"{self.recipe_id} -> {self.neighbour_id}"
+
+
+class RecipeSignature(models.Model):
+    """MinHash signature of a recipe's ingredients and title, used for near-duplicate detection"""
+
+    recipe = models.OneToOneField(
+        Recipe, on_delete=models.CASCADE, primary_key=True, related_name="signature"
+    )
+    minhash = ArrayField(models.BigIntegerField())
+
+    def __str__(self):
+        return f"Signature for {self.recipe_id}"
+
+
+class RecipeLSHBucket(models.Model):
+    """One LSH band bucket of a recipe signature. Recipes sharing a bucket are duplicate candidates"""
+
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name="lsh_buckets")
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=["bucket", "band"])]
+
+    def __str__(self):
+        return f"Band {self.band} bucket {self.bucket} for {self.recipe_id}"
+
+
+class IngestionCursor(models.Model):
+    """
+    Persisted position of Spoonacular ingestion so it resumes where it stopped after worker restarts.
+    Pages are walked in a deterministic sort, one query set (e.g. a dish type) at a time
+    """
+
+    name = models.CharField(max_length=50, unique=True, default="default")
+    sort = models.CharField(max_length=30, default="popularity")
+    sort_direction = models.CharField(max_length=4, default="desc")
+
+    # query set currently being walked and the next offset to claim in it
+    current_query = models.JSONField(default=dict, blank=True)
+    offset = models.PositiveIntegerField(default=0)
+
+    # {query key: {"offset": int, "total": int | None, "done": bool}}
+    query_progress = models.JSONField(default=dict, blank=True)
+
+    last_run_at = models.DateTimeField(blank=True, null=True)
+    last_run_stats = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Ingestion cursor {self.name} at offset {self.offset}"
+
+    @staticmethod
+    def query_key(query):
+        return json.dumps(query, sort_keys=True)
+
+    @classmethod
+    def claim_page(cls, query_sets, batch_size, name="default"):
+        """
+        Atomically hands out the next page to fetch and moves the cursor past it,
+        so two workers never fetch the same page. Returns (cursor, query, offset)
+        """
+        with transaction.atomic():
+            cursor, _ = cls.objects.select_for_update().get_or_create(name=name)
+
+            pending = [
+                query for query in query_sets
+                if not cursor.query_progress.get(cls.query_key(query), {}).get("done")
+            ]
+            if not pending:
+                # Every query set was walked to the end, start a new pass
+                cursor.query_progress = {}
+                pending = list(query_sets)
+
+            query = pending[0]
+            progress = cursor.query_progress.setdefault(
+                cls.query_key(query), {"offset": 0, "total": None, "done": False}
+            )
+            offset = progress["offset"]
+            progress["offset"] = offset + batch_size
+
+            cursor.current_query = query
+            cursor.offset = progress["offset"]
+            cursor.save()
+
+        return cursor, query, offset
+
+    @classmethod
+    def record_page(cls, query, offset, fetched, total, stats, name="default"):
+        """Stores the result of a fetched page and marks its query set done once walked to the end"""
+        with transaction.atomic():
+            cursor, _ = cls.objects.select_for_update().get_or_create(name=name)
+
+            progress = cursor.query_progress.setdefault(
+                cls.query_key(query), {"offset": offset + fetched, "total": None, "done": False}
+            )
+            progress["total"] = total
+            if fetched == 0 or offset + fetched >= total:
+                progress["done"] = True
+
+            cursor.last_run_at = timezone.now()
+            cursor.last_run_stats = {"query": query, "offset": offset, **stats}
+            cursor.save()
+
+        return cursor
@@ -0,0 +1,214 @@
+import os
+import threading
+import numpy as np
+from django.conf import settings
+from . import changelog
+from .models import NutritionalValue
+from .persistence import NUTRITION_FIELDS
+
+# Columns compared by the "similar macro profile" lookup
+MACRO_FIELDS = ["calories_kcal", "protein", "fat", "carbs", "fiber", "sugars"]
+
+# Rows of a sort order checked against the filter at a time when walking it for an ordered page
+ORDER_CHUNK = 65536
+
+ROW_DTYPE = np.dtype([("recipe_id", np.int64)] + [(field, np.float32) for field in NUTRITION_FIELDS])
+
+
+def load_rows(recipe_ids=None):
+    """Nutrition of listed recipes as (sorted recipe ids, float32 array with one row per field)"""
+    rows = NutritionalValue.objects.filter(recipe__duplicate_of__isnull=True)
+    if recipe_ids is not None:
+        rows = rows.filter(recipe_id__in=recipe_ids)
+    rows = rows.order_by("recipe_id").values_list("recipe_id", *NUTRITION_FIELDS)
+
+    data = np.fromiter(rows.iterator(chunk_size=10000), dtype=ROW_DTYPE)
+    return data["recipe_id"], np.vstack([data[field] for field in NUTRITION_FIELDS])
+
+
+class NutritionIndex:
+    """
+    Column store of recipe nutrition: recipe_ids is sorted and columns holds one contiguous float32
+    row per field of NUTRITION_FIELDS, so a range filter is a few vector comparisons over whole columns
+    """
+
+    def __init__(self, recipe_ids, columns, sequence=0):
+        self.recipe_ids = recipe_ids
+        self.columns = columns
+        self.sequence = sequence
+        self.reset_derived()
+
+    def reset_derived(self):
+        self._orders = {}
+        self._profiles = None
+        self._norms = None
+
+    @classmethod
+    def build(cls):
+        # Read first, so changes committed while loading are replayed rather than lost
+        sequence = changelog.latest()
+        return cls(*load_rows(), sequence)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["recipe_ids"], data["columns"], int(data["sequence"]))
+
+    def save(self, path):
+        # Written aside and renamed, so readers never load a half-written snapshot
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as f:
+            np.savez(f, recipe_ids=self.recipe_ids, columns=self.columns, sequence=np.int64(self.sequence))
+        os.replace(temporary, path)
+
+    def apply(self, recipe_ids):
+        """Reloads the rows of changed recipes, removed and near-duplicate ones drop out"""
+        ids, columns = load_rows(recipe_ids)
+        keep = ~np.isin(self.recipe_ids, np.fromiter(recipe_ids, dtype=np.int64))
+
+        merged_ids = np.concatenate([self.recipe_ids[keep], ids])
+        order = np.argsort(merged_ids, kind="stable")
+        self.recipe_ids = merged_ids[order]
+        self.columns = np.concatenate([self.columns[:, keep], columns], axis=1)[:, order]
+        self.reset_derived()
+
+    def column(self, field):
+        return self.columns[NUTRITION_FIELDS.index(field)]
+
+    def search(self, ranges, limit, offset=0, ordering=None):
+        """
+        Recipes whose values fall in every {field: (min, max)} range, either bound may be None.
+        Ordered by recipe id or by a field ("protein", "-protein"). Returns (count, page of recipe ids)
+        """
+        mask = np.ones(len(self.recipe_ids), dtype=bool)
+        for field, (low, high) in ranges.items():
+            column = self.column(field)
+            if low is not None:
+                mask &= column >= low
+            if high is not None:
+                mask &= column <= high
+
+        end = offset + limit
+        if not ordering:
+            return int(np.count_nonzero(mask)), self.recipe_ids[np.flatnonzero(mask)[offset:end]].tolist()
+
+        # Walk the field's sort order until enough rows passed the filter, instead of sorting the matches
+        order = self.sort_order(ordering)
+        pages, found = [], 0
+        for start in range(0, len(order), ORDER_CHUNK):
+            chunk = order[start:start + ORDER_CHUNK]
+            chunk = chunk[mask[chunk]]
+            pages.append(chunk)
+            found += len(chunk)
+            if found >= end:
+                break
+
+        positions = np.concatenate(pages) if pages else order
+        return int(np.count_nonzero(mask)), self.recipe_ids[positions[offset:end]].tolist()
+
+    def sort_order(self, ordering):
+        """Row positions sorted by a field ("protein" or "-protein"), ties by recipe id, computed once per snapshot"""
+        if ordering not in self._orders:
+            column = self.column(ordering.lstrip("-"))
+            self._orders[ordering] = np.argsort(-column if ordering.startswith("-") else column, kind="stable")
+        return self._orders[ordering]
+
+    def profiles(self):
+        """
+        Macro columns scaled to unit variance so kcal and grams weigh alike, with the squared norm of
+        every profile. Computed once per snapshot
+        """
+        if self._profiles is None:
+            macros = np.vstack([self.column(field) for field in MACRO_FIELDS])
+            scale = macros.std(axis=1, keepdims=True)
+            scale[scale == 0] = 1
+            self._profiles = (macros / scale).astype(np.float32)
+            self._norms = np.einsum("ij,ij->j", self._profiles, self._profiles)
+        return self._profiles, self._norms
+
+    def similar(self, recipe_id, k):
+        """
+        The k recipes nearest to recipe_id by macro profile, as (recipe id, distance) pairs,
+        or None when the recipe has no nutrition row
+        """
+        position = int(np.searchsorted(self.recipe_ids, recipe_id))
+        if position == len(self.recipe_ids) or self.recipe_ids[position] != recipe_id:
+            return None
+
+        k = min(k, len(self.recipe_ids) - 1)
+        if k <= 0:
+            return []
+
+        # |p - t|² = |p|² - 2 p·t + |t|², the constant |t|² doesn't change the order
+        profiles, norms = self.profiles()
+        target = profiles[:, position]
+        scores = norms.copy()
+        product = np.empty_like(scores)
+        for row, value in zip(profiles, target):
+            np.multiply(row, 2 * value, out=product)
+            scores -= product
+        scores[position] = np.inf
+
+        # The k-th best score of every 64th row bounds the k-th best overall, so only rows
+        # under it need a partial sort
+        sample = scores[::64]
+        candidates = np.arange(len(scores))
+        if len(sample) > k:
+            candidates = np.flatnonzero(scores <= np.partition(sample, k - 1)[k - 1])
+
+        top = candidates[np.argpartition(scores[candidates], k - 1)[:k]]
+        distances = np.sqrt(((profiles[:, top] - target[:, None]) ** 2).sum(axis=0))
+        order = np.lexsort((self.recipe_ids[top], distances))
+        return [(int(self.recipe_ids[top[i]]), float(distances[i])) for i in order.tolist()]
+
+def refresh():
+    """
+    Brings the snapshot at NUTRITION_INDEX_PATH up to date by replaying the recipe change log,
+    or rebuilds it when the log can't be replayed. Runs in refresh_nutrition_index on a worker,
+    web processes only see the file if NUTRITION_INDEX_PATH is on storage shared with them
+    """
+    path = settings.NUTRITION_INDEX_PATH
+    try:
+        index = NutritionIndex.load(path)
+    except (OSError, ValueError, KeyError):
+        index = None
+
+    if index is not None:
+        latest = changelog.latest()
+        if latest == index.sequence:
+            return index
+
+        sequence, changed, complete = changelog.read(index.sequence, latest)
+        if latest > index.sequence and complete:
+            index.apply(changed)
+            index.sequence = sequence
+        else:
+            index = None
+
+    if index is None:
+        index = NutritionIndex.build()
+
+    index.save(path)
+    return index
+
+
+_index = None
+_version = None
+_lock = threading.Lock()
+
+
+def current():
+    """The latest snapshot, reloaded whenever the task replaced the file. None before the first refresh"""
+    global _index, _version
+
+    path = settings.NUTRITION_INDEX_PATH
+    try:
+        version = (path, os.stat(path).st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+    with _lock:
+        if version != _version:
+            _index = NutritionIndex.load(path)
+            _version = version
+        return _index
@@ -0,0 +1,192 @@
+import threading
+import time
+from array import array
+import numpy as np
+from django.conf import settings
+from . import changelog
+from .ingredients import canonical_name
+from .models import Ingredient, RecipeIngredient
+
+# Seconds a change log entry may be missing before it is taken as expired rather than not yet written
+LOG_GRACE = 2
+
+EMPTY = np.empty(0, dtype=np.int32)
+
+
+def listed_pairs(recipe_ids=None):
+    """Distinct (recipe id, ingredient id) pairs of recipes that are not near-duplicates"""
+    pairs = RecipeIngredient.objects.filter(recipe__duplicate_of__isnull=True)
+    if recipe_ids is not None:
+        pairs = pairs.filter(recipe_id__in=recipe_ids)
+    return pairs.order_by().values_list("recipe_id", "ingredient_id").distinct()
+
+
+class PantryIndex:
+    """
+    Inverted index from ingredient to the recipes using it, held in memory.
+    Recipes live in slots: postings are sorted int32 slot arrays and sizes holds the number of
+    distinct ingredients per slot. A changed recipe gets a new slot at the end, which keeps every
+    posting sorted, and its old slot is dropped by zeroing its size
+    """
+
+    def __init__(self):
+        self.slot_recipe = np.empty(0, dtype=np.int64)
+        self.sizes = EMPTY
+        self.slots = {}
+        self.postings = {}
+        self.names = {}
+        self.words = {}
+        self.dropped = 0
+        self.sequence = 0
+        self.missing_since = None
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        # Read first, so changes committed while loading are replayed rather than lost
+        index.sequence = changelog.latest()
+
+        recipe_ids, ingredient_ids = array("q"), array("q")
+        for recipe_id, ingredient_id in listed_pairs().iterator(chunk_size=10000):
+            recipe_ids.append(recipe_id)
+            ingredient_ids.append(ingredient_id)
+
+        recipes = np.frombuffer(recipe_ids, dtype=np.int64) if recipe_ids else np.empty(0, dtype=np.int64)
+        ingredients = np.frombuffer(ingredient_ids, dtype=np.int64) if ingredient_ids else np.empty(0, dtype=np.int64)
+
+        index.slot_recipe, slots = np.unique(recipes, return_inverse=True)
+        index.sizes = np.bincount(slots, minlength=len(index.slot_recipe)).astype(np.int32)
+        index.slots = {recipe_id: slot for slot, recipe_id in enumerate(index.slot_recipe.tolist())}
+
+        order = np.lexsort((slots, ingredients))
+        ingredients, slots = ingredients[order], slots[order].astype(np.int32)
+        keys, starts = np.unique(ingredients, return_index=True)
+        index.postings = dict(zip(keys.tolist(), np.split(slots, starts[1:]))) if len(keys) else {}
+
+        index.add_names(Ingredient.objects.values_list("id", "name"))
+        return index
+
+    def add_names(self, rows):
+        for ingredient_id, name in rows:
+            self.names[ingredient_id] = name
+            for word in name.split():
+                self.words.setdefault(word, set()).add(ingredient_id)
+
+    def apply(self, recipe_ids):
+        """Reloads the ingredients of changed recipes, removed and near-duplicate ones drop out"""
+        for recipe_id in recipe_ids:
+            slot = self.slots.pop(recipe_id, None)
+            if slot is not None:
+                self.sizes[slot] = 0
+                self.dropped += 1
+
+        grouped = {}
+        for recipe_id, ingredient_id in listed_pairs(recipe_ids):
+            grouped.setdefault(recipe_id, []).append(ingredient_id)
+        if not grouped:
+            return
+
+        unknown = {ingredient_id for ingredients in grouped.values() for ingredient_id in ingredients} - self.names.keys()
+        if unknown:
+            self.add_names(Ingredient.objects.filter(id__in=unknown).values_list("id", "name"))
+
+        start = len(self.slot_recipe)
+        new_slots = {}
+        for slot, (recipe_id, ingredients) in enumerate(sorted(grouped.items()), start):
+            self.slots[recipe_id] = slot
+            for ingredient_id in ingredients:
+                new_slots.setdefault(ingredient_id, []).append(slot)
+
+        self.slot_recipe = np.concatenate([self.slot_recipe, np.array(sorted(grouped), dtype=np.int64)])
+        self.sizes = np.concatenate([
+            self.sizes, np.array([len(grouped[recipe_id]) for recipe_id in sorted(grouped)], dtype=np.int32)
+        ])
+        for ingredient_id, slots in new_slots.items():
+            self.postings[ingredient_id] = np.concatenate(
+                [self.postings.get(ingredient_id, EMPTY), np.array(slots, dtype=np.int32)]
+            )
+
+    def needs_compaction(self):
+        return self.dropped > settings.PANTRY_COMPACT_RATIO * max(len(self.slot_recipe), 1)
+
+    def resolve(self, term):
+        """Ingredient ids whose name contains the term as whole words, like ingredients.matching_ingredients"""
+        term = canonical_name(term)
+        if not term:
+            return set()
+
+        candidates = set.intersection(*(self.words.get(word, set()) for word in term.split()))
+        return {
+            ingredient_id for ingredient_id in candidates
+            if f" {term} " in f" {self.names[ingredient_id]} "
+        }
+
+    def match(self, terms, limit, max_missing=None):
+        """
+        Recipes using any of the pantry terms, fewest missing ingredients first, then by the share
+        of their ingredients covered. Returns (recipe id, matched, missing, coverage) tuples
+        """
+        ingredient_ids = set().union(*(self.resolve(term) for term in terms))
+        postings = [self.postings[ingredient_id] for ingredient_id in ingredient_ids if ingredient_id in self.postings]
+        if not postings:
+            return []
+
+        # Each ingredient occurs once per recipe, so counting slots counts covered ingredients
+        matched = np.bincount(np.concatenate(postings), minlength=len(self.sizes))
+        candidates = np.flatnonzero((matched > 0) & (self.sizes > 0))
+        missing = self.sizes[candidates] - matched[candidates]
+        if max_missing is not None:
+            keep = missing <= max_missing
+            candidates, missing = candidates[keep], missing[keep]
+        if not len(candidates):
+            return []
+
+        coverage = matched[candidates] / self.sizes[candidates]
+        # Coverage is in (0, 1] and only 1 without missing ingredients, so this orders by missing then coverage
+        score = missing - coverage
+        if len(score) > limit:
+            top = np.argpartition(score, limit - 1)[:limit]
+        else:
+            top = np.arange(len(score))
+        top = top[np.lexsort((self.slot_recipe[candidates[top]], score[top]))]
+
+        return [
+            (int(self.slot_recipe[slot]), int(matched[slot]), int(missing[position]), float(coverage[position]))
+            for position, slot in zip(top.tolist(), candidates[top].tolist())
+        ]
+
+    def sync(self):
+        """
+        Replays change log entries newer than the index. Returns False when the index has to be
+        rebuilt: the log was reset, fell too far behind or an entry expired
+        """
+        latest = changelog.latest()
+        if latest < self.sequence or latest - self.sequence > settings.PANTRY_LOG_MAX_REPLAY:
+            return False
+        if latest == self.sequence:
+            return True
+
+        self.sequence, changed, complete = changelog.read(self.sequence, latest)
+        if complete:
+            self.missing_since = None
+        else:
+            self.missing_since = self.missing_since or time.monotonic()
+            if time.monotonic() - self.missing_since > LOG_GRACE:
+                return False
+
+        if changed:
+            self.apply(changed)
+        return not self.needs_compaction()
+
+_index = None
+_lock = threading.Lock()
+
+
+def match(terms, limit, max_missing=None):
+    """Pantry matches from this process's index, built on first use and kept current through the log"""
+    global _index
+
+    with _lock:
+        if _index is None or not _index.sync():
+            _index = PantryIndex.build()
+        return _index.match(terms, limit, max_missing)
@@ -0,0 +1,136 @@
+import hashlib
+import json
+from django.db import IntegrityError, transaction
+from .models import Recipe, NutritionalValue, SLUG_RETRIES
+from .dedupe import index_recipes
+from .ingredients import index_ingredients
+from . import changelog, search
+
+# Columns rewritten when an ingested recipe already exists. The slug is left alone so urls stay stable
+RECIPE_UPDATE_FIELDS = [
+    "title",
+    "category",
+    "diet",
+    "cooking_time",
+    "image_url",
+    "ingredients",
+    "servings",
+    "instructions",
+    "ingredient_lines",
+    "instruction_steps",
+    "description",
+    "author",
+    "content_hash",
+    "updated_at",
+]
+
+NUTRITION_FIELDS = [
+    "calories_kcal",
+    "protein",
+    "fat",
+    "carbs",
+    "fiber",
+    "sugars",
+    "sodium",
+    "cholesterol",
+    "calcium",
+    "iron",
+    "vitamin_c",
+]
+
+
+def fingerprint(normalized):
+    """Stable hash over the normalized fields and nutrition of a recipe"""
+    content = json.dumps(
+        {"fields": normalized["fields"], "nutrition": normalized["nutrition"]},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def bulk_upsert_recipes(normalized):
+    """
+    Writes a batch of normalized recipes (see tasks.normalize_recipe) in one transaction.
+    Recipes are upserted on api_id and their nutrition rows on recipe, so the number of
+    queries stays the same however large the batch is. Recipes whose content fingerprint
+    didn't change are not written at all. The batch is retried with fresh slugs if a concurrent
+    writer takes one of them first. Returns the written Recipe objects
+    """
+    # Last occurrence wins if the same recipe shows up twice in a batch
+    by_api_id = {item["api_id"]: item for item in normalized}
+    if not by_api_id:
+        return []
+
+    hashes = {api_id: fingerprint(item) for api_id, item in by_api_id.items()}
+
+    for attempt in range(SLUG_RETRIES):
+        try:
+            with transaction.atomic():
+                return upsert_batch(by_api_id, hashes)
+        except IntegrityError:
+            # A concurrent writer took one of the allocated slugs, allocate them again
+            if attempt == SLUG_RETRIES - 1:
+                raise
+
+
+def upsert_batch(by_api_id, hashes):
+    """One attempt at writing a deduplicated batch, see bulk_upsert_recipes"""
+    existing = {
+        api_id: (slug, content_hash)
+        for api_id, slug, content_hash in Recipe.objects.filter(
+            api_id__in=by_api_id
+        ).values_list("api_id", "slug", "content_hash")
+    }
+    existing_slugs = {api_id: slug for api_id, (slug, _) in existing.items()}
+
+    by_api_id = {
+        api_id: item for api_id, item in by_api_id.items()
+        if api_id not in existing or existing[api_id][1] != hashes[api_id]
+    }
+    if not by_api_id:
+        return []
+
+    new_items = [item for api_id, item in by_api_id.items() if api_id not in existing_slugs]
+    new_slugs = dict(zip(
+        (item["api_id"] for item in new_items),
+        Recipe.allocate_slugs([item["fields"]["title"] for item in new_items]),
+    ))
+
+    recipes = [
+        Recipe(
+            api_id=api_id,
+            slug=existing_slugs.get(api_id) or new_slugs[api_id],
+            content_hash=hashes[api_id],
+            **item["fields"],
+        )
+        for api_id, item in by_api_id.items()
+    ]
+    Recipe.objects.bulk_create(
+        recipes,
+        update_conflicts=True,
+        unique_fields=["api_id"],
+        update_fields=RECIPE_UPDATE_FIELDS,
+    )
+
+    nutrition = [
+        NutritionalValue(recipe_id=recipe.pk, **by_api_id[recipe.api_id]["nutrition"])
+        for recipe in recipes
+        if by_api_id[recipe.api_id]["nutrition"] is not None
+    ]
+    if nutrition:
+        NutritionalValue.objects.bulk_create(
+            nutrition,
+            update_conflicts=True,
+            unique_fields=["recipe"],
+            update_fields=NUTRITION_FIELDS,
+        )
+
+    # bulk_create skips post_save, so keep the near-duplicate and ingredient indexes current here
+    index_recipes(recipes)
+    index_ingredients(recipes)
+    transaction.on_commit(search.invalidate)
+    recipe_ids = [recipe.pk for recipe in recipes]
+    transaction.on_commit(lambda: changelog.log_changes(recipe_ids))
+
+    return recipes
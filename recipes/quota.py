@@ -0,0 +1,79 @@
+from datetime import date
+from django.conf import settings
+from django.core.cache import cache
+
+# Counters outlive the day they count so late workers never see a fresh key by mistake
+QUOTA_TTL = 60 * 60 * 25
+
+
+def daily_limit():
+    return settings.SPOONACULAR_DAILY_LIMIT
+
+
+def claimed_key(day=None):
+    """Calls reserved today, including ones still in flight"""
+    return f"spoonacular_calls_{day or date.today()}"
+
+
+def exhausted_key(day=None):
+    """Set when the API itself reported today's quota as spent"""
+    return f"spoonacular_exhausted_{day or date.today()}"
+
+
+def _incr(key, tokens):
+    """Atomically adds to a counter, creating it first if needed"""
+    cache.add(key, 0, QUOTA_TTL)
+    try:
+        return cache.incr(key, tokens)
+    except ValueError:
+        # The key expired between add and incr
+        cache.add(key, 0, QUOTA_TTL)
+        return cache.incr(key, tokens)
+
+
+def reserve(tokens=1):
+    """
+    Reserves API calls before making them. The check and the increment are a single
+    atomic incr, so several workers can never reserve more than the daily limit between them.
+    Returns False, without holding anything, if the budget is spent
+    """
+    if cache.get(exhausted_key()):
+        return False
+
+    claimed = _incr(claimed_key(), tokens)
+    if claimed > daily_limit():
+        release(tokens)
+        return False
+
+    return True
+
+
+def release(tokens=1):
+    """Returns reserved calls that never reached the API, e.g. on connection errors"""
+    try:
+        claimed = cache.decr(claimed_key(), tokens)
+    except ValueError:
+        return
+
+    # Releases racing a day rollover or a reset can't push the counter below zero
+    if claimed < 0:
+        _incr(claimed_key(), -claimed)
+
+
+def exhaust():
+    """
+    Marks today's budget as spent, used when the API itself reports the quota is gone.
+    Kept apart from the counter, so calls released afterwards don't reopen the budget
+    """
+    cache.set(exhausted_key(), True, QUOTA_TTL)
+
+
+def calls_used():
+    if cache.get(exhausted_key()):
+        return daily_limit()
+    return min(cache.get(claimed_key(), 0), daily_limit())
+
+
+def remaining():
+    """Number of calls that can still be reserved today"""
+    return max(daily_limit() - calls_used(), 0)
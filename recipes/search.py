@@ -0,0 +1,138 @@
+import hashlib
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import BigIntegerField, BooleanField, Case, Exists, F, Func, IntegerField, OuterRef, Value, When
+from django.db.models.functions import Cast
+from .models import Ingredient, Recipe, RecipeIngredient
+
+# Must match the configuration of the recipes_recipe_search_vector trigger
+SEARCH_CONFIG = "english"
+
+VERSION_KEY = "recipe_search_version"
+
+# Shorter prefixes match too much of the catalog to be useful suggestions
+SUGGEST_MIN_LENGTH = 2
+
+
+class ArrayPosition(Func):
+    """Position of a column value in a literal array, keeps rows in a precomputed order"""
+
+    function = "array_position"
+    output_field = IntegerField()
+
+
+def normalize_query(query):
+    return " ".join((query or "").lower().split())
+
+
+def version():
+    return cache.get_or_set(VERSION_KEY, 1, timeout=None)
+
+
+def invalidate():
+    """Drops every cached result list at once by moving to a new cache key version"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+
+
+def ranked_ids(query):
+    """
+    Ids of listed recipes matching a web-style query ("chicken -curry", "\"olive oil\""),
+    best first. The search_vector GIN index finds the matches and only those get ranked.
+    Results are cached per normalized query until any recipe changes
+    """
+    query = normalize_query(query)
+    if not query:
+        return []
+
+    key = f"recipe_search:{version()}:{hashlib.sha1(query.encode()).hexdigest()}"
+    ids = cache.get(key)
+    if ids is None:
+        search_query = SearchQuery(query, search_type="websearch", config=SEARCH_CONFIG)
+        ids = list(
+            Recipe.objects.filter(search_vector=search_query, duplicate_of__isnull=True)
+            .annotate(rank=SearchRank(F("search_vector"), search_query))
+            .order_by("-rank", "-avg_rating", "id")
+            .values_list("id", flat=True)[:settings.SEARCH_MAX_RESULTS]
+        )
+        cache.set(key, ids, settings.SEARCH_CACHE_TIMEOUT)
+
+    return ids
+
+
+def order_by_ids(queryset, ids):
+    """Restricts a queryset to ids and orders it like the list"""
+    return (
+        queryset.filter(pk__in=ids)
+        .annotate(search_position=ArrayPosition(Cast(Value(ids), ArrayField(BigIntegerField())), F("id")))
+        .order_by("search_position")
+    )
+
+
+def search_page(query, page_number, per_page=12):
+    """A Page of ranked recipes for the HTML search view"""
+    page = Paginator(ranked_ids(query), per_page).get_page(page_number)
+    recipes = Recipe.objects.in_bulk(page.object_list)
+    page.object_list = [recipes[recipe_id] for recipe_id in page.object_list if recipe_id in recipes]
+    return page
+
+
+def starts_with(field, query):
+    return Case(When(**{f"{field}__istartswith": query}, then=Value(True)), default=Value(False),
+                output_field=BooleanField())
+
+
+def suggest(query, limit):
+    """
+    Up to limit completions of a partial query from listed recipe titles and canonical ingredient
+    names. Prefix matches come first, then close matches by word trigram similarity, so misspellings
+    like "choclate" still complete. Both lookups use the pg_trgm GIN indexes, which Postgres keeps
+    current on every write; cached results are dropped together with the search cache
+    """
+    query = normalize_query(query)
+    if len(query) < SUGGEST_MIN_LENGTH:
+        return []
+
+    key = f"recipe_suggest:{version()}:{limit}:{hashlib.sha1(query.encode()).hexdigest()}"
+    suggestions = cache.get(key)
+    if suggestions is not None:
+        return suggestions
+
+    titles = (
+        Recipe.objects.filter(duplicate_of__isnull=True, title__trigram_word_similar=query)
+        .annotate(prefix=starts_with("title", query), similarity=TrigramWordSimilarity(query, "title"))
+        .order_by("-prefix", "-similarity", "-avg_rating", "id")
+        .values_list("prefix", "similarity", "title", "slug")[:limit]
+    )
+    ingredients = (
+        Ingredient.objects.filter(name__trigram_word_similar=query)
+        .filter(Exists(RecipeIngredient.objects.filter(ingredient=OuterRef("pk"))))
+        .annotate(prefix=starts_with("name", query), similarity=TrigramWordSimilarity(query, "name"))
+        .order_by("-prefix", "-similarity", "name")
+        .values_list("prefix", "similarity", "name")[:limit]
+    )
+
+    candidates = [(prefix, similarity, "recipe", title, slug) for prefix, similarity, title, slug in titles]
+    candidates += [(prefix, similarity, "ingredient", name, None) for prefix, similarity, name in ingredients]
+    # Stable sort keeps the database order (rating, then name) among equal scores
+    candidates.sort(key=lambda candidate: (not candidate[0], -candidate[1]))
+
+    suggestions, seen = [], set()
+    for _, _, kind, text, slug in candidates:
+        if (kind, text.lower()) in seen:
+            continue
+        seen.add((kind, text.lower()))
+
+        suggestion = {"text": text, "type": kind}
+        if slug:
+            suggestion["slug"] = slug
+        suggestions.append(suggestion)
+    suggestions = suggestions[:limit]
+
+    cache.set(key, suggestions, settings.SEARCH_CACHE_TIMEOUT)
+    return suggestions
@@ -1,3 +1,4 @@
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 from .models import Recipe, NutritionalValue
 
@@ -26,6 +27,8 @@ class RecipeSerializer(serializers.ModelSerializer):
     author = serializers.StringRelatedField(read_only=True)
     nutritional_value = NutritionalValueSerializer(read_only=True)
     average_rating = serializers.SerializerMethodField(read_only=True)
+    total_ratings = serializers.IntegerField(source="rating_count", read_only=True)
+    image_variants = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Recipe
@@ -39,24 +42,38 @@ class RecipeSerializer(serializers.ModelSerializer):
             "description",
             "servings",
             "ingredients",
+            "ingredient_lines",
             "image",
+            "image_url",
+            "image_variants",
+            "image_placeholder",
+            "image_width",
+            "image_height",
             "instructions",
+            "instruction_steps",
             "prep_time",
             "cooking_time",
             "average_rating",
             "total_ratings",
             "nutritional_value",
         ]
-        read_only_fields = ['authot']
+        read_only_fields = ['authot', 'image_url', 'image_placeholder', 'image_width', 'image_height', 'ingredient_lines', 'instruction_steps']
 
     def get_average_rating(self, obj):
         """Returns the average rating for a recipe"""
         return round(obj.avg_rating, 1) if obj.avg_rating else None
 
-    def get_total_ratings(self, obj):
-        """Returns the total number of ratings for a recipe"""
-        return obj.total_ratings()
-    
+    def get_image_variants(self, obj):
+        """Returns the resized variants as {width: {format: url}}"""
+        request = self.context.get("request")
+        variants = {}
+        for width, formats in obj.image_variants.items():
+            variants[width] = {}
+            for fmt, path in formats.items():
+                url = default_storage.url(path)
+                variants[width][fmt] = request.build_absolute_uri(url) if request else url
+        return variants
+
     def create(self, validated_data):
         """Sets author to current user"""
         validated_data['author'] = self.context['request'].user
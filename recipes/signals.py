@@ -0,0 +1,90 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .dedupe import index_recipes
+from .ingredients import index_ingredients
+from .models import NutritionalValue, Recipe
+from . import changelog, search
+from .tasks import process_recipe_image
+
+
+def cleared_image_fields():
+    return {
+        "image_variants": {},
+        "image_placeholder": "",
+        "image_width": None,
+        "image_height": None,
+        "image_source": "",
+    }
+
+
+@receiver(post_save, sender=Recipe)
+def update_duplicate_index(sender, instance, raw=False, **kwargs):
+    """Keeps the near-duplicate index current for recipes saved one by one, e.g. user uploads"""
+    if not raw:
+        index_recipes([instance])
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_search_cache(sender, instance, raw=False, **kwargs):
+    """
+    Cached search results may now be stale, the database trigger already updated the vector.
+    Dropped once committed, so readers can't cache results from before the change again
+    """
+    if not raw:
+        transaction.on_commit(search.invalidate)
+
+
+@receiver(post_save, sender=Recipe)
+def update_ingredient_index(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Re-parses the ingredient lines of recipes saved one by one, e.g. user uploads and edits"""
+    if raw or (update_fields is not None and "ingredients" not in update_fields):
+        return
+    index_ingredients([instance])
+
+
+@receiver(post_save, sender=Recipe)
+def queue_image_processing(sender, instance, raw=False, **kwargs):
+    """
+    Drops variants built from a replaced or removed upload and processes a new upload in the background.
+    The original file is served until the task has built the variants
+    """
+    if raw:
+        return
+
+    if instance.image:
+        if instance.image_source == instance.image.name:
+            return
+    elif not instance.image_source or instance.image_source == instance.image_url:
+        return
+
+    cleared = cleared_image_fields()
+    Recipe.objects.filter(pk=instance.pk).update(**cleared)
+    for field, value in cleared.items():
+        setattr(instance, field, value)
+
+    if instance.image:
+        recipe_id, name = instance.pk, instance.image.name
+        transaction.on_commit(lambda: process_recipe_image.delay(recipe_id, name))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def log_recipe_change(sender, instance, raw=False, **kwargs):
+    """
+    Lets the in-memory pantry and nutrition indexes patch themselves. Connected last and deferred
+    to commit, so the ingredient rows and duplicate flag they reload are already written
+    """
+    if not raw:
+        recipe_id = instance.pk
+        transaction.on_commit(lambda: changelog.log_changes([recipe_id]))
+
+
+@receiver(post_save, sender=NutritionalValue)
+@receiver(post_delete, sender=NutritionalValue)
+def log_nutrition_change(sender, instance, raw=False, **kwargs):
+    """Nutrition edited on its own, e.g. in the admin or by fetch_detailed_infos"""
+    if not raw:
+        recipe_id = instance.recipe_id
+        transaction.on_commit(lambda: changelog.log_changes([recipe_id]))
@@ -0,0 +1,202 @@
+from array import array
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from . import changelog
+from .models import Recipe, RecipeNeighbour
+from .pantry import listed_pairs
+
+# Change log sequence the stored neighbour lists are current with, a missing key means a full rebuild
+SEQUENCE_KEY = "similar_recipes_seq"
+
+# Categories and diets say less about a dish than its ingredients
+CATEGORY_WEIGHT = 0.5
+DIET_WEIGHT = 0.5
+
+# Recipes searched together, bounds the (recipe, candidate) pairs held at once
+BLOCK_SIZE = 256
+
+# Recipes whose lists are computed and written together during a full rebuild
+STORE_CHUNK = 10000
+
+BATCH_SIZE = 5000
+
+
+def concat_ranges(starts, lengths):
+    """Indices of every range starts[i]:starts[i] + lengths[i], concatenated"""
+    total = int(lengths.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(total)
+
+
+def csr(rows, columns, values, row_count):
+    """(indptr, columns, values) with entries grouped by row"""
+    order = np.lexsort((columns, rows))
+    indptr = np.zeros(row_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=row_count), out=indptr[1:])
+    return indptr, columns[order], values[order]
+
+
+class FeatureMatrix:
+    """
+    TF-IDF vectors of listed recipes over their parsed ingredients, categories and diets, held both
+    by recipe (rows) and by feature (postings). Features in more than SIMILAR_MAX_DF of the recipes
+    are dropped like stop words, vectors are L2 normalized so a dot product is the cosine
+    """
+
+    def __init__(self, recipe_ids, rows, features, weights, feature_count):
+        self.recipe_ids = recipe_ids
+        self.slots = {recipe_id: slot for slot, recipe_id in enumerate(recipe_ids.tolist())}
+        self.row_ptr, self.row_features, self.row_weights = csr(rows, features, weights, len(recipe_ids))
+        self.feature_ptr, self.feature_slots, self.feature_weights = csr(features, rows, weights, feature_count)
+
+    @classmethod
+    def load(cls):
+        recipes = Recipe.objects.filter(duplicate_of__isnull=True).order_by("id").values_list("id", "category", "diet")
+        recipe_ids, rows, features, groups = array("q"), array("q"), array("q"), array("d")
+        labels = {}
+        for slot, (recipe_id, categories, diets) in enumerate(recipes.iterator(chunk_size=10000)):
+            recipe_ids.append(recipe_id)
+            for prefix, values, weight in (("c", categories, CATEGORY_WEIGHT), ("d", diets, DIET_WEIGHT)):
+                for value in values or []:
+                    if value != "none":
+                        rows.append(slot)
+                        features.append(labels.setdefault(f"{prefix}:{value}", len(labels)))
+                        groups.append(weight)
+
+        recipe_ids = np.frombuffer(recipe_ids, dtype=np.int64) if recipe_ids else np.empty(0, dtype=np.int64)
+        slots = {recipe_id: slot for slot, recipe_id in enumerate(recipe_ids.tolist())}
+        ingredient_features = {}
+        for recipe_id, ingredient_id in listed_pairs().iterator(chunk_size=10000):
+            slot = slots.get(recipe_id)
+            if slot is not None:
+                rows.append(slot)
+                features.append(ingredient_features.setdefault(ingredient_id, len(labels) + len(ingredient_features)))
+                groups.append(1.0)
+
+        rows = np.frombuffer(rows, dtype=np.int64) if rows else np.empty(0, dtype=np.int64)
+        features = np.frombuffer(features, dtype=np.int64) if features else np.empty(0, dtype=np.int64)
+        groups = np.frombuffer(groups, dtype=np.float64) if groups else np.empty(0)
+        feature_count = len(labels) + len(ingredient_features)
+
+        df = np.bincount(features, minlength=feature_count)
+        keep = df[features] <= settings.SIMILAR_MAX_DF * max(len(recipe_ids), 1)
+        rows, features = rows[keep], features[keep]
+        weights = np.log(len(recipe_ids) / df[features]) * groups[keep]
+
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=len(recipe_ids)))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights = weights / norms[rows]
+        keep = weights > 0
+        return cls(recipe_ids, rows[keep], features[keep], weights[keep], feature_count)
+
+    def neighbours(self, slots):
+        """
+        Top SIMILAR_RECIPES neighbours of each slot as {slot: (neighbour slots, scores)}, best first.
+        Candidates come from the postings of the recipe's features, features shared by more than
+        SIMILAR_MAX_POSTING recipes are skipped: their idf is low, so they barely move the cosine
+        """
+        lengths = np.diff(self.feature_ptr)
+        limit = settings.SIMILAR_RECIPES
+        result = {}
+
+        for first in range(0, len(slots), BLOCK_SIZE):
+            block = np.asarray(slots[first:first + BLOCK_SIZE], dtype=np.int64)
+            row_lengths = self.row_ptr[block + 1] - self.row_ptr[block]
+            entries = concat_ranges(self.row_ptr[block], row_lengths)
+            queries = np.repeat(np.arange(len(block)), row_lengths)
+            features, weights = self.row_features[entries], self.row_weights[entries]
+
+            usable = lengths[features] <= settings.SIMILAR_MAX_POSTING
+            queries, features, weights = queries[usable], features[usable], weights[usable]
+
+            posting_lengths = lengths[features]
+            postings = concat_ranges(self.feature_ptr[features], posting_lengths)
+            candidates = self.feature_slots[postings]
+            products = self.feature_weights[postings] * np.repeat(weights, posting_lengths)
+            queries = np.repeat(queries, posting_lengths)
+
+            keys, inverse = np.unique(queries * len(self.recipe_ids) + candidates, return_inverse=True)
+            scores = np.bincount(inverse, weights=products)
+            queries, candidates = keys // len(self.recipe_ids), keys % len(self.recipe_ids)
+
+            others = candidates != block[queries]
+            queries, candidates, scores = queries[others], candidates[others], scores[others]
+            order = np.lexsort((candidates, -scores, queries))
+            queries, candidates, scores = queries[order], candidates[order], scores[order]
+
+            _, starts, counts = np.unique(queries, return_index=True, return_counts=True)
+            for query, start, count in zip(queries[starts].tolist(), starts.tolist(), counts.tolist()):
+                end = start + min(count, limit)
+                result[int(block[query])] = (candidates[start:end], scores[start:end])
+
+        return result
+
+
+def neighbour_rows(matrix, neighbours):
+    for slot, (neighbour_slots, scores) in neighbours.items():
+        for rank, (neighbour, score) in enumerate(zip(neighbour_slots.tolist(), scores.tolist())):
+            yield RecipeNeighbour(
+                recipe_id=int(matrix.recipe_ids[slot]),
+                neighbour_id=int(matrix.recipe_ids[neighbour]),
+                rank=rank,
+                score=round(score, 4),
+            )
+
+
+def store(matrix, batches, recipe_ids=None):
+    """Replaces the neighbour rows of recipe_ids, or of every recipe when None, with batches of neighbour lists"""
+    with transaction.atomic():
+        existing = RecipeNeighbour.objects.all()
+        if recipe_ids is not None:
+            existing = existing.filter(recipe_id__in=recipe_ids)
+        existing.delete()
+
+        for neighbours in batches:
+            RecipeNeighbour.objects.bulk_create(neighbour_rows(matrix, neighbours), batch_size=BATCH_SIZE)
+
+
+def refresh_similar_recipes(full=False):
+    """
+    Recomputes neighbour lists for recipes changed since the last run, recipes listing them and
+    recipes they now list, so lists stay close to a full rebuild. Falls back to recomputing every
+    list on the first run or when the change log can't be replayed. Returns the recipes recomputed
+    """
+    latest = changelog.latest()
+    sequence = None if full else cache.get(SEQUENCE_KEY)
+
+    changed = None
+    if sequence is not None and sequence <= latest:
+        _, changed, complete = changelog.read(sequence, latest)
+        if not complete:
+            changed = None
+
+    if changed is not None and not changed:
+        cache.set(SEQUENCE_KEY, latest, timeout=None)
+        return 0
+
+    matrix = FeatureMatrix.load()
+    if changed is None:
+        slots = np.arange(len(matrix.recipe_ids))
+        store(matrix, (matrix.neighbours(slots[first:first + STORE_CHUNK]) for first in range(0, len(slots), STORE_CHUNK)))
+        recomputed = len(matrix.recipe_ids)
+    else:
+        # Lists that may now hold a stale score or a recipe that is gone
+        recipe_ids = set(changed) | set(
+            RecipeNeighbour.objects.filter(neighbour_id__in=changed).values_list("recipe_id", flat=True)
+        )
+        neighbours = matrix.neighbours([matrix.slots[recipe_id] for recipe_id in changed if recipe_id in matrix.slots])
+        # Similarity is symmetric, recipes the changed ones are now close to may need them in their lists
+        for neighbour_slots, _ in list(neighbours.values()):
+            recipe_ids.update(matrix.recipe_ids[neighbour_slots].tolist())
+
+        others = [matrix.slots[recipe_id] for recipe_id in recipe_ids - set(changed) if recipe_id in matrix.slots]
+        neighbours.update(matrix.neighbours(others))
+        store(matrix, [neighbours], recipe_ids)
+        recomputed = len(recipe_ids)
+
+    cache.set(SEQUENCE_KEY, latest, timeout=None)
+    return recomputed
@@ -1,82 +1,194 @@
 import re
 import requests
-import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from celery import shared_task
-from .models import Recipe, NutritionalValue
+from .models import Recipe, NutritionalValue, IngestionCursor
+from .persistence import bulk_upsert_recipes
+from .archive import store_response, load_response
+from .known_ids import CompleteRecipeIndex, MISSING_INGREDIENTS, MISSING_INSTRUCTIONS
+from .images import ImageError, mirror_remote_image, mirrorable, process_uploaded_image
 from django.conf import settings
-from datetime import date
-from django.core.cache import cache
+from django.db.models import F, Q
+from . import nutrition, quota, similar
 
-API_URL = "https://api.spoonacular.com/recipes/complexSearch"
-RECIPE_INFO_URL = "https://api.spoonacular.com/recipes/{id}/information"
+SEARCH_PATH = "/recipes/complexSearch"
+BULK_INFO_PATH = "/recipes/informationBulk"
 API_KEY = settings.SPOONACULAR_API_KEY
 
-@shared_task(bind=True, max_retries=3)
-def fetch_recipes(self, offset=0, batch_size=10):
-    """Fetches recipes from Spoonacular and saves them into DB"""
+# complexSearch accepts offsets up to 900, so at most 1000 results per query
+MAX_RESULTS = 1000
 
-    daily_limit = 50
+_session = None
 
-    # Prevent exceeding API call limit
-    today = date.today()
-    cache_key = f"spoonacular_calls_{today}"
 
-    try:
-        calls_used = cache.incr(cache_key)
-    except ValueError:
-        cache.set(cache_key, 1, 86400)
-        calls_used = 1
+def api_url(path):
+    return settings.SPOONACULAR_API_BASE_URL.rstrip("/") + path
 
-    if calls_used > daily_limit:
-        return f"Daily limit reached: {calls_used}/{daily_limit}"
 
-    recipes_per_call = 100
-    daily_limit = 50
+def get_session():
+    """
+    Returns a module-wide keep-alive session so detail fetches reuse pooled connections
+    """
+    global _session
 
-    #prevent reaching api call limit
-    today = date.today()
-    cache_key = f"spoonacular_calls_{today}"
-    calls_used = cache.get(cache_key, 0)
+    if _session is None:
+        pool_size = settings.SPOONACULAR_DETAIL_CONCURRENCY
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
 
-    if calls_used > daily_limit:
-        return f"Daily limit reached: {calls_used}/{daily_limit}"
+        _session = requests.Session()
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
 
-    params = {
+    return _session
+
+def get_query_sets():
+    """
+    Query sets walked by the ingestion cursor. complexSearch only pages through the first
+    MAX_RESULTS matches of a query, so the catalog is split up by dish type
+    """
+    return settings.SPOONACULAR_QUERY_SETS or [
+        {"type": value} for value, _ in Recipe.CATEGORY_CHOICES
+    ]
+
+def build_search_params(offset, batch_size=100, query=None, sort="popularity", sort_direction="desc"):
+    """Params for a complexSearch page"""
+    return {
         "apiKey": API_KEY,
         "offset": offset,
-        "number": 100,
+        "number": min(batch_size, 100),
         "addRecipeNutrition": True,
         "addRecipeInformation": True,
-        "sort": "random",
+        "sort": sort,
+        "sortDirection": sort_direction,
+        **(query or {}),
     }
 
+def cursor_sort(cursor):
+    """(sort, sort_direction) the cursor walks pages in, complexSearch's popularity order without one"""
+    if cursor is None:
+        return "popularity", "desc"
+    return cursor.sort, cursor.sort_direction
+
+@shared_task(bind=True, max_retries=3)
+def fetch_recipes(self, offset=None, batch_size=100, replay=False, query=None, follow=True):
+    """
+    Fetches recipes from Spoonacular and saves them into DB.
+    The next page comes from the persisted IngestionCursor unless an explicit offset and query are given.
+    With replay=True the page is read back from the local archive instead, without any API calls.
+    With follow=False the task does not queue the next page when it is done
+    """
+
+    if replay:
+        return replay_recipes(offset or 0, batch_size, query)
+
+    # Prevent exceeding API call limit
+    if not quota.reserve():
+        return f"Daily limit reached: {quota.calls_used()}/{quota.daily_limit()}"
+
+    claimed = False
+    try:
+        if offset is None:
+            cursor, query, offset = IngestionCursor.claim_page(get_query_sets(), batch_size)
+        else:
+            cursor = IngestionCursor.objects.filter(name="default").first()
+        claimed = True
+    finally:
+        # No call is made without a page, give the reserved call back
+        if not claimed:
+            quota.release()
+
+    sort, sort_direction = cursor_sort(cursor)
+    params = build_search_params(offset, batch_size, query, sort, sort_direction)
+
+    # Retries refetch the page this task claimed instead of claiming a new one
+    retry_kwargs = {"offset": offset, "batch_size": batch_size, "query": query, "follow": follow}
+
+    try:
+        response = get_session().get(api_url(SEARCH_PATH), params=params, timeout=10)
+    except requests.RequestException as exc:
+        # The call never reached the API, give the reserved call back
+        quota.release()
+        raise self.retry(exc=exc, countdown=20, kwargs=retry_kwargs)
+
     try:
-        response = requests.get(API_URL, params=params, timeout=10)
         response.raise_for_status()
     except requests.HTTPError as exc:
         if response.status_code == 402:
+            quota.exhaust()
             return f"You have depleted your free API calls. Please upgrade to premium"
-        raise self.retry(exc=exc, countdown=30)
+        raise self.retry(exc=exc, countdown=30, kwargs=retry_kwargs)
 
-    except requests.RequestException as exc:
-        raise self.retry(exc=exc, countdown=20)
+    payload = response.json()
+    store_response("complexSearch", params, payload)
 
-    data = response.json().get("results", [])
+    data = payload.get("results", [])
+    stored = Recipe.objects.filter(api_id__in=[item["id"] for item in data]).count()
 
-    # Only save recipes with complete information to prevent burning out api calls
-    saved_recipes = 0
-    for item in data:
-        if save_or_update_recipe(item):
-            saved_recipes += 1
+    # Recipes we already have complete cost neither a detail fetch nor a write
+    known = CompleteRecipeIndex.load()
+    saved_recipes = ingest_page(data, known=known)
 
     print(f"Saved {saved_recipes} out of {len(data)} recipes from offset {offset}.")
 
-    updated_calls = cache.get(cache_key, 0)
+    total = min(payload.get("totalResults", 0), MAX_RESULTS)
+    stats = {"fetched": len(data), "new": len(data) - stored, "saved": saved_recipes}
+    IngestionCursor.record_page(query or {}, offset, len(data), total, stats)
+
+    if follow and quota.remaining() > 0:
+        fetch_recipes.apply_async(kwargs={"batch_size": batch_size}, countdown=5)
+
+    return f"Successfully fetched {len(data)} recipes. Calls used: {quota.calls_used()}/{quota.daily_limit()}"
+
+def replay_recipes(offset=0, batch_size=100, query=None):
+    """Re-ingests an archived complexSearch page and chains to the next archived one"""
+    # Pages are archived under their params, sort included, so replay asks for the cursor's sort
+    sort, sort_direction = cursor_sort(IngestionCursor.objects.filter(name="default").first())
+    payload = load_response("complexSearch", build_search_params(offset, batch_size, query, sort, sort_direction))
+    if payload is None:
+        return f"No archived page for offset {offset}"
 
-    if updated_calls < daily_limit:
-        fetch_recipes.apply_async(args=[offset + batch_size], countdown=5)
+    data = payload.get("results", [])
+    saved_recipes = ingest_page(data, replay=True)
 
-    return f"Successfully fetched {len(data)} recipes. Calls used: {updated_calls}/{daily_limit}"
+    print(f"Replayed {saved_recipes} out of {len(data)} recipes from offset {offset}.")
+
+    next_offset = offset + batch_size
+    next_params = build_search_params(next_offset, batch_size, query, sort, sort_direction)
+    if load_response("complexSearch", next_params) is not None:
+        fetch_recipes.apply_async(args=[next_offset, batch_size], kwargs={"replay": True, "query": query})
+
+    return f"Successfully replayed {len(data)} recipes from offset {offset}"
+
+def ingest_page(data, replay=False, known=None):
+    """
+    Completes, normalizes and saves one page of API items. Returns the number of recipes saved.
+    With replay=True detailed info comes from the archive instead of the API.
+    Items already stored complete in the `known` CompleteRecipeIndex are skipped entirely
+    """
+    if known is not None:
+        data = [item for item in data if item["id"] not in known]
+
+    # Fetch details for every incomplete item up front, then save over the merged results
+    incomplete_ids = [item["id"] for item in data if needs_detailed_info(item)]
+    if replay:
+        detailed_infos = load_detailed_infos(incomplete_ids)
+    else:
+        detailed_infos = fetch_detailed_infos(incomplete_ids)
+
+    for item in data:
+        detailed_info = detailed_infos.get(item["id"])
+        if detailed_info:
+            merge_detailed_info(item, detailed_info)
+
+    # Only save recipes with complete information to prevent burning out api calls
+    normalized = [recipe for recipe in map(normalize_recipe, data) if recipe]
+    saved_recipes = bulk_upsert_recipes(normalized)
+
+    if known is not None:
+        known.update_from(normalized)
+
+    return len(saved_recipes)
 
 def clean_text(text):
     """
@@ -99,88 +211,168 @@ def clean_text(text):
 def fetch_detailed_info(recipe_id):
     """
     Fetch detailed recipe information from Spoonacular API.
-    The API_URL has limited information such as ingredietns. Therefore, if the info is not available, hit the second url
+    The search endpoint has limited information such as ingredietns. Therefore, if the info is not available, hit the bulk information url
+    """
+    return fetch_detailed_infos([recipe_id]).get(recipe_id)
+
+
+def fetch_bulk_info(recipe_ids):
+    """
+    Fetch detailed information for a chunk of recipes with a single informationBulk call.
+    Each recipe is archived on its own so replays can look it up by id
     """
 
     # Checks if API calls are still available
-    today = date.today()
-    cache_key = f"spoonacular_calls_{today}"
+    if not quota.reserve():
+        print(f"Daily API limit reached, cannot fetch detailed info for {len(recipe_ids)} recipes")
+        return []
+
+    params = {
+        "apiKey": API_KEY,
+        "ids": ",".join(str(recipe_id) for recipe_id in recipe_ids),
+        "includeNutrition": True,
+    }
 
-    calls_used = cache.get(cache_key, 0)
-    daily_limit = 50
-    
-    if calls_used >= daily_limit:
-        print(f"Daily API limit reached, cannot fetch detailed info for recipe {recipe_id}")
-        return None
-    
     try:
-        url = RECIPE_INFO_URL.format(id=recipe_id)
-        params = {
-            "apiKey": API_KEY,
-            "includeNutrition": True
-        }
+        response = get_session().get(api_url(BULK_INFO_PATH), params=params, timeout=10)
+    except requests.RequestException as e:
+        quota.release()
+        print(f"Error fetching detailed recipes: {e}")
+        return []
 
-        response = requests.get(url, params=params, timeout=5)
+    try:
         response.raise_for_status()
+        detailed_infos = response.json()
+    except requests.RequestException as e:
+        if response.status_code == 402:
+            quota.exhaust()
+        print(f"Error fetching detailed recipes: {e}")
+        return []
 
-        time.sleep(0.2)
+    for detailed_info in detailed_infos:
+        store_response("information", {"id": detailed_info["id"], "includeNutrition": True}, detailed_info)
+
+    return detailed_infos
 
-        return response.json()
-    except requests.RequestException as e:
-        print(f"Error fetching detailed recipe: {e}")
-        return None
 
+def fetch_detailed_infos(recipe_ids):
+    """
+    Fetch detailed information for several recipes, SPOONACULAR_BULK_CHUNK_SIZE ids per API call.
+    Chunks are fetched concurrently over the shared session.
+    Returns a dict of recipe id -> detailed info, leaving out recipes that could not be fetched
+    """
+    if not recipe_ids:
+        return {}
 
-def save_or_update_recipe(item):
-    """Extract recipe details and save to DB with fallback fetching"""
+    chunk_size = settings.SPOONACULAR_BULK_CHUNK_SIZE
+    chunks = [recipe_ids[i:i + chunk_size] for i in range(0, len(recipe_ids), chunk_size)]
 
-    recipe_id = item["id"]
-    
-    # Skip recipe if ingredient is missing
+    workers = min(settings.SPOONACULAR_DETAIL_CONCURRENCY, len(chunks))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(fetch_bulk_info, chunks)
+
+        return {
+            detailed_info["id"]: detailed_info
+            for detailed_infos in results
+            for detailed_info in detailed_infos
+        }
+
+
+def load_detailed_infos(recipe_ids):
+    """Archive counterpart of fetch_detailed_infos, used when replaying"""
+    detailed_infos = {}
+    for recipe_id in recipe_ids:
+        detailed_info = load_response("information", {"id": recipe_id, "includeNutrition": True})
+        if detailed_info:
+            detailed_infos[recipe_id] = detailed_info
+
+    return detailed_infos
+
+
+def get_missing_fields(item):
+    """Returns (missing_ingredients, missing_instructions, missing_nutrition) for an API item"""
     missing_ingredients = not item.get("extendedIngredients")
     missing_instructions = not item.get("analyzedInstructions") and not item.get("instructions")
     missing_nutrition = "nutrition" not in item
-    
-    if missing_ingredients or missing_instructions or missing_nutrition:
+
+    return missing_ingredients, missing_instructions, missing_nutrition
+
+
+def needs_detailed_info(item):
+    """Checks whether an API item needs a detail fetch to be complete"""
+    return any(get_missing_fields(item))
+
+
+def merge_detailed_info(item, detailed_info):
+    """Fills the missing fields of an API item in place from its detailed info"""
+    recipe_id = item["id"]
+    missing_ingredients, missing_instructions, missing_nutrition = get_missing_fields(item)
+
+    # Update ingredients if missing
+    if missing_ingredients and detailed_info.get("extendedIngredients"):
+        item["extendedIngredients"] = detailed_info["extendedIngredients"]
+        print(f"Found ingredients for recipe {recipe_id}")
+
+    # Update instructions if missing
+    if missing_instructions:
+        if detailed_info.get("analyzedInstructions") or detailed_info.get("instructions"):
+            if detailed_info.get("analyzedInstructions"):
+                item["analyzedInstructions"] = detailed_info["analyzedInstructions"]
+            if detailed_info.get("instructions"):
+                item["instructions"] = detailed_info["instructions"]
+            print(f"Found instructions for recipe {recipe_id}")
+
+    # Update nutrition if missing
+    if missing_nutrition and detailed_info.get("nutrition"):
+        item["nutrition"] = detailed_info["nutrition"]
+        print(f"Found nutrition info for recipe {recipe_id}")
+
+    # Update other fields that might be more complete in detailed info
+    for field in ["summary", "readyInMinutes", "servings", "image", "title"]:
+        if detailed_info.get(field) and (not item.get(field) or len(str(detailed_info[field])) > len(str(item.get(field, "")))):
+            item[field] = detailed_info[field]
+
+    return item
+
+
+def save_or_update_recipe(item, fetch_missing=True):
+    """
+    Extract recipe details and save to DB with fallback fetching.
+    Pass fetch_missing=False when the caller has already merged detailed info into the item
+    """
+
+    recipe_id = item["id"]
+
+    if fetch_missing and needs_detailed_info(item):
         print(f"Recipe {recipe_id} missing some information. Attempting to fetch...")
 
         detailed_info = fetch_detailed_info(recipe_id)
 
         if detailed_info:
-            # Update ingredients if missing
-            if missing_ingredients:
-                if detailed_info.get("extendedIngredients"):
-                    item["extendedIngredients"] = detailed_info["extendedIngredients"]
-                    missing_ingredients = False
-                    print(f"Found ingredients for recipe {recipe_id}")
-            
-            # Update instructions if missing
-            if missing_instructions:
-                if detailed_info.get("analyzedInstructions") or detailed_info.get("instructions"):
-                    if detailed_info.get("analyzedInstructions"):
-                        item["analyzedInstructions"] = detailed_info["analyzedInstructions"]
-                    if detailed_info.get("instructions"):
-                        item["instructions"] = detailed_info["instructions"]
-                    missing_instructions = False
-                    print(f"Found instructions for recipe {recipe_id}")
-            
-            # Update nutrition if missing
-            if missing_nutrition and detailed_info.get("nutrition"):
-                item["nutrition"] = detailed_info["nutrition"]
-                missing_nutrition = False
-                print(f"Found nutrition info for recipe {recipe_id}")
-            
-            # Update other fields that might be more complete in detailed info
-            for field in ["summary", "readyInMinutes", "servings", "image", "title"]:
-                if detailed_info.get(field) and (not item.get(field) or len(str(detailed_info[field])) > len(str(item.get(field, "")))):
-                    item[field] = detailed_info[field]
+            merge_detailed_info(item, detailed_info)
         else:
-            print("Could not fetch detailed information for {recipe_id}")
-    
+            print(f"Could not fetch detailed information for {recipe_id}")
+
+    normalized = normalize_recipe(item)
+    if normalized is None:
+        return False
+
+    saved = bulk_upsert_recipes([normalized])
+    # Nothing is written when the recipe didn't change
+    return saved[0] if saved else Recipe.objects.get(api_id=recipe_id)
+
+def normalize_recipe(item):
+    """
+    Converts a Spoonacular item into the fields stored on Recipe and NutritionalValue.
+    Returns None if the item is still missing critical information
+    """
+    recipe_id = item["id"]
+
     # Skip if still missing critical information
+    missing_ingredients, missing_instructions, _ = get_missing_fields(item)
     if missing_ingredients or missing_instructions:
         print(f"Skipping recipe {recipe_id}: Still missing critical information after detailed fetch")
-        return False 
+        return None
 
     # --- Category ---
     category = ["none"]
@@ -209,7 +401,7 @@ def save_or_update_recipe(item):
         (ing.get("original") or ing.get("name") or ing.get("originalString", "")).strip()
         for ing in raw_ingredients if ing
     ]
-    ingredients = "\n".join(ingredient_texts) if ingredient_texts else "Ingredients not available."
+    ingredient_texts = [text for text in ingredient_texts if text] or [MISSING_INGREDIENTS]
 
     # --- Instructions ---
     instructions = []
@@ -231,47 +423,44 @@ def save_or_update_recipe(item):
         else:
             # Split by sentences as fallback
             sentences = re.split(r'(?<=[.!?])\s+', clean)
+            instructions = [sentence.strip() for sentence in sentences if sentence.strip()]
 
         instructions = [re.sub(r'^\d+\.\s*', '', inst.strip()) for inst in instructions if inst.strip()]
     else:
-        instructions = ["No instructions available."]
+        instructions = [MISSING_INSTRUCTIONS]
 
-    instructions = "\n".join(instructions)
+    instructions = [step.replace("\n", " ").strip() for step in instructions if step.strip()]
 
     # --- Clean description ---
     description = clean_text(item.get("summary", ""))
 
-    # --- Save Recipe ---
-    recipe, _ = Recipe.objects.update_or_create(
-        api_id=item["id"],
-        defaults={
+    return {
+        "api_id": recipe_id,
+        "fields": {
             "title": item.get("title"),
             "category": category,
             "diet": diet,
             "cooking_time": item.get("readyInMinutes", 0),
             "image_url": item.get("image"),
-            "ingredients": ingredients,
+            "ingredients": "\n".join(ingredient_texts),
+            "ingredient_lines": ingredient_texts,
             "servings": item.get("servings", 0),
-            "instructions": instructions,
+            "instructions": "\n".join(instructions),
+            "instruction_steps": instructions,
             "description": description,
             "author": None,
         },
-    )
-
-    # --- Save Nutrition ---
-    if "nutrition" in item:
-        create_or_update_nutrition(recipe, item["nutrition"])
-
-    return recipe
+        "nutrition": normalize_nutrition(item["nutrition"]) if "nutrition" in item else None,
+    }
 
-def create_or_update_nutrition(recipe, nutrition_data):
-    """Create or update nutritional data in DB"""
+def normalize_nutrition(nutrition_data):
+    """Maps Spoonacular nutrients onto NutritionalValue fields"""
     nutrient_map = {
         item["name"].lower(): item["amount"]
         for item in nutrition_data.get("nutrients", [])
     }
 
-    defaults = {
+    return {
         "calories_kcal": nutrient_map.get("calories", 0.0),
         "protein": nutrient_map.get("protein", 0.0),
         "fat": nutrient_map.get("fat", 0.0),
@@ -285,8 +474,84 @@ def create_or_update_nutrition(recipe, nutrition_data):
         "vitamin_c": nutrient_map.get("vitamin c", 0.0),
     }
 
+def create_or_update_nutrition(recipe, nutrition_data):
+    """Create or update nutritional data in DB"""
     nutritional_value, _ = NutritionalValue.objects.update_or_create(
-        recipe=recipe, defaults=defaults
+        recipe=recipe, defaults=normalize_nutrition(nutrition_data)
     )
 
     return nutritional_value
+
+@shared_task(bind=True, max_retries=3)
+def mirror_recipe_image(self, recipe_id):
+    """Mirrors a recipe's remote image into MEDIA_ROOT as resized variants"""
+    recipe = (
+        Recipe.objects.filter(pk=recipe_id, api_id__isnull=False)
+        .only("id", "image", "image_url", "image_source").first()
+    )
+
+    # Only ingested recipes are mirrored, uploaded images take precedence and already mirrored
+    # urls are not downloaded again
+    if not recipe or recipe.image or not mirrorable(recipe.image_url) or recipe.image_source == recipe.image_url:
+        return f"Nothing to mirror for recipe {recipe_id}"
+
+    try:
+        updated = mirror_remote_image(recipe)
+    except requests.RequestException as exc:
+        raise self.retry(exc=exc, countdown=60)
+    except ImageError as exc:
+        # Not an image we can decode, mark it so it isn't picked up again
+        Recipe.objects.filter(pk=recipe_id).update(image_source=recipe.image_url)
+        print(f"Skipping image of recipe {recipe_id}: {exc}")
+        return f"Image of recipe {recipe_id} could not be processed"
+
+    if not updated:
+        return f"Image of recipe {recipe_id} changed before it was mirrored"
+
+    return f"Mirrored image of recipe {recipe_id}"
+
+@shared_task
+def mirror_pending_images(limit=200):
+    """Queues mirroring for ingested recipes whose remote image has no variants yet"""
+    hosts = Q()
+    for host in settings.RECIPE_IMAGE_HOSTS:
+        hosts |= Q(image_url__startswith=f"https://{host}/") | Q(image_url__startswith=f"http://{host}/")
+
+    recipe_ids = list(
+        Recipe.objects.filter(Q(image="") | Q(image__isnull=True), hosts, api_id__isnull=False)
+        .exclude(image_source=F("image_url"))
+        .values_list("id", flat=True)[:limit]
+    )
+
+    for recipe_id in recipe_ids:
+        mirror_recipe_image.delay(recipe_id)
+
+    return f"Queued {len(recipe_ids)} images for mirroring"
+
+@shared_task
+def process_recipe_image(recipe_id, name):
+    """Normalizes an uploaded recipe image and builds its variants, the original is served until then"""
+    try:
+        updated = process_uploaded_image(recipe_id, name)
+    except ImageError as exc:
+        print(f"Skipping uploaded image {name} of recipe {recipe_id}: {exc}")
+        return f"Image of recipe {recipe_id} could not be processed"
+
+    if not updated:
+        return f"Image of recipe {recipe_id} changed before {name} was processed"
+
+    return f"Processed image of recipe {recipe_id}"
+
+
+@shared_task
+def refresh_nutrition_index():
+    """Keeps the nutrition column store snapshot current, replaying only recipes changed since the last run"""
+    index = nutrition.refresh()
+    return f"Nutrition index holds {len(index.recipe_ids)} recipes"
+
+
+@shared_task
+def refresh_similar_recipes():
+    """Recomputes the content-based neighbour lists of recipes changed since the last run"""
+    recomputed = similar.refresh_similar_recipes()
+    return f"Recomputed similar recipes for {recomputed} recipes"
@@ -1,3 +1,900 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import random
+import tempfile
+import time
+from unittest import mock
+import numpy as np
+import requests
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from . import nutrition, pantry, quota, search, similar
+from .archive import archive_key, iter_records, load_response, store_response
+from .models import Recipe, NutritionalValue, IngestionCursor, RecipeNeighbour
+from .dedupe import minhash, shingles, similarity
+from .fake_spoonacular import FakeSpoonacular, make_recipe
+from .images import download_image, generate_variants, mirrorable, open_image, process_uploaded_image, source_key
+from .ingredients import parse_line
+from .known_ids import CompleteRecipeIndex
+from .persistence import NUTRITION_FIELDS, bulk_upsert_recipes
+from .tasks import build_search_params, fetch_detailed_infos, fetch_recipes, ingest_page, normalize_recipe, process_recipe_image, refresh_nutrition_index
 
-# Create your tests here.
+
+def make_normalized(api_id, title="Pancakes", calories=100.0):
+    """Builds a normalized recipe the way tasks.normalize_recipe does"""
+    return {
+        "api_id": api_id,
+        "fields": {
+            "title": title,
+            "category": ["breakfast"],
+            "diet": ["none"],
+            "cooking_time": 20,
+            "image_url": None,
+            "ingredients": "2 eggs\n1 cup flour",
+            "servings": 2,
+            "instructions": "1. Mix\n2. Fry",
+            "description": "",
+            "author": None,
+        },
+        "nutrition": {"calories_kcal": calories, "protein": 5.0},
+    }
+
+
+def make_detailed_info(recipe_id):
+    """A complete /information payload"""
+    return {
+        "id": recipe_id,
+        "title": f"Recipe {recipe_id}",
+        "extendedIngredients": [{"original": "2 eggs"}, {"original": "1 cup flour"}],
+        "analyzedInstructions": [{"steps": [{"number": 1, "step": "Mix everything."}]}],
+        "nutrition": {"nutrients": [{"name": "Calories", "amount": 320.0}]},
+        "readyInMinutes": 20,
+        "servings": 2,
+    }
+
+
+# In-process cache for tests going through the default cache, so they never need a live Redis
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def create_recipe(title, commit=False, nutrition=None, **fields):
+    """
+    Saves a recipe with the fewest fields that make it valid, keyword arguments override them.
+    With commit=True on_commit hooks run as if the test transaction committed, e.g. the change log
+    """
+    fields = {
+        "instructions": "1. Cook", "category": [], "diet": [], "servings": 2, "cooking_time": 10, **fields,
+    }
+    with TestCase.captureOnCommitCallbacks(execute=commit):
+        recipe = Recipe.objects.create(title=title, **fields)
+        if nutrition is not None:
+            NutritionalValue.objects.create(recipe=recipe, **nutrition)
+    return recipe
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LocalCacheTestCase(TestCase):
+    """TestCase whose recipe writes and reads go through an empty in-process cache"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+def fake_settings(fake):
+    return override_settings(
+        SPOONACULAR_API_BASE_URL=fake.url,
+        SPOONACULAR_ARCHIVE_ENABLED=False,
+        SPOONACULAR_BULK_CHUNK_SIZE=50,
+        CACHES=LOCMEM_CACHES,
+    )
+
+
+class BulkInfoBackfillTests(SimpleTestCase):
+    def test_ids_are_fetched_in_chunks(self):
+        """
+        Ensure missing details are resolved with one informationBulk call per chunk of ids.
+        """
+        with FakeSpoonacular(recipes=120) as fake, fake_settings(fake):
+            detailed_infos = fetch_detailed_infos(list(range(1, 121)))
+
+        bulk_calls = fake.calls_to("/recipes/informationBulk")
+        self.assertEqual(len(bulk_calls), 3)
+        self.assertEqual(len(fake.calls), 3)
+        self.assertEqual(sorted(detailed_infos), list(range(1, 121)))
+
+    @override_settings(
+        SPOONACULAR_BULK_CHUNK_SIZE=2,
+        SPOONACULAR_DETAIL_CONCURRENCY=3,
+        SPOONACULAR_ARCHIVE_ENABLED=False,
+        SPOONACULAR_DAILY_LIMIT=10,
+        CACHES=LOCMEM_CACHES,
+    )
+    def test_failed_chunk_releases_its_call(self):
+        """
+        Ensure concurrent chunks merge back in page order and a failing one only loses its own ids and call.
+        """
+        def get(url, params, timeout):
+            chunk = [int(recipe_id) for recipe_id in params["ids"].split(",")]
+            if chunk == [8, 1]:
+                raise requests.ConnectionError("Connection reset")
+            if chunk == [5, 3]:
+                # The first chunk of the page finishes last
+                time.sleep(0.05)
+            response = mock.Mock(status_code=200)
+            response.json.return_value = [{"id": recipe_id, "title": f"Recipe {recipe_id}"} for recipe_id in chunk]
+            return response
+
+        session = mock.Mock()
+        session.get.side_effect = get
+        quota.cache.clear()
+
+        with mock.patch("recipes.tasks.get_session", return_value=session):
+            detailed_infos = fetch_detailed_infos([5, 3, 8, 1, 9, 4])
+
+        chunks = sorted(call.kwargs["params"]["ids"] for call in session.get.call_args_list)
+        self.assertEqual(chunks, ["5,3", "8,1", "9,4"])
+        self.assertEqual(list(detailed_infos), [5, 3, 9, 4])
+        self.assertEqual(quota.remaining(), 8)
+
+
+class IngestPageTests(TestCase):
+    def test_incomplete_page_costs_one_detail_call(self):
+        """
+        Ensure a page with 30 incomplete items is backfilled with a single API call.
+        """
+        page = [{"id": recipe_id, "title": f"Recipe {recipe_id}"} for recipe_id in range(1, 31)]
+
+        with FakeSpoonacular(recipes=30) as fake, fake_settings(fake):
+            saved = ingest_page(page)
+
+        self.assertEqual(saved, 30)
+        self.assertEqual(len(fake.calls_to("/recipes/informationBulk")), 1)
+        self.assertEqual(Recipe.objects.count(), 30)
+        self.assertEqual(NutritionalValue.objects.count(), 30)
+
+    def test_known_complete_recipes_are_skipped(self):
+        """
+        Ensure recipes already stored complete cost neither a detail call nor a write.
+        """
+        page = [{"id": recipe_id, "title": f"Recipe {recipe_id}"} for recipe_id in range(1, 11)]
+
+        with FakeSpoonacular(recipes=10) as fake, fake_settings(fake):
+            ingest_page([dict(item) for item in page])
+            known = CompleteRecipeIndex.load()
+            self.assertEqual(len(known), 10)
+
+            with self.assertNumQueries(0):
+                saved = ingest_page([dict(item) for item in page], known=known)
+
+        self.assertEqual(saved, 0)
+        self.assertEqual(len(fake.calls_to("/recipes/informationBulk")), 1)
+
+
+class CompleteRecipeIndexTests(SimpleTestCase):
+    def test_membership(self):
+        """
+        Ensure the bitmap answers membership for added ids only.
+        """
+        index = CompleteRecipeIndex([3, 8, 1_100_000])
+        index.add(9)
+
+        self.assertIn(8, index)
+        self.assertIn(1_100_000, index)
+        self.assertNotIn(7, index)
+        self.assertNotIn(5_000_000, index)
+        self.assertEqual(len(index), 4)
+
+
+class ImportRecipesCommandTests(TestCase):
+    def test_imports_gzip_dump_and_resumes_from_line(self):
+        """
+        Ensure a gzip JSONL dump is imported in batches and can resume mid-file.
+        """
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = os.path.join(tmp_dir.name, "dump.jsonl.gz")
+
+        with gzip.open(path, "wt") as f:
+            for recipe_id in range(1, 8):
+                f.write(json.dumps(make_detailed_info(recipe_id)) + "\n")
+            f.write("not json\n")
+
+        call_command("import_recipes", path, "--batch-size", "3", "--start-line", "3", stdout=io.StringIO())
+
+        self.assertEqual(
+            sorted(Recipe.objects.values_list("api_id", flat=True)), [3, 4, 5, 6, 7]
+        )
+
+
+class BulkUpsertRecipesTests(TestCase):
+    def test_inserts_then_updates_on_api_id(self):
+        """
+        Ensure re-ingesting a batch updates rows in place and keeps their slugs.
+        """
+        bulk_upsert_recipes([make_normalized(1), make_normalized(2)])
+        slugs = set(Recipe.objects.values_list("slug", flat=True))
+        self.assertEqual(slugs, {"pancakes", "pancakes-1"})
+
+        bulk_upsert_recipes([make_normalized(1, title="Better Pancakes", calories=250.0)])
+
+        recipe = Recipe.objects.get(api_id=1)
+        self.assertEqual(Recipe.objects.count(), 2)
+        self.assertEqual(recipe.title, "Better Pancakes")
+        self.assertEqual(recipe.slug, "pancakes")
+        self.assertEqual(recipe.nutritional_value.calories_kcal, 250.0)
+        self.assertEqual(NutritionalValue.objects.count(), 2)
+
+    def test_unchanged_recipes_are_not_rewritten(self):
+        """
+        Ensure re-ingesting an unchanged batch writes nothing and only changed rows are updated.
+        """
+        bulk_upsert_recipes([make_normalized(1), make_normalized(2)])
+        updated_at = dict(Recipe.objects.values_list("api_id", "updated_at"))
+
+        with self.assertNumQueries(3):
+            self.assertEqual(bulk_upsert_recipes([make_normalized(1), make_normalized(2)]), [])
+
+        written = bulk_upsert_recipes([make_normalized(1), make_normalized(2, calories=900.0)])
+
+        self.assertEqual([recipe.api_id for recipe in written], [2])
+        self.assertEqual(Recipe.objects.get(api_id=1).updated_at, updated_at[1])
+        self.assertNotEqual(Recipe.objects.get(api_id=2).updated_at, updated_at[2])
+
+    def test_query_count_is_flat(self):
+        """
+        Ensure a batch costs the same number of queries regardless of its size.
+        """
+        with CaptureQueriesContext(connection) as small:
+            bulk_upsert_recipes([make_normalized(i) for i in range(1, 3)])
+        with CaptureQueriesContext(connection) as large:
+            bulk_upsert_recipes([make_normalized(i, title=f"Soup {i}") for i in range(10, 60)])
+
+        self.assertEqual(len(small), len(large))
+
+
+class IngestionCursorTests(TestCase):
+    def test_claims_advance_and_resume_from_the_db(self):
+        """
+        Ensure each claim hands out the next page and the position survives in the DB.
+        """
+        query_sets = [{"type": "dessert"}, {"type": "soup"}]
+
+        _, query, offset = IngestionCursor.claim_page(query_sets, 100)
+        self.assertEqual((query, offset), ({"type": "dessert"}, 0))
+
+        _, query, offset = IngestionCursor.claim_page(query_sets, 100)
+        self.assertEqual((query, offset), ({"type": "dessert"}, 100))
+        self.assertEqual(IngestionCursor.objects.get().offset, 200)
+
+    def test_moves_to_next_query_set_when_done(self):
+        """
+        Ensure a query set walked to the end is skipped and the last run is recorded.
+        """
+        query_sets = [{"type": "dessert"}, {"type": "soup"}]
+
+        _, query, offset = IngestionCursor.claim_page(query_sets, 100)
+        cursor = IngestionCursor.record_page(query, offset, 40, 40, {"fetched": 40})
+        self.assertEqual(cursor.last_run_stats["fetched"], 40)
+
+        _, query, offset = IngestionCursor.claim_page(query_sets, 100)
+        self.assertEqual((query, offset), ({"type": "soup"}, 0))
+
+    def test_replay_uses_the_cursor_sort(self):
+        """
+        Ensure replays look archived pages up with the sort the cursor fetched them in.
+        """
+        IngestionCursor.objects.create(name="default", sort="time", sort_direction="asc")
+
+        with tempfile.TemporaryDirectory() as tmp_dir, override_settings(SPOONACULAR_ARCHIVE_DIR=tmp_dir):
+            params = build_search_params(0, 100, {"type": "soup"}, "time", "asc")
+            store_response("complexSearch", params, {"results": []})
+
+            result = fetch_recipes(0, 100, replay=True, query={"type": "soup"})
+        self.assertEqual(result, "Successfully replayed 0 recipes from offset 0")
+
+
+class ResponseArchiveTests(SimpleTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.override = override_settings(SPOONACULAR_ARCHIVE_DIR=tmp_dir.name)
+        self.override.enable()
+        self.addCleanup(self.override.disable)
+
+    def test_key_ignores_api_key_and_param_order(self):
+        """
+        Ensure the archive key only depends on the endpoint and request params.
+        """
+        self.assertEqual(
+            archive_key("complexSearch", {"offset": 0, "number": 100, "apiKey": "a"}),
+            archive_key("complexSearch", {"number": "100", "offset": "0", "apiKey": "b"}),
+        )
+        self.assertNotEqual(
+            archive_key("complexSearch", {"offset": 0}),
+            archive_key("information", {"offset": 0}),
+        )
+
+    def test_store_and_load_round_trip(self):
+        """
+        Ensure archived payloads can be loaded back by params and iterated for replay.
+        """
+        payload = {"results": [{"id": 1, "title": "Pancakes"}]}
+        store_response("complexSearch", {"offset": 0, "apiKey": "secret"}, payload)
+
+        self.assertEqual(load_response("complexSearch", {"offset": 0}), payload)
+        self.assertIsNone(load_response("complexSearch", {"offset": 100}))
+
+        records = list(iter_records("complexSearch"))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["params"], {"offset": "0"})
+        self.assertNotIn("apiKey", records[0]["params"])
+
+
+@override_settings(
+    SPOONACULAR_DAILY_LIMIT=3,
+    CACHES=LOCMEM_CACHES,
+)
+class QuotaTests(SimpleTestCase):
+    def setUp(self):
+        quota.cache.clear()
+
+    def test_reserve_stops_at_daily_limit(self):
+        """
+        Ensure reservations never go past the daily limit and failed ones hold nothing.
+        """
+        self.assertTrue(quota.reserve(2))
+        self.assertFalse(quota.reserve(2))
+        self.assertEqual(quota.remaining(), 1)
+        self.assertTrue(quota.reserve())
+        self.assertEqual(quota.remaining(), 0)
+
+    def test_release_returns_unused_calls(self):
+        """
+        Ensure calls that never reached the API are given back to the budget.
+        """
+        quota.reserve()
+        quota.release()
+        self.assertEqual(quota.remaining(), 3)
+
+    def test_exhaust_spends_the_budget(self):
+        """
+        Ensure a 402 from the API stops every worker from reserving more calls.
+        """
+        quota.reserve()
+        quota.exhaust()
+        self.assertFalse(quota.reserve())
+
+        # A call still in flight when the API reported the quota gone doesn't reopen it
+        quota.release()
+        self.assertEqual(quota.remaining(), 0)
+        self.assertFalse(quota.reserve())
+
+    def test_failed_claim_releases_the_reservation(self):
+        """
+        Ensure a fetch that can't claim a page gives its reserved call back.
+        """
+        with mock.patch.object(IngestionCursor, "claim_page", side_effect=RuntimeError("database is down")):
+            with self.assertRaises(RuntimeError):
+                fetch_recipes()
+        self.assertEqual(quota.remaining(), 3)
+
+    def test_release_never_goes_below_zero(self):
+        """
+        Ensure releasing more than was reserved leaves the full budget, not more.
+        """
+        quota.reserve()
+        quota.release(2)
+        self.assertEqual(quota.remaining(), 3)
+        self.assertEqual(quota.cache.get(quota.claimed_key()), 0)
+
+
+class NearDuplicateTests(LocalCacheTestCase):
+    def test_signature_similarity(self):
+        """
+        Ensure near-identical ingredient lists score high and unrelated ones low.
+        """
+        pancakes = minhash(shingles("Pancakes", "2 cups flour\n2 eggs\n1 cup milk\n1 tbsp sugar"))
+        copy = minhash(shingles("Pancakes!", "2 1/2 cups flour\n3 eggs\n1 cup milk\n1 tbsp sugar"))
+        stew = minhash(shingles("Beef stew", "1 lb beef\n2 carrots\n1 onion"))
+
+        self.assertGreater(similarity(pancakes, copy), 0.9)
+        self.assertLess(similarity(pancakes, stew), 0.2)
+
+    def test_uploaded_copy_is_flagged(self):
+        """
+        Ensure a saved copy of an existing recipe points at the original and is left out of listings.
+        """
+        original = create_recipe("Pancakes", ingredients="2 cups flour\n2 eggs\n1 cup milk\n1 tbsp sugar")
+        copy = create_recipe("Pancakes", ingredients="2 cups flour\n3 eggs\n1 cup milk\n1 tbsp sugar")
+        other = create_recipe("Beef stew", ingredients="1 lb beef\n2 carrots\n1 onion")
+
+        copy.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(copy.duplicate_of, original)
+        self.assertIsNone(other.duplicate_of)
+
+        response = self.client.get("/api/recipes/")
+        self.assertNotIn(copy.id, [recipe["id"] for recipe in response.data["results"]])
+
+
+class ImageVariantTests(SimpleTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.override = override_settings(MEDIA_ROOT=tmp_dir.name, RECIPE_IMAGE_WIDTHS=[320, 640, 1024])
+        self.override.enable()
+        self.addCleanup(self.override.disable)
+
+    def make_image(self, width, height):
+        buffer = io.BytesIO()
+        Image.new("RGB", (width, height), (200, 120, 40)).save(buffer, "PNG")
+        return buffer.getvalue()
+
+    def test_variants_never_upscale(self):
+        """
+        Ensure only widths up to the original are generated, in both formats, with a placeholder.
+        """
+        fields = generate_variants(7, open_image(self.make_image(800, 400)), "recipes/7/original.jpg")
+
+        self.assertEqual(sorted(fields["image_variants"], key=int), ["320", "640"])
+        self.assertEqual((fields["image_width"], fields["image_height"]), (800, 400))
+        self.assertTrue(fields["image_placeholder"].startswith("data:image/jpeg;base64,"))
+
+        with default_storage.open(fields["image_variants"]["320"]["webp"]) as f:
+            variant = Image.open(f)
+            self.assertEqual((variant.format, variant.size), ("WEBP", (320, 160)))
+
+    def test_srcset_lists_variants_smallest_first(self):
+        """
+        Ensure templates get a srcset per format and fall back to the remote url without variants.
+        """
+        recipe = Recipe(image_url="https://img.example.com/1.jpg")
+        self.assertEqual(recipe.display_image_url(), "https://img.example.com/1.jpg")
+
+        image = open_image(self.make_image(1200, 800))
+        recipe.image_variants = generate_variants(1, image, recipe.image_url)["image_variants"]
+        directory = f"/media/recipes/variants/1/{source_key(recipe.image_url)}"
+        self.assertEqual(
+            recipe.webp_srcset(),
+            f"{directory}/320.webp 320w, {directory}/640.webp 640w, {directory}/1024.webp 1024w",
+        )
+        self.assertEqual(recipe.display_image_url(), f"{directory}/1024.jpg")
+
+    @override_settings(RECIPE_IMAGE_HOSTS=["img.spoonacular.com"])
+    def test_only_allowed_hosts_are_mirrored(self):
+        """
+        Ensure remote images are only fetched from the configured image hosts.
+        """
+        self.assertTrue(mirrorable("https://img.spoonacular.com/recipes/1-556x370.jpg"))
+        self.assertFalse(mirrorable("http://169.254.169.254/latest/meta-data/"))
+        self.assertFalse(mirrorable("https://img.spoonacular.com.example.com/1.jpg"))
+        self.assertFalse(mirrorable("file:///etc/passwd"))
+        self.assertFalse(mirrorable(None))
+
+        with self.assertRaises(ValueError):
+            download_image("http://localhost:6379/")
+
+    def test_upload_is_turned_upright(self):
+        """
+        Ensure EXIF orientation is applied and the result carries no EXIF data.
+        """
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotate 90 degrees clockwise to display
+        buffer = io.BytesIO()
+        Image.new("RGB", (400, 200)).save(buffer, "JPEG", exif=exif)
+
+        image = open_image(buffer.getvalue())
+        self.assertEqual(image.size, (200, 400))
+        self.assertNotIn(0x0112, image.getexif())
+
+
+class UploadedImageTests(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.override = override_settings(MEDIA_ROOT=tmp_dir.name, RECIPE_IMAGE_MAX_DIMENSION=1000)
+        self.override.enable()
+        self.addCleanup(self.override.disable)
+
+    def test_upload_is_processed_after_commit(self):
+        """
+        Ensure a new upload is queued once the recipe is committed and ends up capped with variants.
+        """
+        buffer = io.BytesIO()
+        Image.new("RGB", (3000, 1500)).save(buffer, "PNG")
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            recipe = Recipe.objects.create(
+                title="Chapati", servings=2, cooking_time=20, instructions="Cook.", category=[], diet=[],
+                image=SimpleUploadedFile("chapati.png", buffer.getvalue()),
+            )
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(recipe.image_variants, {})
+
+        name = recipe.image.name
+        process_recipe_image(recipe.pk, name)
+
+        recipe.refresh_from_db()
+        self.assertTrue(recipe.image.name.startswith(f"recipes/{recipe.pk}/"))
+        self.assertTrue(recipe.image.name.endswith(".jpg"))
+        self.assertFalse(default_storage.exists(name))
+        self.assertEqual((recipe.image_width, recipe.image_height), (1000, 500))
+        self.assertIn("640", recipe.image_variants)
+        self.assertEqual(recipe.image_source, recipe.image.name)
+
+    def upload(self, recipe, width):
+        buffer = io.BytesIO()
+        Image.new("RGB", (width, width // 2)).save(buffer, "PNG")
+        name = default_storage.save(f"recipes/upload-{width}.png", ContentFile(buffer.getvalue()))
+        Recipe.objects.filter(pk=recipe.pk).update(image=name)
+        return name
+
+    @override_settings(RECIPE_IMAGE_WIDTHS=[320, 640])
+    def test_late_upload_keeps_current_variants(self):
+        """
+        Ensure a task for an image that was replaced leaves the current variants alone and cleans up after itself.
+        """
+        recipe = create_recipe("Chapati")
+        stale = self.upload(recipe, 800)
+        current = self.upload(recipe, 1200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(process_uploaded_image(recipe.pk, current))
+        recipe.refresh_from_db()
+        variants = recipe.image_variants
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(process_uploaded_image(recipe.pk, stale))
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants, variants)
+        paths = [path for formats in variants.values() for path in formats.values()]
+        self.assertTrue(all(default_storage.exists(path) for path in paths))
+        directories, _ = default_storage.listdir(f"recipes/variants/{recipe.pk}")
+        self.assertEqual(directories, [source_key(recipe.image.name)])
+
+    @override_settings(RECIPE_IMAGE_WIDTHS=[320, 640])
+    def test_new_upload_replaces_old_variants(self):
+        """
+        Ensure processing a new upload deletes the previous variants, including widths it no longer has.
+        """
+        recipe = create_recipe("Chapati")
+        with self.captureOnCommitCallbacks(execute=True):
+            process_uploaded_image(recipe.pk, self.upload(recipe, 1200))
+        recipe.refresh_from_db()
+        old = [path for formats in recipe.image_variants.values() for path in formats.values()]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            process_uploaded_image(recipe.pk, self.upload(recipe, 400))
+
+        recipe.refresh_from_db()
+        self.assertEqual(list(recipe.image_variants), ["320"])
+        self.assertFalse(any(default_storage.exists(path) for path in old))
+        self.assertTrue(default_storage.exists(recipe.image_variants["320"]["webp"]))
+
+
+class SlugAllocationTests(LocalCacheTestCase):
+    def test_suffix_follows_highest_in_use(self):
+        """
+        Ensure slugs continue after the highest suffix and unrelated prefixes are not counted.
+        """
+        self.assertEqual(create_recipe("Chocolate cake").slug, "chocolate-cake")
+        self.assertEqual(create_recipe("Chocolate Cake!").slug, "chocolate-cake-1")
+        Recipe.objects.filter(slug="chocolate-cake-1").update(slug="chocolate-cake-41")
+        create_recipe("Chocolate cake roll")
+
+        self.assertEqual(create_recipe("Chocolate cake").slug, "chocolate-cake-42")
+        self.assertEqual(
+            Recipe.allocate_slugs(["Chocolate cake", "Pancakes", "chocolate cake"]),
+            ["chocolate-cake-43", "pancakes", "chocolate-cake-44"],
+        )
+
+    def test_overlong_numeric_suffix_is_ignored(self):
+        """
+        Ensure a title ending in a huge number doesn't break allocation for its base slug.
+        """
+        self.assertEqual(create_recipe("Pancakes 99999999999999999999").slug, "pancakes-99999999999999999999")
+        create_recipe("Pancakes")
+        self.assertEqual(Recipe.allocate_slugs(["Pancakes"]), ["pancakes-1"])
+
+    def test_allocation_cost_does_not_grow(self):
+        """
+        Ensure allocating a slug is a single query however many recipes share the title.
+        """
+        for _ in range(20):
+            create_recipe("Pancakes")
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Recipe.allocate_slugs(["Pancakes"]), ["pancakes-20"])
+
+
+class IngredientParserTests(SimpleTestCase):
+    def test_parse_line(self):
+        """
+        Ensure quantities, units and canonical names are split out of free-text lines.
+        """
+        self.assertEqual(parse_line("2 1/2 cups all-purpose flour, sifted"), (2.5, "cup", "all purpose flour"))
+        self.assertEqual(parse_line("3 large eggs"), (3.0, "", "egg"))
+        self.assertEqual(parse_line("400g canned tomatoes"), (400.0, "g", "tomato"))
+        self.assertEqual(parse_line("½ tsp ground cumin"), (0.5, "tsp", "ground cumin"))
+        self.assertEqual(parse_line("2-3 cloves garlic, minced"), (2.0, "clove", "garlic"))
+        self.assertEqual(parse_line("Salt (to taste)"), (None, "", "salt"))
+        self.assertIsNone(parse_line("Ingredients not available."))
+
+    def test_malformed_lines(self):
+        """
+        Ensure zero denominators give no quantity and names fit Ingredient.name.
+        """
+        self.assertEqual(parse_line("1 1/0 cup flour"), (None, "cup", "flour"))
+        self.assertEqual(parse_line("1/0 cup flour"), (None, "cup", "flour"))
+
+        name = parse_line("1 cup " + "very " * 60 + "flour").name
+        self.assertLessEqual(len(name), 200)
+        self.assertTrue(name.startswith("very very"))
+        self.assertFalse(name.endswith(" "))
+
+
+class IngredientFilterTests(LocalCacheTestCase):
+    def test_recipes_containing_all_ingredients(self):
+        """
+        Ensure comma-separated ingredients are ANDed and matched on whole words through the index.
+        """
+        curry = create_recipe("Curry", ingredients="1 lb chicken breast\n1 cup rice\n1 onion")
+        soup = create_recipe("Soup", ingredients="2 chicken thighs\n2 carrots")
+        create_recipe("Pilaf", ingredients="1 cup rice\n1 tbsp butter")
+
+        response = self.client.get("/api/recipes/", {"ingredient": "chicken, rice"})
+        self.assertEqual([recipe["id"] for recipe in response.data["results"]], [curry.id])
+
+        response = self.client.get("/api/recipes/", {"ingredient": "Chickens"})
+        self.assertEqual({recipe["id"] for recipe in response.data["results"]}, {curry.id, soup.id})
+
+        curry.ingredients = "1 cup rice"
+        curry.save()
+        response = self.client.get("/api/recipes/", {"ingredient": "chicken,rice"})
+        self.assertEqual(response.data["results"], [])
+
+
+class StructuredTextTests(SimpleTestCase):
+    def test_normalize_keeps_lists(self):
+        """
+        Ensure ingestion stores ingredient lines and steps as lists next to the joined text.
+        """
+        item = make_recipe(1, random.Random(0))
+        item["analyzedInstructions"] = []
+        item["instructions"] = "<p>Mix the batter. Fry until golden!</p>"
+
+        fields = normalize_recipe(item)["fields"]
+
+        self.assertEqual(fields["ingredient_lines"], [i["original"] for i in item["extendedIngredients"]])
+        self.assertEqual(fields["instruction_steps"], ["Mix the batter.", "Fry until golden!"])
+        self.assertEqual(fields["instructions"], "Mix the batter.\nFry until golden!")
+
+
+class ArrayFilterTests(TestCase):
+    def setUp(self):
+        def create(title, category, diet):
+            return Recipe.objects.create(
+                title=title, instructions="1. Cook", category=category, diet=diet, servings=2, cooking_time=10,
+            )
+
+        self.salad = create("Salad", ["salad", "side dish"], ["vegan", "gluten_free"])
+        self.bread = create("Bread", ["bread"], ["vegan"])
+        self.steak = create("Steak", ["main course"], ["carnivore", "gluten_free"])
+
+    def ids(self, **params):
+        response = self.client.get("/api/recipes/", params)
+        self.assertEqual(response.status_code, 200)
+        return {recipe["id"] for recipe in response.data["results"]}
+
+    def test_any_and_all_matching(self):
+        """
+        Ensure comma-separated categories and diets match any value by default and every value on request.
+        """
+        self.assertEqual(self.ids(category="bread,salad"), {self.salad.id, self.bread.id})
+        self.assertEqual(self.ids(diet="vegan,gluten_free"), {self.salad.id, self.bread.id, self.steak.id})
+        self.assertEqual(self.ids(diet="vegan,gluten_free", diet_match="all"), {self.salad.id})
+        self.assertEqual(self.ids(category="side dish", diet="gluten_free"), {self.salad.id})
+        self.assertEqual(self.client.get("/api/recipes/", {"diet_match": "some"}).status_code, 400)
+
+
+class FullTextSearchTests(LocalCacheTestCase):
+    def test_ranked_and_cached_results(self):
+        """
+        Ensure title matches outrank ingredient matches and cached results follow recipe changes.
+        """
+        stew = create_recipe("Beef stew", ingredients="1 lb beef\n2 carrots")
+        salad = create_recipe("Carrot salad", ingredients="3 carrots\n1 lemon")
+        create_recipe("Pancakes", ingredients="2 cups flour")
+
+        response = self.client.get("/api/recipes/", {"search": "Carrots"})
+        self.assertEqual([recipe["id"] for recipe in response.data["results"]], [salad.id, stew.id])
+
+        stew.ingredients = "1 lb beef\n2 potatoes"
+        with self.captureOnCommitCallbacks(execute=True):
+            stew.save()
+        self.assertEqual(search.ranked_ids("carrots"), [salad.id])
+
+        response = self.client.get("/api/recipes/search", {"q": "carrot"})
+        self.assertEqual(list(response.context["results"]), [salad])
+
+
+class SuggestTests(LocalCacheTestCase):
+    def test_prefix_and_misspelled_completions(self):
+        """
+        Ensure prefixes and misspellings complete to titles and ingredient names, prefix matches first.
+        """
+        cake = create_recipe("Chocolate cake", ingredients="200 g dark chocolate\n3 eggs")
+        create_recipe("Lemon tart", ingredients="2 lemons")
+
+        response = self.client.get("/api/recipes/suggest", {"q": "choc"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"][0], {"text": "Chocolate cake", "type": "recipe", "slug": cake.slug})
+        self.assertIn({"text": "dark chocolate", "type": "ingredient"}, response.data["results"])
+
+        response = self.client.get("/api/recipes/suggest", {"q": "lemmon"})
+        self.assertIn("Lemon tart", [suggestion["text"] for suggestion in response.data["results"]])
+
+    def test_suggestions_follow_recipe_changes(self):
+        """
+        Ensure a new recipe shows up in cached suggestions and short queries return nothing.
+        """
+        self.assertEqual(search.suggest("pancakes", 5), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            create_recipe("Pancakes")
+        self.assertEqual(search.suggest("pancakes", 5)[0]["text"], "Pancakes")
+
+        response = self.client.get("/api/recipes/suggest", {"q": "p"})
+        self.assertEqual(response.data["results"], [])
+
+
+class PantryMatchTests(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        pantry._index = None
+
+    def test_ranked_by_missing_then_coverage(self):
+        """
+        Ensure pantry matches put recipes with the fewest missing ingredients first.
+        """
+        fried_rice = create_recipe("Fried rice", commit=True, ingredients="2 cups rice\n2 eggs\n1 tbsp soy sauce")
+        omelette = create_recipe("Omelette", commit=True, ingredients="3 eggs\n1 pinch salt")
+        create_recipe("Pancakes", commit=True, ingredients="2 cups flour\n1 cup milk")
+
+        response = self.client.get("/api/recipes/pantry", {"ingredients": "eggs, rice, salt"})
+        self.assertEqual(response.status_code, 200)
+        results = [(result["recipe"]["id"], result["missing"]) for result in response.data["results"]]
+        self.assertEqual(results, [(omelette.id, 0), (fried_rice.id, 1)])
+
+    def test_index_follows_saves_and_deletes(self):
+        """
+        Ensure the in-memory index picks up edited and deleted recipes through the change log.
+        """
+        recipe = create_recipe("Garlic bread", commit=True, ingredients="1 loaf bread\n4 cloves garlic")
+        self.assertEqual([match[0] for match in pantry.match(["garlic"], 10)], [recipe.id])
+
+        recipe.ingredients = "1 loaf bread\n2 tbsp butter"
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        self.assertEqual(pantry.match(["garlic"], 10), [])
+        self.assertEqual([match[0] for match in pantry.match(["butter"], 10)], [recipe.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertEqual(pantry.match(["butter"], 10), [])
+
+
+class NutritionIndexTests(SimpleTestCase):
+    def setUp(self):
+        # Recipes 1-4: calories_kcal, protein, fat, carbs, the other fields stay 0
+        values = np.zeros((len(NUTRITION_FIELDS), 4), dtype=np.float32)
+        values[:4] = [[300, 600, 320, 900], [30, 10, 28, 40], [10, 30, 11, 50], [20, 80, 22, 90]]
+        self.index = nutrition.NutritionIndex(np.array([1, 2, 3, 4], dtype=np.int64), values)
+
+    def test_range_search(self):
+        """
+        Ensure ranges combine, open bounds work and ordering pages through the matches.
+        """
+        self.assertEqual(self.index.search({"calories_kcal": (None, 650)}, 10), (3, [1, 2, 3]))
+        self.assertEqual(self.index.search({"calories_kcal": (None, 650), "protein": (25, None)}, 10), (2, [1, 3]))
+        self.assertEqual(self.index.search({}, 2, 1, "-protein"), (4, [1, 3]))
+
+    def test_similar_macro_profile(self):
+        """
+        Ensure the nearest macro profiles come first and the recipe itself is left out.
+        """
+        self.assertEqual([recipe_id for recipe_id, _ in self.index.similar(1, 2)], [3, 2])
+        self.assertIsNone(self.index.similar(5, 2))
+
+
+class NutritionSearchTests(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.enterContext(override_settings(NUTRITION_INDEX_PATH=os.path.join(tmp_dir.name, "nutrition.npz")))
+
+    def test_endpoints_follow_refreshes(self):
+        """
+        Ensure both endpoints answer from the snapshot and a refresh picks up changed nutrition.
+        """
+        self.assertEqual(self.client.get("/api/recipes/nutrition-search").status_code, 503)
+
+        salad = create_recipe("Salad", commit=True, nutrition={"calories_kcal": 250, "protein": 8, "fat": 12, "carbs": 20})
+        steak = create_recipe("Steak", commit=True, nutrition={"calories_kcal": 600, "protein": 50, "fat": 40, "carbs": 2})
+        chicken = create_recipe("Chicken", commit=True, nutrition={"calories_kcal": 450, "protein": 45, "fat": 15, "carbs": 5})
+        refresh_nutrition_index()
+
+        response = self.client.get("/api/recipes/nutrition-search", {"protein_min": 40, "ordering": "calories_kcal"})
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual([recipe["id"] for recipe in response.data["results"]], [chicken.id, steak.id])
+
+        response = self.client.get(f"/api/recipes/{steak.id}/nutrition-similar", {"limit": 1})
+        self.assertEqual(response.data["results"][0]["recipe"]["id"], chicken.id)
+
+        nutritional_value = NutritionalValue.objects.get(recipe=salad)
+        nutritional_value.protein = 60
+        with self.captureOnCommitCallbacks(execute=True):
+            nutritional_value.save()
+        refresh_nutrition_index()
+
+        response = self.client.get("/api/recipes/nutrition-search", {"protein_min": 40})
+        self.assertEqual(response.data["count"], 3)
+
+
+class FeatureMatrixTests(SimpleTestCase):
+    def test_neighbours_by_cosine(self):
+        """
+        Ensure neighbours are ranked by cosine and recipes without shared features are left out.
+        """
+        rows = np.array([0, 0, 0, 1, 1, 1, 2, 2, 3, 3])
+        features = np.array([0, 1, 2, 0, 1, 3, 4, 5, 0, 4])
+        weights = 1 / np.sqrt(np.bincount(rows))[rows]
+        matrix = similar.FeatureMatrix(np.array([10, 11, 12, 13], dtype=np.int64), rows, features, weights, 6)
+
+        neighbours = matrix.neighbours([0, 2])
+        self.assertEqual(neighbours[0][0].tolist(), [1, 3])
+        self.assertAlmostEqual(neighbours[0][1][0], 2 / 3)
+        self.assertEqual(neighbours[2][0].tolist(), [3])
+
+
+@override_settings(SIMILAR_MAX_DF=1.0)
+class SimilarRecipesTests(LocalCacheTestCase):
+    def test_lists_refresh_for_changed_recipes(self):
+        """
+        Ensure the detail page and API show stored neighbours and an edited recipe gets new ones.
+        """
+        cake = create_recipe("Cake", commit=True, ingredients="2 cups flour\n3 eggs\n1 cup sugar", category=["dessert"])
+        muffins = create_recipe("Muffins", commit=True, ingredients="2 cups flour\n2 eggs\n1 cup blueberries", category=["dessert"])
+        curry = create_recipe("Curry", commit=True, ingredients="1 lb chicken\n1 can coconut milk", category=["main course"])
+        similar.refresh_similar_recipes(full=True)
+
+        response = self.client.get(f"/api/recipes/{cake.id}/similar")
+        self.assertEqual([result["recipe"]["id"] for result in response.data["results"]], [muffins.id])
+        response = self.client.get(f"/api/recipes/{cake.slug}/")
+        self.assertEqual(response.context["similar_recipes"], [muffins])
+
+        curry.ingredients = "1 lb chicken\n2 cups flour\n1 cup sugar"
+        curry.category = ["dessert"]
+        with self.captureOnCommitCallbacks(execute=True):
+            curry.save()
+        self.assertGreater(similar.refresh_similar_recipes(), 0)
+
+        self.assertIn(cake.id, RecipeNeighbour.objects.filter(recipe=curry).values_list("neighbour_id", flat=True))
+        self.assertIn(curry.id, RecipeNeighbour.objects.filter(recipe=cake).values_list("neighbour_id", flat=True))
+
+    def test_unknown_recipe_is_not_found(self):
+        """
+        Ensure the API answers 404 for recipes that don't exist or aren't ids.
+        """
+        self.assertEqual(self.client.get("/api/recipes/999999/similar").status_code, 404)
+        self.assertEqual(self.client.get("/api/recipes/abc/similar/").status_code, 404)
@@ -23,6 +23,13 @@ urlpatterns = [
     path("recipe/<slug:slug>/comment/<int:parent_id>/reply/", add_comment, name="add_reply"),
     path("recipe/<slug:slug>/comment/<int:comment_id>/delete/", delete_comment, name="delete_comment"),
 
+    # Before the detail route, which would take these names for slugs
+    path("suggest", RecipeViewSet.as_view({"get": "suggest"}), name="suggest"),
+    path("pantry", RecipeViewSet.as_view({"get": "pantry"}), name="pantry"),
+    path("top", RecipeViewSet.as_view({"get": "top"}), name="top"),
+    path("nutrition-search", RecipeViewSet.as_view({"get": "nutrition_search"}), name="nutrition-search"),
+    path("<int:pk>/nutrition-similar", RecipeViewSet.as_view({"get": "nutrition_similar"}), name="nutrition-similar"),
+    path("<int:pk>/similar", RecipeViewSet.as_view({"get": "similar"}), name="similar"),
     path("<slug:slug>/", recipe_detail, name="recipe_detail"),
     path("", include(router.urls)),
     path("search", search_recipes, name="search"),
@@ -1,14 +1,20 @@
+import logging
+import redis
 from rest_framework import viewsets, status, permissions, filters
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Recipe
+from .models import Recipe, RecipeNeighbour
+from ratings import leaderboard
 from ratings.models import Rating
-from django.db.models import Avg, Count, Case, When, FloatField
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from .serializers import RecipeSerializer
 from .filters import RecipeFilter
+from . import nutrition, pantry, search
+from .persistence import NUTRITION_FIELDS
 from .forms import AddRecipeForm
 from django.shortcuts import render, get_object_or_404
 from django.http import JsonResponse
@@ -21,24 +27,28 @@ from ratings.models import Rating
 from django.template.loader import render_to_string
 from django.shortcuts import render
 from django.http import JsonResponse
+from django.conf import settings
 from django.db import models
 from django.core.paginator import Paginator
 
 User = get_user_model()
 
+logger = logging.getLogger(__name__)
+
 def home(request):
-    base_queryset = Recipe.objects.annotate(
-        avg_rating=Case(
-            When(ratings__isnull=True, then=0.0),
-            default=Avg("ratings__rating"),
-            output_field=FloatField()
-        ),
-        total_ratings=Count("ratings")
-    )
+    base_queryset = Recipe.objects.filter(duplicate_of__isnull=True)
 
     queryset = base_queryset.order_by('-created_at')
-    # Sort by avg_rating DESC, but put 0.0-rated recipes LAST
-    top_recipes = base_queryset.order_by("-avg_rating", "-total_ratings")[:4]
+    try:
+        top_ids = [recipe_id for recipe_id, _ in leaderboard.top(4)]
+    except redis.RedisError:
+        logger.exception("Could not read the top-rated leaderboard")
+        top_ids = []
+    recipes_by_id = base_queryset.in_bulk(top_ids)
+    top_recipes = [recipes_by_id[recipe_id] for recipe_id in top_ids if recipe_id in recipes_by_id]
+    if not top_recipes:
+        # Nothing ranked before the first rebuild or Redis is down, unrated recipes have an avg_rating of 0.0
+        top_recipes = base_queryset.order_by("-avg_rating", "-rating_count")[:4]
 
     paginator = Paginator(queryset, 4)
     recipes = paginator.get_page(request.GET.get("page"))
@@ -55,9 +65,19 @@ def search_recipes(request):
     query = request.GET.get("q", "")
     results = []
     if query:
-        results = Recipe.objects.filter(title__icontains=query)
+        # Ranked full-text matches, the id list is cached per normalized query
+        results = search.search_page(query, request.GET.get("page"))
     return render(request, 'recipes/search_list.html', {"results": results, "query": query})
 
+def similar_recipes(recipe):
+    """The precomputed neighbour list of a recipe, one query on the (recipe, rank) index"""
+    neighbours = (
+        RecipeNeighbour.objects.filter(recipe=recipe, neighbour__duplicate_of__isnull=True)
+        .select_related("neighbour")
+        .order_by("rank")
+    )
+    return [neighbour.neighbour for neighbour in neighbours]
+
 def recipe_detail(request, slug):
     """
     Renders the details for each recipe
@@ -69,15 +89,8 @@ def recipe_detail(request, slug):
     comments = recipe.comments.select_related('author').order_by('-created_at')
     comment_form = CommentForm()
 
-    # Split by new lines
-    ingredients = recipe.ingredients.split("\n") if recipe.ingredients else []
-    instructions = recipe.instructions.split("\n") if recipe.instructions else []
-
-    # Clean up empty strings and whitespace
-    ingredients = [ing.strip() for ing in ingredients if ing.strip()]
-    instructions = [inst.strip() for inst in instructions if inst.strip()]
-
-    return render(request, "recipes/recipe_detail.html", {"recipe": recipe, "nut_v": nut_v, "ingredients": ingredients, "instructions": instructions, "comments": comments, "comment_form": comment_form},)
+    # Lines and steps were split when the recipe was saved
+    return render(request, "recipes/recipe_detail.html", {"recipe": recipe, "nut_v": nut_v, "ingredients": recipe.ingredient_lines, "instructions": recipe.instruction_steps, "comments": comments, "comment_form": comment_form, "similar_recipes": similar_recipes(recipe)},)
 
 def upload_recipe(request):
     """
@@ -247,16 +260,16 @@ def rate_recipe(request, slug):
                 defaults={"rating": value},
             )
 
-            avg_rating = recipe.ratings.aggregate(avg=Avg("rating"))["avg"] or 0.0
-            total_ratings = recipe.ratings.count()
+            # The aggregates were updated along with the rating
+            recipe.refresh_from_db(fields=["avg_rating", "rating_count"])
 
             # Use Json Format for the response instead of html
             return JsonResponse({
                 "success": True,
                 "message": f"Recipe rated Successfully",
                 "new_rating": value,
-                "avg_rating": round(avg_rating, 1),
-                "total_ratings": total_ratings,
+                "avg_rating": round(recipe.avg_rating, 1),
+                "total_ratings": recipe.rating_count,
             });
 
         except (ValueError, TypeError):
@@ -297,14 +310,23 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
 
 class RecipeViewSet(viewsets.ModelViewSet):
     """Viewset to handle recipe CRUD"""
-    queryset = Recipe.objects.annotate(avg_rating=Avg('ratings__rating'), total_ratings=Count('ratings')).select_related("author", "nutritional_value")
+    queryset = Recipe.objects.select_related("author", "nutritional_value")
     serializer_class = RecipeSerializer
-    filter_backends = [DjangoFilterBackend]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_class = RecipeFilter
+    ordering_fields = ["avg_rating", "rating_count", "created_at", "cooking_time", "prep_time"]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        # Near-duplicates stay reachable by id but are left out of listings
+        if self.action == "list":
+            queryset = queryset.filter(duplicate_of__isnull=True)
+        return queryset
 
     def get_permissions(self):
         #viewing(list) open to public
-        if self.action in ["list", "retrieve"]:
+        if self.action in ["list", "retrieve", "suggest", "pantry", "nutrition_search", "nutrition_similar", "similar", "top"]:
             return [permissions.AllowAny()]
 
         #other crud 
@@ -312,3 +334,160 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
+
+    @action(detail=False, methods=["get"])
+    def suggest(self, request):
+        """Autocomplete for the search box: /api/recipes/suggest?q=chick&limit=5"""
+        try:
+            limit = int(request.query_params.get("limit", settings.SUGGEST_LIMIT))
+        except ValueError:
+            limit = settings.SUGGEST_LIMIT
+        limit = min(max(limit, 1), settings.SUGGEST_MAX_LIMIT)
+
+        query = request.query_params.get("q", "")
+        return Response({"query": query, "results": search.suggest(query, limit)})
+
+    @action(detail=False, methods=["get"])
+    def pantry(self, request):
+        """
+        Recipes to cook from what is at hand: /api/recipes/pantry?ingredients=chicken,rice&max_missing=3
+        Fewest missing ingredients first, then by the share of the recipe's ingredients covered
+        """
+        ingredients = [term.strip() for term in request.query_params.get("ingredients", "").split(",") if term.strip()]
+        try:
+            limit = self.page_limit(settings.PANTRY_LIMIT, settings.PANTRY_MAX_LIMIT)
+            max_missing = request.query_params.get("max_missing")
+            max_missing = int(max_missing) if max_missing else None
+        except ValueError:
+            return Response({"error": "limit and max_missing must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        matches = pantry.match(ingredients, limit, max_missing) if ingredients else []
+        recipes = self.get_queryset().in_bulk([recipe_id for recipe_id, *_ in matches])
+
+        results = []
+        for recipe_id, matched, missing, coverage in matches:
+            if recipe_id in recipes:
+                results.append({
+                    "recipe": self.get_serializer(recipes[recipe_id]).data,
+                    "matched": matched,
+                    "missing": missing,
+                    "coverage": round(coverage, 3),
+                })
+        return Response({"ingredients": ingredients, "results": results})
+
+    def page_limit(self, default, maximum):
+        limit = int(self.request.query_params.get("limit", default))
+        return min(max(limit, 1), maximum)
+
+    def in_order(self, recipe_ids):
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        return [recipes[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes]
+
+    @action(detail=False, methods=["get"])
+    def top(self, request):
+        """
+        Top-rated recipes by Bayesian average, overall or within one category or diet:
+        /api/recipes/top?category=dessert&limit=10
+        """
+        category = request.query_params.get("category")
+        diet = request.query_params.get("diet")
+        if category and diet:
+            return Response({"error": "Pass either category or diet, not both"}, status=status.HTTP_400_BAD_REQUEST)
+        if category and category not in dict(Recipe.CATEGORY_CHOICES):
+            return Response({"error": f"Unknown category: {category}"}, status=status.HTTP_400_BAD_REQUEST)
+        if diet and diet not in dict(Recipe.DIET_CHOICES):
+            return Response({"error": f"Unknown diet: {diet}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = self.page_limit(settings.LEADERBOARD_LIMIT, settings.LEADERBOARD_MAX_LIMIT)
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            ranked = leaderboard.top(limit, category, diet)
+        except redis.RedisError:
+            logger.exception("Could not read the top-rated leaderboard")
+            return Response({"error": "The leaderboard is unavailable"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        scores = dict(ranked)
+        # Recipes merged as near-duplicates since they were ranked stay out until the next rebuild
+        recipes = [recipe for recipe in self.in_order([recipe_id for recipe_id, _ in ranked]) if recipe.duplicate_of_id is None]
+        return Response({
+            "results": [
+                {"recipe": self.get_serializer(recipe).data, "score": round(scores[recipe.pk], 3)}
+                for recipe in recipes
+            ],
+        })
+
+    @action(detail=True, methods=["get"])
+    def similar(self, request, pk=None):
+        """Recipes with similar ingredients, category and diet: /api/recipes/42/similar"""
+        recipe = self.get_object()
+        neighbours = (
+            RecipeNeighbour.objects.filter(recipe=recipe, neighbour__duplicate_of__isnull=True)
+            .select_related("neighbour__author", "neighbour__nutritional_value")
+            .order_by("rank")
+        )
+        return Response({
+            "results": [
+                {"recipe": self.get_serializer(neighbour.neighbour).data, "score": neighbour.score}
+                for neighbour in neighbours
+            ],
+        })
+
+    @action(detail=False, methods=["get"], url_path="nutrition-search")
+    def nutrition_search(self, request):
+        """
+        Recipes within nutrition ranges, any field of NutritionalValue as {field}_min / {field}_max:
+        /api/recipes/nutrition-search?calories_kcal_max=600&protein_min=30&ordering=-protein
+        """
+        index = nutrition.current()
+        if index is None:
+            return Response({"error": "The nutrition index is not built yet"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        ordering = request.query_params.get("ordering") or None
+        if ordering and ordering.lstrip("-") not in NUTRITION_FIELDS:
+            return Response({"error": f"Unknown ordering {ordering}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            ranges = {}
+            for field in NUTRITION_FIELDS:
+                low = request.query_params.get(f"{field}_min")
+                high = request.query_params.get(f"{field}_max")
+                if low or high:
+                    ranges[field] = (float(low) if low else None, float(high) if high else None)
+            limit = self.page_limit(settings.NUTRITION_LIMIT, settings.NUTRITION_MAX_LIMIT)
+            offset = max(int(request.query_params.get("offset", 0)), 0)
+        except ValueError:
+            return Response({"error": "Ranges, limit and offset must be numbers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        count, recipe_ids = index.search(ranges, limit, offset, ordering)
+        return Response({
+            "count": count,
+            "results": self.get_serializer(self.in_order(recipe_ids), many=True).data,
+        })
+
+    @action(detail=True, methods=["get"], url_path="nutrition-similar")
+    def nutrition_similar(self, request, pk=None):
+        """Recipes with the closest calories, macros, fiber and sugars: /api/recipes/42/nutrition-similar?limit=5"""
+        recipe = self.get_object()
+        index = nutrition.current()
+        if index is None:
+            return Response({"error": "The nutrition index is not built yet"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        try:
+            limit = self.page_limit(settings.NUTRITION_LIMIT, settings.NUTRITION_MAX_LIMIT)
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        neighbours = index.similar(recipe.pk, limit)
+        if neighbours is None:
+            return Response({"error": "This recipe has no nutrition data"}, status=status.HTTP_404_NOT_FOUND)
+
+        distances = dict(neighbours)
+        recipes = self.in_order([recipe_id for recipe_id, _ in neighbours])
+        return Response({
+            "results": [
+                {"recipe": self.get_serializer(similar).data, "distance": round(distances[similar.pk], 4)}
+                for similar in recipes
+            ],
+        })